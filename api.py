@@ -0,0 +1,621 @@
+import errno
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Optional
+
+from config import Config
+from errors import (
+    ContainsSourceDirectory,
+    CustomFileException,
+    GroupEscapesSource,
+    InsideSourceDirectory,
+    InvalidSetting,
+    LinkingError,
+    MoveFailed,
+    NoMatches,
+    NoOwner,
+    NotInSourceDirectory,
+    NotMovedBack,
+    OriginNotRemoved,
+    RelinkFailed,
+)
+from linker import LinkData, link, unlink_entry
+from patterns import PatternSet
+from spans import span
+from utils import absolute_path, get_home_dir
+
+# The farm as a library. Farm methods return result objects and raise the
+# exceptions in errors.py instead of printing and exiting, so one process can
+# run any number of operations against one loaded config. CommandProcessor
+# renders these results for the command line.
+
+if TYPE_CHECKING:
+    from planner import Plan
+    from status import Report
+
+# called with the path being moved, returns a mover progress callback or None
+ProgressFactory = Callable[[Path], Optional[Callable[[int, int], None]]]
+
+
+@dataclass
+class Added:
+    origin: Path
+    source: Path
+    already_linked: bool = False
+    unfolded: list[str] = field(default_factory=list)
+
+
+@dataclass
+class AddOutcome:
+    origin: Path
+    # where it now lives in the farm, None when it wasn't added
+    source: Optional[Path] = None
+    error: Optional[Exception] = None
+    unfolded: list[str] = field(default_factory=list)
+
+
+@dataclass
+class Regrouped:
+    old: str
+    new: str
+    relinked: Optional[Path] = None
+    unfolded: list[str] = field(default_factory=list)
+    removed_groups: list[Path] = field(default_factory=list)
+
+
+@dataclass
+class DsymEntry:
+    source: Path
+    target: Path
+    # the target exists and is not a symlink, nothing was moved
+    skipped: bool = False
+    removed_groups: list[Path] = field(default_factory=list)
+
+
+@dataclass
+class Dsymed:
+    entries: list[DsymEntry] = field(default_factory=list)
+    unfolded: list[str] = field(default_factory=list)
+
+    @property
+    def restored(self) -> list[DsymEntry]:
+        return [entry for entry in self.entries if not entry.skipped]
+
+
+@dataclass
+class LinkOutcome:
+    source: Path
+    target: Path
+    data: LinkData
+
+
+@dataclass
+class LinkResult:
+    # entries that were checked, in config order; fresh and folded ones aren't
+    outcomes: list[LinkOutcome] = field(default_factory=list)
+    folded: list[tuple[str, str]] = field(default_factory=list)
+    unfolded: list[str] = field(default_factory=list)
+    total: int = 0
+
+    @property
+    def linked(self) -> list[LinkOutcome]:
+        return [o for o in self.outcomes if o.data.error is None and not o.data.already_linked]
+
+    @property
+    def failed(self) -> list[LinkOutcome]:
+        return [o for o in self.outcomes if o.data.error is not None]
+
+    @property
+    def already_linked(self) -> int:
+        """entries the index or a fold vouched for count as already linked too"""
+        return self.total - len(self.linked) - len(self.failed)
+
+
+@dataclass
+class UnlinkResult:
+    # (fold or source, None or why it couldn't be unlinked), in order
+    folds: list[tuple[str, Optional[OSError]]] = field(default_factory=list)
+    outcomes: list[tuple[Path, Optional[LinkingError]]] = field(default_factory=list)
+    unfolded: list[str] = field(default_factory=list)
+
+    @property
+    def failed(self) -> list[tuple[Path, LinkingError]]:
+        return [(path, error) for path, error in self.outcomes if error is not None]
+
+
+@dataclass
+class PushResult:
+    # `success`, `up-to-date`, `blocked`, `error` or the git push status
+    result: str
+    attempts: int
+    changed_files: Optional[int]
+    violations: int
+
+
+def _make_parent_dirs(parents: set[Path], jobs: int) -> set[Path]:
+    from concurrent.futures import ThreadPoolExecutor
+
+    def make(parent: Path) -> Optional[Path]:
+        try:
+            parent.mkdir(parents=True, exist_ok=True)
+            return parent
+        except OSError:
+            return None
+
+    # sorted so nested parents are usually created by their ancestor first
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        created = pool.map(make, sorted(parents))
+    return {parent for parent in created if parent is not None}
+
+
+def _link_parallel(pairs: list[tuple[Path, Path]], jobs: int) -> list[LinkData]:
+    from concurrent.futures import ThreadPoolExecutor
+
+    # only for links link() will create, a missing source or a conflict
+    # leaves nothing behind just like a sequential run
+    ready = _make_parent_dirs(
+        {
+            target.parent
+            for source, target in pairs
+            if source.exists() and not os.path.lexists(target)
+        },
+        jobs,
+    )
+
+    # parents that failed to be created fall back to link's own mkdir so the
+    # error is reported the same way as a sequential run
+    def run(pair: tuple[Path, Path]) -> LinkData:
+        source, target = pair
+        return link(source, target, make_parents=target.parent not in ready)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(run, pairs))
+
+
+def _free_path(directory: Path, name: str) -> Path:
+    """directory/name, or the first of stem_1.suffix, stem_2.suffix... that is free"""
+    path = directory / name
+    stem, suffix = Path(name).stem, Path(name).suffix
+    counter = 1
+    while path.exists():
+        path = directory / f"{stem}_{counter}{suffix}"
+        counter += 1
+    return path
+
+
+def _free_name(name: str, taken: set[str]) -> str:
+    """the first of name, stem_1.suffix, stem_2.suffix... not in `taken`, which it joins"""
+    if name not in taken:
+        taken.add(name)
+        return name
+    path = Path(name)
+    counter = 1
+    while f"{path.stem}_{counter}{path.suffix}" in taken:
+        counter += 1
+    name = f"{path.stem}_{counter}{path.suffix}"
+    taken.add(name)
+    return name
+
+
+def _check_group(group: Optional[str]) -> None:
+    if group and ".." in group.split("/"):
+        raise GroupEscapesSource(Path(group))
+
+
+class _Batch:
+    def __init__(self, farm: "Farm"):
+        self.farm = farm
+        self.autosave = farm.autosave
+
+    def __enter__(self) -> "Farm":
+        self.farm.autosave = False
+        return self.farm
+
+    def __exit__(self, *exc) -> None:
+        self.farm.autosave = self.autosave
+        if self.farm.dirty:
+            self.farm.save()
+
+
+class Farm:
+    """
+    A source directory and its config. Every change is written to the config
+    as it is made unless `autosave` is off; `batch` writes once for a block.
+    """
+
+    def __init__(self, config: Optional[Config] = None, autosave: bool = True):
+        self.config = config if config is not None else Config.load()
+        self.autosave = autosave
+        self.dirty = False
+        self.progress: Optional[ProgressFactory] = None
+
+    @property
+    def source_dir(self) -> Path:
+        return Config.get_source_directory()
+
+    def save(self) -> None:
+        self.config.write()
+        self.dirty = False
+
+    def batch(self) -> _Batch:
+        """a context manager that writes the config once, when the block ends"""
+        return _Batch(self)
+
+    def _changed(self) -> None:
+        self.dirty = True
+        if self.autosave:
+            self.save()
+
+    def _move(self, origin: Path, dest: Path, jobs: int = 8) -> None:
+        from mover import move
+
+        # progress lines from several moves at once would only garble each other
+        progress = self.progress(origin) if self.progress and jobs > 1 else None
+        # a failed move leaves the original where it was, never delete it here
+        try:
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            move(origin.absolute(), dest.absolute(), jobs=jobs, progress=progress)
+        except OSError as e:
+            raise MoveFailed(origin.absolute(), dest.absolute(), e) from e
+
+    def _move_and_link(self, origin: Path, dest: Path, jobs: int = 8) -> None:
+        """moves `origin` to `dest` and links it back, putting it back if that fails"""
+        self._move(origin, dest, jobs)
+        data = link(dest, origin)
+        if data.error is None:
+            return
+        # put it back rather than leave it orphaned in the source directory
+        try:
+            self._move(dest, origin, jobs)
+        except (MoveFailed, OriginNotRemoved) as e:
+            raise NotMovedBack(origin, dest, data.error) from e
+        raise data.error
+
+    def _unfold_around(self, targets: list[str]) -> list[str]:
+        from folding import unfold_around
+
+        return unfold_around(os.path.abspath(self.source_dir), targets)
+
+    def _take_out_of_fold(self, path: Path) -> list[str]:
+        """
+        Unfolds every fold `path` lies under. Something written through a fold
+        landed in the source directory without an entry; it is moved back to
+        `path` so it can be added like anything else. Returns the unfolded
+        directories.
+        """
+        if not os.path.lexists(path):
+            return []
+        unfolded = self._unfold_around([str(path)])
+        if str(path.parent) not in unfolded or not path.is_symlink():
+            return unfolded
+
+        real_source_dir = os.path.realpath(self.source_dir)
+        source = os.path.realpath(path)
+        if not source.startswith(real_source_dir + os.sep):
+            return unfolded
+        if os.path.relpath(source, real_source_dir) in self.config.paths:
+            return unfolded
+        path.unlink()
+        try:
+            self._move(Path(source), path)
+        except MoveFailed:
+            path.symlink_to(source)
+            raise
+        return unfolded
+
+    def _cleanup_empty_groups(self, source_rel: str) -> list[Path]:
+        removed: list[Path] = []
+        parent = Path(source_rel).parent
+        while parent != Path("."):
+            group_dir = self.source_dir / parent
+            if not group_dir.exists() or any(group_dir.iterdir()):
+                break
+            try:
+                group_dir.rmdir()
+            except OSError:
+                break
+            removed.append(group_dir)
+            parent = parent.parent
+        return removed
+
+    def add(self, path, group: Optional[str] = None) -> Added:
+        """moves `path` into the farm, under `group` if given, and links it back"""
+        path = absolute_path(path)
+        source_dir = self.source_dir
+        _check_group(group)
+        unfolded = self._take_out_of_fold(path)
+        if path.resolve().is_relative_to(source_dir.resolve()):
+            raise InsideSourceDirectory(path, source_dir)
+
+        dest_dir = source_dir / group if group else source_dir
+        if group:
+            dest_dir.mkdir(parents=True, exist_ok=True)
+        source_path = dest_dir / path.name
+        if source_path.resolve() == path.resolve():
+            return Added(path, source_path, already_linked=True, unfolded=unfolded)
+        source_path = _free_path(dest_dir, path.name)
+
+        self._move_and_link(path, source_path)
+        self.config.add_to_paths(str(source_path.relative_to(source_dir)), str(path))
+        self._changed()
+        return Added(path, source_path, unfolded=unfolded)
+
+    def add_many(self, paths, group: Optional[str] = None, jobs: int = 8) -> list[AddOutcome]:
+        """
+        Adds every path in one pass: destination names are picked against one
+        listing of the destination directory, the moves and links run on `jobs`
+        threads and the config is changed once. Paths that fail carry their
+        error and don't stop the others.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        source_dir = self.source_dir
+        _check_group(group)
+        dest_dir = source_dir / group if group else source_dir
+        dest_dir.mkdir(parents=True, exist_ok=True)
+
+        resolved_source = source_dir.resolve()
+        taken = set(os.listdir(dest_dir))
+        outcomes: list[AddOutcome] = []
+        pending: list[tuple[AddOutcome, Path]] = []
+        for path in paths:
+            outcome = AddOutcome(absolute_path(path))
+            outcomes.append(outcome)
+            path = outcome.origin
+            try:
+                outcome.unfolded = self._take_out_of_fold(path)
+            except (MoveFailed, OriginNotRemoved) as e:
+                outcome.error = e
+                continue
+            if not os.path.lexists(path):
+                missing = FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), str(path))
+                outcome.error = MoveFailed(path, dest_dir / path.name, missing)
+            elif path.resolve().is_relative_to(resolved_source):
+                outcome.error = InsideSourceDirectory(path, source_dir)
+            elif resolved_source.is_relative_to(path.resolve()):
+                outcome.error = ContainsSourceDirectory(path, source_dir)
+            else:
+                pending.append((outcome, dest_dir / _free_name(path.name, taken)))
+
+        def run(item: tuple[AddOutcome, Path]) -> None:
+            outcome, dest = item
+            try:
+                self._move_and_link(outcome.origin, dest, jobs=1)
+                outcome.source = dest
+            except (CustomFileException, LinkingError) as e:
+                outcome.error = e
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            list(pool.map(run, pending))
+
+        added = [outcome for outcome, _ in pending if outcome.source is not None]
+        for outcome in added:
+            self.config.add_to_paths(
+                str(outcome.source.relative_to(source_dir)), str(outcome.origin)
+            )
+        if added:
+            self._changed()
+        return outcomes
+
+    def regroup(self, path: str, new_group: Optional[str] = None) -> Regrouped:
+        """moves the source `path` into `new_group`, or to the top when it is None"""
+        source_dir = self.source_dir
+        old_source_path = source_dir / path
+        if not old_source_path.exists():
+            raise NotInSourceDirectory(Path(path))
+        _check_group(new_group)
+
+        result = Regrouped(path, path)
+        if path in self.config.paths:
+            result.unfolded = self._unfold_around([str(absolute_path(self.config.paths[path]))])
+
+        new_dir = source_dir / new_group if new_group else source_dir
+        new_source_path = _free_path(new_dir, Path(path).name)
+        result.new = str(new_source_path.relative_to(source_dir))
+        self._move(old_source_path, new_source_path)
+
+        relink = None
+        if path in self.config.paths:
+            target_path = absolute_path(self.config.paths[path])
+            if (
+                target_path.is_symlink()
+                and target_path.resolve() == old_source_path.resolve()
+            ):
+                relink = target_path
+            self.config.move_in_paths(path, result.new)
+
+        # the config follows the source before the link is touched, so a
+        # failed relink leaves nothing worse than a link `esf link` can fix
+        result.removed_groups = self._cleanup_empty_groups(path)
+        self._changed()
+        if relink is not None:
+            try:
+                relink.unlink()
+                relink.symlink_to(new_source_path)
+            except OSError as e:
+                raise RelinkFailed(relink, new_source_path, e) from e
+            result.relinked = relink
+        return result
+
+    def dsym(self, pattern: str) -> Dsymed:
+        """moves the sources matching `pattern` back over their links"""
+        source_dir = self.source_dir
+        abs_paths = self.config.get_absolute_paths()
+        matcher = PatternSet([pattern])
+        matched = [
+            (source_rel, target)
+            for source_rel, target in abs_paths.items()
+            if matcher.matches(source_rel)
+        ]
+        if not matched:
+            raise NoMatches(pattern)
+
+        result = Dsymed(unfolded=self._unfold_around([target for _, target in matched]))
+        try:
+            for source_rel, target_str in matched:
+                entry = DsymEntry(source_dir / source_rel, Path(target_str))
+                result.entries.append(entry)
+                if entry.target.is_symlink():
+                    entry.target.unlink()
+                elif entry.target.exists():
+                    entry.skipped = True
+                    continue
+
+                self._move(entry.source, entry.target)
+                self.config.remove_from_paths(target_str)
+                entry.removed_groups = self._cleanup_empty_groups(source_rel)
+        finally:
+            # what was moved before a failure is out of the farm for good
+            if result.restored:
+                self._changed()
+        return result
+
+    def link(self, jobs: int = 1, verify_all: bool = False, fold: bool = False) -> LinkResult:
+        """
+        Links every entry that isn't already, skipping the ones the link index
+        vouches for unless `verify_all`, and folding directories if `fold`.
+        """
+        from folding import FoldFinder, fold as fold_dirs, unfold_conflicts
+        from link_index import LinkIndex
+
+        source_dir = self.source_dir
+        abs_source_dir = os.path.abspath(source_dir)
+        with span("link.expand"):
+            abs_paths = self.config.get_absolute_paths()
+        with span("link.index"):
+            index = LinkIndex.load(self.config)
+
+        result = LinkResult(total=len(abs_paths))
+        if fold:
+            pairs = [
+                (os.path.join(abs_source_dir, source_rel), target)
+                for source_rel, target in abs_paths.items()
+            ]
+            with span("link.fold"):
+                result.folded = fold_dirs(abs_source_dir, pairs, str(get_home_dir()))
+
+        entries = []
+        with span("link.fresh"):
+            for source_rel, target_str in abs_paths.items():
+                source_path = source_dir / source_rel
+                if not verify_all and index.is_fresh(
+                    source_rel, str(source_path), target_str
+                ):
+                    continue
+                entries.append((source_rel, source_path, Path(target_str)))
+
+        with span("link.unfold"):
+            # a fold can't hold links to anything but its own source directory
+            result.unfolded = unfold_conflicts(
+                abs_source_dir,
+                [
+                    (os.path.join(abs_source_dir, source_rel), str(target_path))
+                    for source_rel, _, target_path in entries
+                ],
+            )
+
+            # entries a fold already shows need no link of their own
+            finder = FoldFinder(abs_source_dir)
+            unfolded_entries = []
+            for entry in entries:
+                source_rel, _, target_path = entry
+                if finder.covers(os.path.join(abs_source_dir, source_rel), str(target_path)):
+                    index.forget(source_rel)
+                else:
+                    unfolded_entries.append(entry)
+            entries = unfolded_entries
+
+        pairs = [(source_path, target_path) for _, source_path, target_path in entries]
+        with span("link.links", entries=len(pairs), jobs=jobs):
+            if jobs > 1:
+                results = _link_parallel(pairs, jobs)
+            else:
+                results = [link(source, target) for source, target in pairs]
+
+        for (source_rel, source_path, target_path), data in zip(entries, results):
+            result.outcomes.append(LinkOutcome(source_path, target_path, data))
+            if data.error is not None:
+                index.forget(source_rel)
+            else:
+                index.record(source_rel, str(source_path), str(target_path))
+
+        with span("link.index"):
+            index.save()
+        return result
+
+    def unlink(self, pattern: Optional[str] = None) -> UnlinkResult:
+        """
+        Removes the links of the sources matching `pattern`, or of every source.
+        Sources stay in the farm and in the config.
+        """
+        from folding import FoldFinder
+
+        source_dir = self.source_dir
+        abs_paths = self.config.get_absolute_paths()
+        result = UnlinkResult()
+
+        if pattern is not None:
+            matcher = PatternSet([pattern])
+            matched = list(matcher.filter(self.config.paths.keys()))
+            result.unfolded = self._unfold_around([abs_paths[source_rel] for source_rel in matched])
+        else:
+            # a fold goes away as a whole, its entries then have nothing to unlink
+            abs_source_dir = os.path.abspath(source_dir)
+            finder = FoldFinder(abs_source_dir)
+            folds: dict[str, None] = {}
+            matched = []
+            for source_rel, target_str in abs_paths.items():
+                if finder.covers(os.path.join(abs_source_dir, source_rel), target_str):
+                    folds[finder.fold_of(os.path.dirname(target_str))[0]] = None
+                else:
+                    matched.append(source_rel)
+            for fold in folds:
+                try:
+                    os.unlink(fold)
+                    result.folds.append((fold, None))
+                except OSError as e:
+                    result.folds.append((fold, e))
+
+        for source_rel in matched:
+            source_path = source_dir / source_rel
+            result.outcomes.append((source_path, unlink_entry(source_path, self.config)))
+        return result
+
+    def which(self, target) -> Path:
+        """the path in the farm that `target` shows"""
+        owner = self.config.find_owner(str(target))
+        if owner is None:
+            raise NoOwner(absolute_path(target))
+        source_rel, remainder = owner
+        source_path = self.source_dir / source_rel
+        return source_path / remainder if remainder else source_path
+
+    def set(self, tag: str, key: str, *values) -> None:
+        """changes one config setting, as `esf set` does"""
+        try:
+            self.config.update(tag, key, *values)
+        except ValueError as e:
+            raise InvalidSetting(tag, key, str(e)) from e
+        self._changed()
+
+    def status(self, jobs: int = 8) -> "Report":
+        from status import scan
+
+        with span("status.scan", jobs=jobs):
+            return scan(self.config, jobs)
+
+    def plan(self) -> "Plan":
+        from planner import build_plan
+
+        return build_plan(self.config)
+
+    def push(self, force: bool = False) -> PushResult:
+        """commits and pushes the source directory; failures are reported on stderr"""
+        from pusher import Pusher
+
+        pusher = Pusher(self.config)
+        pusher.push(force)
+        return PushResult(
+            pusher.result, pusher.attempts, pusher.changed_files, pusher.violations
+        )
@@ -0,0 +1,394 @@
+"""
+Hot path benchmarks for esf.
+
+Builds a synthetic farm for every scale in a temporary directory: a source
+tree with nested groups, a metadata file mixing `~` and absolute targets, a
+git repository holding it all and some untracked noise. Then runs the hot
+operations against it in order and records, for each one, the wall time, the
+filesystem calls made through `os` and the processes started. Calls that
+never go through Python's os module, like the stat behind `DirEntry.is_dir`,
+are not seen.
+
+Results are printed as a table, or as JSON with `--json`, and `--save` writes
+them to a file. With `--baseline`, any operation that got slower than the
+saved run by more than `--time-threshold`, or makes more calls or forks than
+`--count-threshold` allows, fails the run.
+
+    python benchmarks/farm.py [--scales 1000,10000,100000] [--runs N]
+        [--only op,...] [--json] [--save FILE] [--baseline FILE]
+        [--time-threshold F] [--count-threshold F]
+"""
+
+import collections
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# audit events that stand for one filesystem call each
+_FS_EVENTS = {
+    "open",
+    "os.listdir",
+    "os.scandir",
+    "os.symlink",
+    "os.link",
+    "os.remove",
+    "os.rename",
+    "os.mkdir",
+    "os.rmdir",
+    "os.chmod",
+    "os.chown",
+    "os.utime",
+    "os.truncate",
+}
+_FORK_EVENTS = {"subprocess.Popen", "os.fork", "os.forkpty", "os.posix_spawn", "os.system"}
+# os functions without an audit event, counted by wrapping them
+_WRAPPED = ("stat", "lstat", "readlink", "access")
+
+# a slower run only counts as a regression past this many seconds as well
+_TIME_SLACK = 0.005
+
+_counter: Optional["_Counter"] = None
+
+
+class _Counter:
+    def __init__(self):
+        self.active = False
+        self.calls: collections.Counter = collections.Counter()
+        self._lock = threading.Lock()
+
+    def hit(self, name: str) -> None:
+        if self.active:
+            with self._lock:
+                self.calls[name] += 1
+
+    def _audit(self, event: str, args: tuple) -> None:
+        if self.active and (event in _FS_EVENTS or event in _FORK_EVENTS):
+            self.hit(event)
+
+    def install(self) -> None:
+        sys.addaudithook(self._audit)
+        for name in _WRAPPED:
+            original = getattr(os, name)
+
+            def wrapper(*args, _original=original, _name=f"os.{name}", **kwargs):
+                self.hit(_name)
+                return _original(*args, **kwargs)
+
+            # shutil and friends look functions up in these sets
+            for supports in (os.supports_fd, os.supports_dir_fd, os.supports_follow_symlinks):
+                if original in supports:
+                    supports.add(wrapper)
+            setattr(os, name, wrapper)
+
+    @contextlib.contextmanager
+    def counting(self):
+        self.calls.clear()
+        self.active = True
+        try:
+            yield
+        finally:
+            self.active = False
+
+
+def _git(cwd: str, *args: str) -> None:
+    subprocess.run(
+        ["git", "-c", "user.name=bench", "-c", "user.email=bench@localhost", *args],
+        cwd=cwd,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def build_farm(root: str, entries: int) -> None:
+    """
+    `entries` files spread over ten groups of twenty subdirectories, plus a
+    ten file `solo` group for dsym. One target in ten is absolute, the rest
+    live under `~/.bench`. A twentieth as many untracked files and a few
+    edits are left uncommitted.
+    """
+    home = os.path.join(root, "home")
+    source = os.path.join(root, "src")
+    outside = os.path.join(root, "abs")
+    os.makedirs(home)
+    os.makedirs(source)
+
+    paths = []
+    for i in range(entries):
+        rel = f"g{i % 10}/s{i // 10 % 20}/f{i}.conf"
+        if i % 10 == 9:
+            target = f"{outside}/g{i % 10}/f{i}.conf"
+        else:
+            target = f"~/.bench/g{i % 10}/s{i // 10 % 20}/f{i}.conf"
+        paths.append((rel, target))
+    paths += [(f"solo/f{i}.conf", f"~/.solo/f{i}.conf") for i in range(10)]
+
+    made = set()
+    for rel, _ in paths:
+        directory = os.path.join(source, os.path.dirname(rel))
+        if directory not in made:
+            os.makedirs(directory, exist_ok=True)
+            made.add(directory)
+        with open(os.path.join(source, rel), "w") as f:
+            f.write(f"{rel}\n")
+
+    with open(os.path.join(source, "easy_env_sym_data.toml"), "w") as f:
+        f.write('[general]\nno-update-on = ["*.lock"]\n\n[paths]\n')
+        f.writelines(f'"{rel}" = "{target}"\n' for rel, target in paths)
+
+    _git(source, "init", "-q")
+    _git(source, "add", "-A")
+    _git(source, "commit", "-q", "-m", "farm")
+
+    os.makedirs(os.path.join(source, "scratch"))
+    for i in range(max(1, entries // 20)):
+        with open(os.path.join(source, "scratch", f"n{i}.tmp"), "w") as f:
+            f.write("noise\n")
+    for rel, _ in paths[:: max(1, len(paths) // 5)]:
+        with open(os.path.join(source, rel), "a") as f:
+            f.write("edited\n")
+
+
+_Step = Callable[[dict], None]
+
+
+def _operations() -> list[tuple[str, _Step, Optional[_Step]]]:
+    """(name, operation, untimed setup) in the order they run against one farm"""
+    from commands import CommandProcessor
+    from config import Config
+    from fingerprint import compute_fingerprint, save_fingerprint
+    from git_wrapper import GitWrapper
+    from patterns import PatternSet
+    from pusher import Pusher
+    from state import replaced_state_path
+
+    def drop_cache(ctx):
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(replaced_state_path("tomlcache"))
+
+    def load(ctx):
+        ctx["config"] = Config.load()
+
+    def write(ctx):
+        ctx["config"].write()
+
+    def add_entry(ctx):
+        ctx["config"].add_to_paths("bench-extra", "~/.bench-extra")
+
+    def link_all(ctx):
+        CommandProcessor(ctx["config"]).link_all()
+
+    def remove_entry(ctx):
+        # entries are removed by target; the source name would match nothing
+        # and leave an unlinked entry behind for every later operation
+        ctx["config"].remove_from_paths("~/.bench-extra")
+        assert "bench-extra" not in ctx["config"].paths
+        ctx["config"].write()
+
+    def git_changes(ctx):
+        GitWrapper(Config.get_source_directory()).changes(PatternSet(ctx["config"].no_update_on))
+
+    def push_detect_dirty(ctx):
+        source_dir = Config.get_source_directory()
+        compute_fingerprint(source_dir)
+        GitWrapper(source_dir).has_changes(PatternSet(ctx["config"].no_update_on))
+
+    def save_current_fingerprint(ctx):
+        # the first save creates the state file, which changes the fingerprint
+        for _ in range(2):
+            save_fingerprint(compute_fingerprint(Config.get_source_directory()), True)
+
+    def push_detect_clean(ctx):
+        Pusher(ctx["config"]).push()
+
+    def dsym(ctx):
+        CommandProcessor(ctx["config"]).dsym("solo/*")
+
+    def unlink_all(ctx):
+        CommandProcessor(ctx["config"]).unlink_all()
+
+    return [
+        ("config-load", load, drop_cache),
+        ("config-load-cached", load, None),
+        # the generated file isn't laid out the way esf writes it until saved once
+        ("config-write-noop", write, write),
+        ("config-write", write, add_entry),
+        ("link-all", link_all, remove_entry),
+        ("link-all-indexed", link_all, None),
+        ("git-changes", git_changes, None),
+        ("push-detect-dirty", push_detect_dirty, None),
+        ("push-detect-clean", push_detect_clean, save_current_fingerprint),
+        ("dsym", dsym, None),
+        ("unlink-all", unlink_all, None),
+    ]
+
+
+def run_scale(entries: int, only: Optional[set[str]]) -> list[dict]:
+    assert _counter is not None
+    results = []
+    with tempfile.TemporaryDirectory(prefix="esf-bench-") as root:
+        build_farm(root, entries)
+        os.environ.update(
+            HOME=os.path.join(root, "home"),
+            easy_sym_source=os.path.join(root, "src"),
+            easy_sym_meta_name="easy_env_sym_data.toml",
+            ESF_NO_SERVER="1",
+        )
+        os.environ.pop("SUDO_USER", None)
+        cwd = os.getcwd()
+        os.chdir(root)
+
+        ctx: dict = {}
+        sink = open(os.devnull, "w")
+        try:
+            for name, operation, setup in _operations():
+                with contextlib.redirect_stdout(sink), contextlib.redirect_stderr(sink):
+                    if setup is not None:
+                        setup(ctx)
+                    exit_code = 0
+                    with _counter.counting():
+                        start = time.perf_counter()
+                        try:
+                            operation(ctx)
+                        except SystemExit as e:
+                            exit_code = e.code if isinstance(e.code, int) else 1
+                        seconds = time.perf_counter() - start
+                if only is not None and name not in only:
+                    continue
+                calls = dict(_counter.calls)
+                forks = sum(count for event, count in calls.items() if event in _FORK_EVENTS)
+                fs = {event: count for event, count in calls.items() if event not in _FORK_EVENTS}
+                results.append(
+                    {
+                        "op": name,
+                        "entries": entries,
+                        "seconds": round(seconds, 6),
+                        "fs_calls": sum(fs.values()),
+                        "forks": forks,
+                        "fs": dict(sorted(fs.items())),
+                        "exit_code": exit_code,
+                    }
+                )
+        finally:
+            sink.close()
+            os.chdir(cwd)
+    return results
+
+
+def _best(runs: list[list[dict]]) -> list[dict]:
+    """the fastest time and lowest counts of every operation across runs"""
+    best = [dict(result) for result in runs[0]]
+    for run in runs[1:]:
+        for kept, result in zip(best, run):
+            for key in ("seconds", "fs_calls", "forks"):
+                kept[key] = min(kept[key], result[key])
+    return best
+
+
+def compare(
+    results: list[dict], baseline: dict, time_threshold: float, count_threshold: float
+) -> list[str]:
+    saved = {(r["op"], r["entries"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        before = saved.get((result["op"], result["entries"]))
+        if before is None:
+            continue
+        label = f"{result['op']} @ {result['entries']}"
+        limit = before["seconds"] * (1 + time_threshold) + _TIME_SLACK
+        if result["seconds"] > limit:
+            regressions.append(
+                f"{label}: {result['seconds'] * 1000:.1f}ms, was {before['seconds'] * 1000:.1f}ms"
+            )
+        for key in ("fs_calls", "forks"):
+            if result[key] > before[key] * (1 + count_threshold):
+                regressions.append(f"{label}: {result[key]} {key}, was {before[key]}")
+    return regressions
+
+
+def _print_table(results: list[dict]) -> None:
+    print(f"{'operation':20} {'entries':>8} {'time':>11} {'fs calls':>9} {'forks':>6}")
+    for r in results:
+        failed = "  (exit {})".format(r["exit_code"]) if r["exit_code"] else ""
+        print(
+            f"{r['op']:20} {r['entries']:>8} {r['seconds'] * 1000:9.1f}ms "
+            f"{r['fs_calls']:>9} {r['forks']:>6}{failed}"
+        )
+
+
+def _option(args: list[str], name: str, default: Optional[str]) -> Optional[str]:
+    if name in args:
+        return args[args.index(name) + 1]
+    return default
+
+
+def main() -> int:
+    global _counter
+
+    args = sys.argv[1:]
+    scales = [int(s) for s in _option(args, "--scales", "1000,10000").split(",")]
+    runs = int(_option(args, "--runs", "1"))
+    only_arg = _option(args, "--only", None)
+    only = set(only_arg.split(",")) if only_arg else None
+    save = _option(args, "--save", None)
+    baseline_path = _option(args, "--baseline", None)
+    time_threshold = float(_option(args, "--time-threshold", "0.5"))
+    count_threshold = float(_option(args, "--count-threshold", "0.1"))
+
+    if shutil.which("git") is None:
+        print("git is required to build the benchmark farms", file=sys.stderr)
+        return 1
+
+    # everything the operations import is loaded up front so imports are not counted
+    import commands  # noqa: F401
+    import folding  # noqa: F401
+    import link_index  # noqa: F401
+    import mover  # noqa: F401
+    import pusher  # noqa: F401
+    import status  # noqa: F401
+
+    _counter = _Counter()
+    _counter.install()
+
+    results = []
+    for entries in scales:
+        results += _best([run_scale(entries, only) for _ in range(runs)])
+
+    output = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": runs,
+        "results": results,
+    }
+    if "--json" in args:
+        print(json.dumps(output, indent=2))
+    else:
+        _print_table(results)
+    if save:
+        with open(save, "w") as f:
+            json.dump(output, f, indent=2)
+            f.write("\n")
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, time_threshold, count_threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
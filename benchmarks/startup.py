@@ -0,0 +1,100 @@
+"""
+Startup budget for esf.
+
+Runs esf under `python -X importtime` for a few commands that should stay
+cheap and fails when one of them imports a module it has no use for or when
+the time spent importing esf's own code and its dependencies goes over
+budget. Modules the bare interpreter already imports are not counted.
+
+    python benchmarks/startup.py [--runs N] [--scale F]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+ESF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "esf.py")
+
+# heavy modules none of the commands below may import
+_ALWAYS_FORBIDDEN = {
+    "asyncio",
+    "subprocess",
+    "shutil",
+    "datetime",
+    "git_wrapper",
+    "pusher",
+    "watcher",
+    "planner",
+    "concurrent.futures",
+}
+
+# (argv, extra forbidden modules, budget in microseconds)
+CASES = [
+    (
+        ["help"],
+        {"commands", "config", "linker", "pathlib", "tomllib", "json", "socket"},
+        10_000,
+    ),
+    (["add-to-git-ignore", "*.swp"], {"tomllib", "json", "socket"}, 75_000),
+    (["which", "~/.bashrc"], {"json", "socket"}, 75_000),
+]
+
+
+def _import_times(argv: list[str], env: dict[str, str]) -> dict[str, int]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *argv],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(self_us)
+    return times
+
+
+def main() -> int:
+    runs = 5
+    scale = 1.0
+    args = sys.argv[1:]
+    if "--runs" in args:
+        runs = int(args[args.index("--runs") + 1])
+    if "--scale" in args:
+        scale = float(args[args.index("--scale") + 1])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.update(HOME=tmp, easy_sym_source=os.path.join(tmp, "src"), ESF_NO_SERVER="1")
+        env.pop("SUDO_USER", None)
+        baseline = set(_import_times(["-c", "pass"], env))
+
+        failed = False
+        for argv, forbidden, budget_us in CASES:
+            best = None
+            imported: set[str] = set()
+            for _ in range(runs):
+                times = _import_times([ESF, *argv], env)
+                own = {name: us for name, us in times.items() if name not in baseline}
+                imported |= set(own)
+                total = sum(own.values())
+                best = total if best is None else min(best, total)
+
+            assert best is not None
+            budget = int(budget_us * scale)
+            bad = sorted(imported & (forbidden | _ALWAYS_FORBIDDEN))
+            ok = not bad and best <= budget
+            failed |= not ok
+            status = "ok" if ok else "FAIL"
+            print(f"{status:4} esf {' '.join(argv):28} {best / 1000:7.2f}ms (budget {budget / 1000:.0f}ms)")
+            if bad:
+                print(f"     eager imports: {', '.join(bad)}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,126 +1,326 @@
 import sys
-from pathlib import Path
-from commands import CommandProcessor
-from config import Config
 
 from ansii import GREEN, BLUE, RESET, BOLD
 
+# Nothing heavier than ansii is imported at module level: `help` and the other
+# config-free commands must not pay for commands, config or git. Keep new
+# imports inside the handlers that need them; benchmarks/startup.py enforces it.
+# typing alone costs `help` more than its budget, so it is only imported for
+# type checkers and the annotations naming its types are strings.
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Optional
+
+    from commands import CommandProcessor
+    from config import Config
+
+
+def _take_option(args: list[str], *names: str) -> "Optional[str]":
+    for name in names:
+        if name in args:
+            index = args.index(name)
+            if index + 1 >= len(args):
+                print(f"Error: '{name}' requires a value", file=sys.stderr)
+                sys.exit(1)
+            value = args[index + 1]
+            del args[index : index + 2]
+            return value
+    return None
+
+
+def _take_flag(args: list[str], *names: str) -> bool:
+    found = False
+    for name in names:
+        while name in args:
+            args.remove(name)
+            found = True
+    return found
+
+
+def _take_int_option(args: list[str], default: int, *names: str) -> int:
+    value = _take_option(args, *names)
+    if value is None:
+        return default
+    try:
+        result = int(value)
+    except ValueError:
+        result = 0
+    if result < 1:
+        print(f"Error: '{names[0]}' must be a positive integer", file=sys.stderr)
+        sys.exit(1)
+    return result
+
+
+def _require(rest: list[str], count: int, message: str) -> None:
+    if len(rest) < count:
+        print(f"Error: {message}", file=sys.stderr)
+        sys.exit(1)
+
+
+def _link(parser: "Parser", rest: list[str]) -> None:
+    if _take_flag(rest, "--root"):
+        import os
+
+        root_home = _take_option(rest, "--root-home")
+        jobs = _take_int_option(rest, os.cpu_count() or 1, "--jobs", "-j")
+        _require(rest, 1, "'link --root' requires at least one directory")
+        if "--fold" in rest or "--verify-all" in rest:
+            print(
+                "Error: '--root' can't be combined with '--fold' or '--verify-all'",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+        parser.processor.link_roots(rest, jobs, root_home)
+        return
+
+    jobs = _take_int_option(rest, 1, "--jobs", "-j")
+    verify_all = _take_flag(rest, "--verify-all")
+    fold = _take_flag(rest, "--fold")
+    parser.processor.link_all(jobs, verify_all, fold)
+
+
+def _plan(parser: "Parser", rest: list[str]) -> None:
+    parser.processor.plan(as_json="--json" in rest)
+
+
+def _status(parser: "Parser", rest: list[str]) -> None:
+    jobs = _take_int_option(rest, 8, "--jobs", "-j")
+    parser.processor.status(as_json="--json" in rest, jobs=jobs)
+
+
+def _doctor(parser: "Parser", rest: list[str]) -> None:
+    jobs = _take_int_option(rest, 8, "--jobs", "-j")
+    parser.processor.status(as_json="--json" in rest, jobs=jobs, strict=True)
+
+
+def _apply(parser: "Parser", rest: list[str]) -> None:
+    parser.processor.apply()
+
+
+def _which(parser: "Parser", rest: list[str]) -> None:
+    _require(rest, 1, "'which' requires a target path")
+    parser.processor.which(rest[0])
+
+
+def _unlink(parser: "Parser", rest: list[str]) -> None:
+    if rest:
+        parser.processor.unlink_source_match_pattern(rest[0])
+    else:
+        parser.processor.unlink_all()
+
+
+def _push(parser: "Parser", rest: list[str]) -> None:
+    parser.processor.push(force=_take_flag(rest, "--force"))
+
+
+def _serve(parser: "Parser", rest: list[str]) -> None:
+    from server import Server
+
+    Server().serve_forever()
+
+
+def _watch(parser: "Parser", rest: list[str]) -> None:
+    parser.processor.watch(force_polling=_take_flag(rest, "--poll"))
+
+
+def _add(parser: "Parser", rest: list[str]) -> None:
+    from pathlib import Path
+
+    _require(rest, 1, "'add' requires at least one argument")
+    path = Path(rest[0])
+    if len(rest) >= 2:
+        parser.processor.add_path_and_group(path, rest[1])
+    else:
+        parser.processor.add(path)
+
+
+def _add_many(parser: "Parser", rest: list[str]) -> None:
+    group = _take_option(rest, "--group", "-g")
+    jobs = _take_int_option(rest, 8, "--jobs", "-j")
+    _require(rest, 1, "'add-many' requires at least one path, glob or '-'")
+    parser.processor.add_many(rest, group, jobs)
+
+
+def _add_to_git_ignore(parser: "Parser", rest: list[str]) -> None:
+    from commands import CommandProcessor
+
+    _require(rest, 1, "'add-to-git-ignore' requires a pattern")
+    CommandProcessor.add_to_git_ignore(rest[0])
+
+
+def _remove_from_git_ignore(parser: "Parser", rest: list[str]) -> None:
+    from commands import CommandProcessor
+
+    _require(rest, 1, "'remove-from-git-ignore' requires a pattern")
+    CommandProcessor.remove_from_git_ignore(rest[0])
+
+
+def _add_to_no_update(parser: "Parser", rest: list[str]) -> None:
+    _require(rest, 1, "'add-to-no-update' requires a pattern")
+    parser.processor.add_to_no_update(rest[0])
+
+
+def _remove_from_no_update(parser: "Parser", rest: list[str]) -> None:
+    _require(rest, 1, "'remove-from-no-update' requires a pattern")
+    parser.processor.remove_from_no_update(rest[0])
+
+
+def _add_to_no_new_files(parser: "Parser", rest: list[str]) -> None:
+    from pathlib import Path
+
+    _require(rest, 1, "'add-to-no-new-files' requires a path")
+    parser.processor.add_to_no_new_files(Path(rest[0]))
+
+
+def _remove_from_no_new_files(parser: "Parser", rest: list[str]) -> None:
+    from pathlib import Path
+
+    _require(rest, 1, "'remove-from-no-new-files' requires a path")
+    parser.processor.remove_from_no_new_files(Path(rest[0]))
+
+
+def _set(parser: "Parser", rest: list[str]) -> None:
+    _require(rest, 2, "'set' requires at least a tag and setting")
+    parser.processor.set_config_value(rest[0], rest[1], *rest[2:])
+
+
+def _dsym(parser: "Parser", rest: list[str]) -> None:
+    _require(rest, 1, "'dsym' requires a pattern")
+    parser.processor.dsym(rest[0])
+
+
+def _update_sym_data(parser: "Parser", rest: list[str]) -> None:
+    parser.processor.update_sym_data()
+
+
+def _regroup(parser: "Parser", rest: list[str]) -> None:
+    _require(rest, 1, "'regroup' requires at least one argument")
+    new_group = rest[1] if len(rest) >= 2 else None
+    parser.processor.regroup(rest[0], new_group)
+
+
+COMMANDS = {
+    "link": _link,
+    "plan": _plan,
+    "apply": _apply,
+    "status": _status,
+    "doctor": _doctor,
+    "which": _which,
+    "unlink": _unlink,
+    "push": _push,
+    "serve": _serve,
+    "watch": _watch,
+    "add": _add,
+    "add-many": _add_many,
+    "add-to-git-ignore": _add_to_git_ignore,
+    "remove-from-git-ignore": _remove_from_git_ignore,
+    "add-to-no-update": _add_to_no_update,
+    "remove-from-no-update": _remove_from_no_update,
+    "add-to-no-new-files": _add_to_no_new_files,
+    "remove-from-no-new-files": _remove_from_no_new_files,
+    "set": _set,
+    "dsym": _dsym,
+    "update-sym-data": _update_sym_data,
+    "regroup": _regroup,
+}
+
 
 class Parser:
-    def __init__(self):
-        self.config = Config.load()
-        self.processor = CommandProcessor(self.config)
+    """
+    Dispatches through COMMANDS. The config and the command processor are only
+    loaded the first time a handler asks for them.
+    """
+
+    def __init__(self, config: "Optional[Config]" = None):
+        self._config = config
+        self._processor = None
+
+    @property
+    def config(self) -> "Config":
+        if self._config is None:
+            from config import Config
+
+            try:
+                self._config = Config.load()
+            except ValueError as e:
+                print(f"Error: {Config._config_path()}: {e}", file=sys.stderr)
+                sys.exit(1)
+        return self._config
+
+    @property
+    def processor(self) -> "CommandProcessor":
+        if self._processor is None:
+            from commands import CommandProcessor
+
+            self._processor = CommandProcessor(self.config)
+        return self._processor
 
     def dispatch(self, *argv) -> None:
+        import os
+
         args = list(argv)
+        timings = _take_flag(args, "--timings")
+        trace_path = os.environ.get("ESF_TRACE")
+        if not timings and not trace_path:
+            self._dispatch(args)
+            return
+
+        import spans
+
+        spans.enable()
+        try:
+            with spans.span(f"esf {args[0] if args else 'help'}"):
+                self._dispatch(args)
+        finally:
+            spans.finish(timings, trace_path)
+
+    def _dispatch(self, args: list[str]) -> None:
         if not args or args[0] in ("-h", "--help", "help"):
             self.print_help()
             return
 
         command = args[0]
-        rest = args[1:]
-
-        if command == "link":
-            self.processor.link_all()
-        elif command == "unlink":
-            if rest:
-                self.processor.unlink_source_match_pattern(rest[0])
-            else:
-                self.processor.unlink_all()
-        elif command == "push":
-            self.processor.push()
-        elif command == "add":
-            if not rest:
-                print("Error: 'add' requires at least one argument", file=sys.stderr)
-                sys.exit(1)
-            path = Path(rest[0])
-            if len(rest) >= 2:
-                group = rest[1]
-                self.processor.add_path_and_group(path, group)
-            else:
-                self.processor.add(path)
-        elif command == "add-to-git-ignore":
-            if not rest:
-                print("Error: 'add-to-git-ignore' requires a pattern", file=sys.stderr)
-                sys.exit(1)
-            self.processor.add_to_git_ignore(rest[0])
-        elif command == "remove-from-git-ignore":
-            if not rest:
-                print(
-                    "Error: 'remove-from-git-ignore' requires a pattern",
-                    file=sys.stderr,
-                )
-                sys.exit(1)
-            self.processor.remove_from_git_ignore(rest[0])
-        elif command == "add-to-no-update":
-            if not rest:
-                print("Error: 'add-to-no-update' requires a pattern", file=sys.stderr)
-                sys.exit(1)
-            self.processor.add_to_no_update(rest[0])
-        elif command == "remove-from-no-update":
-            if not rest:
-                print(
-                    "Error: 'remove-from-no-update' requires a pattern", file=sys.stderr
-                )
-                sys.exit(1)
-            self.processor.remove_from_no_update(rest[0])
-        elif command == "add-to-no-new-files":
-            if not rest:
-                print("Error: 'add-to-no-new-files' requires a path", file=sys.stderr)
-                sys.exit(1)
-            self.processor.add_to_no_new_files(Path(rest[0]))
-        elif command == "remove-from-no-new-files":
-            if not rest:
-                print(
-                    "Error: 'remove-from-no-new-files' requires a path", file=sys.stderr
-                )
-                sys.exit(1)
-            self.processor.remove_from_no_new_files(Path(rest[0]))
-        elif command == "set":
-            if len(rest) < 2:
-                print(
-                    "Error: 'set' requires at least a tag and setting", file=sys.stderr
-                )
-                sys.exit(1)
-            tag = rest[0]
-            setting = rest[1]
-            values = rest[2:] if len(rest) > 2 else []
-            self.processor.set_config_value(tag, setting, *values)
-        elif command == "dsym":
-            if not rest:
-                print("Error: 'dsym' requires a pattern", file=sys.stderr)
-                sys.exit(1)
-            self.processor.dsym(rest[0])
-        elif command == "update-sym-data":
-            self.processor.update_sym_data()
-        elif command == "regroup":
-            if not rest:
-                print(
-                    "Error: 'regroup' requires at least one argument", file=sys.stderr
-                )
-                sys.exit(1)
-            new_group = rest[1] if len(rest) >= 2 else None
-            self.processor.regroup(rest[0], new_group)
-        else:
+        handler = COMMANDS.get(command)
+        if handler is None:
             print(f"Unknown command: {command}", file=sys.stderr)
             self.print_help()
             sys.exit(1)
+        handler(self, args[1:])
 
     def print_help(self) -> None:
         print(f"""{BOLD}Easy Sym Farm{RESET} - Manage symbolic links to your configuration files
 
 {BOLD}Flags:{RESET}
     {BLUE}-h{RESET} -> Print all available flags, what they do and a brief program description
+    {BLUE}--timings{RESET} -> After the command, print how long each phase took to stderr
 
 {BOLD}Subcommands:{RESET}
     {GREEN}help{RESET} -> Print all available flags, what they do and a brief program description
     {GREEN}link{RESET} -> Symlink the files in the source directory
+    {GREEN}link --jobs <n>{RESET} -> Symlink the files using n worker threads
+    {GREEN}link --verify-all{RESET} -> Symlink the files, re-checking entries the link index reports as unchanged
+    {GREEN}link --fold{RESET} -> Symlink the files, replacing directories that only hold farm links with one directory link
+    {GREEN}link --root <dir>...{RESET} -> Symlink the files into each directory as if it were /, one process per directory
+    {GREEN}link --root --root-home <home> --jobs <n> <dir>...{RESET} -> Use home in place of ~ inside the directories, n at a time
+    {GREEN}plan{RESET} -> Show the operations needed to bring the targets in line with the farm
+    {GREEN}plan --json{RESET} -> Print the plan as JSON
+    {GREEN}apply{RESET} -> Perform only the create, retarget and remove operations from the plan
+    {GREEN}status{RESET} -> Report every target that is missing, dangling, points elsewhere or has a file in the way
+    {GREEN}status --json{RESET} -> Print the state of every entry as JSON
+    {GREEN}doctor{RESET} -> Like status, but exit with 1 when anything is wrong
+    {GREEN}which <target>{RESET} -> Print the file in the source directory that a target path comes from
     {GREEN}unlink{RESET} -> Unlinks all symlinked files from the source directory
     {GREEN}unlink <pattern>{RESET} -> Unlinks all files relative to the source directory root using the file pattern
     {GREEN}desym <pattern>{RESET} -> Removes the symlink from the file and moves it back to it's proper location
     {GREEN}push{RESET} -> Uses git add, commit, push to push the changes
+    {GREEN}push --force{RESET} -> Push even if nothing changed since the last push
+    {GREEN}serve{RESET} -> Keep the config loaded and answer esf commands over a UNIX socket
+    {GREEN}watch{RESET} -> Watch the source directory and push shortly after files change
+    {GREEN}watch --poll{RESET} -> Watch by polling instead of inotify
     {GREEN}add <file>{RESET} -> Add a non-symlink file or directory, move it to source, and link it
     {GREEN}add <file> <group>{RESET} -> Add a file to a group directory in the source
+    {GREEN}add-many <paths|globs|->{RESET} -> Add many files at once, writing the config once; '-' reads paths from stdin
+    {GREEN}add-many --group <group> --jobs <n> ...{RESET} -> Add them to a group directory using n worker threads
     {GREEN}add-to-git-ignore <pattern>{RESET} -> Adds a pattern to the .gitignore file
     {GREEN}remove-from-git-ignore <pattern>{RESET} -> Removes a pattern from the .gitignore file
     {GREEN}add-to-no-update <pattern>{RESET} -> Adds a file pattern to the no-update-on list
@@ -0,0 +1,123 @@
+import os
+import sys
+
+# Kept free of esf's own modules so forwarding a command to a running
+# `esf serve` costs only interpreter startup. Not even typing is imported
+# outside type checking, the annotations naming its types are strings.
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Optional
+
+# commands that are long running, read the terminal or are cheaper to run than
+# to forward always run in process
+LOCAL_COMMANDS = {"serve", "watch", "help", "-h", "--help"}
+
+# environment the server must share with the client for results to be the same
+FORWARDED_ENV = ("easy_sym_source", "easy_sym_meta_name", "SUDO_USER", "HOME")
+
+
+def _config_path() -> str:
+    source_dir = os.environ.get("easy_sym_source")
+    if source_dir is None:
+        sudo_user = os.environ.get("SUDO_USER")
+        home = f"/home/{sudo_user}" if sudo_user else os.path.expanduser("~")
+        source_dir = os.path.join(home, "easy_syms")
+    meta_name = os.environ.get("easy_sym_meta_name", "easy_env_sym_data.toml")
+    return os.path.join(source_dir, meta_name)
+
+
+def socket_dir() -> str:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return os.path.join(runtime_dir, f"esf-{os.getuid()}")
+
+
+def socket_path() -> str:
+    import hashlib
+
+    digest = hashlib.blake2b(_config_path().encode(), digest_size=6).hexdigest()
+    return os.path.join(socket_dir(), f"{digest}.sock")
+
+
+def is_private_dir(path: str) -> bool:
+    """
+    whether `path` is a real directory only this user can enter, so nobody
+    else can have put or swapped anything inside it
+    """
+    import stat
+
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return (
+        stat.S_ISDIR(st.st_mode)
+        and st.st_uid == os.getuid()
+        and st.st_mode & 0o077 == 0
+    )
+
+
+def _is_own_socket(path: str) -> bool:
+    import stat
+
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+
+def request_env() -> "dict[str, Optional[str]]":
+    return {name: os.environ.get(name) for name in FORWARDED_ENV}
+
+
+def send_message(sock, message: dict) -> None:
+    import json
+
+    sock.sendall(json.dumps(message).encode() + b"\n")
+
+
+def run_via_server(argv: list[str]) -> "Optional[int]":
+    """
+    Forwards `argv` to a running `esf serve` and relays its output. Returns the
+    exit code, or None if there is no server to talk to and the command should
+    run in this process instead.
+    """
+    if os.environ.get("ESF_NO_SERVER") or not argv or argv[0] in LOCAL_COMMANDS:
+        return None
+    # a '-' argument reads this process's stdin, which the server can't see
+    if "-" in argv:
+        return None
+    # a trace has to describe this process, not the server
+    if os.environ.get("ESF_TRACE"):
+        return None
+
+    # argv and the environment are sent to whoever listens on the socket and
+    # its answer is trusted, so only talk to a server this user started
+    path = socket_path()
+    if not is_private_dir(os.path.dirname(path)) or not _is_own_socket(path):
+        return None
+
+    import json
+    import socket
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+
+    with sock:
+        send_message(sock, {"argv": argv, "cwd": os.getcwd(), "env": request_env()})
+        streams = {"stdout": sys.stdout, "stderr": sys.stderr}
+        for line in sock.makefile("rb"):
+            message = json.loads(line)
+            if "exit" in message:
+                return message["exit"]
+            if message.get("fallback"):
+                return None
+            stream = streams[message["stream"]]
+            stream.write(message["data"])
+            stream.flush()
+    # the server went away mid command, nothing sensible to fall back to
+    return 1
@@ -1,230 +1,345 @@
-import fnmatch
+import os
 from pathlib import Path
-import shutil
-from utils import print_err, delete_path, suppress_errors, absolute_path
+from utils import print_err, absolute_path, get_home_dir
 from ansii import RED, RESET, BLUE, BOLD, GREEN
-import sys
-import subprocess
-import time
 
+from api import Farm
 from config import Config
-from git_wrapper import GitPushStatus, GitWrapper
-from linker import link, unlink, LinkData
-from typing import Optional
+from errors import LinkingError
+from linker import describe, link
+from spans import span
+from typing import TYPE_CHECKING, Optional
 
+# commands that need git, threads, the planner or the watcher import them
+# where they are used, keeping startup cheap for everything else
+if TYPE_CHECKING:
+    from planner import Operation
 
-def _guard_against_adding_inside_source(path: Path, source_dir: Path):
-    if path.resolve().is_relative_to(source_dir.resolve()):
-        print_err(
-            f"{RED}{BOLD}ERROR{RESET}{
-                RED
-            }: cannot add path that is inside source directory {BLUE}{BOLD}{source_dir}{
-                RESET
-            }"
-        )
-        exit(1)
 
+def _move_progress(origin: Path):
+    """progress callback for mover.move that redraws one line on a terminal"""
+    import sys
 
-def _safe_move_dir(origin: Path, target: Path):
-    try:
-        target.parent.mkdir(parents=True, exist_ok=True)
-        shutil.move(str(origin.absolute()), str(target.absolute()))
-    except FileNotFoundError:
-        print_err(
-            f"{RED}{BOLD}FILE NOT FOUND{RESET}{RED}, can't add {BOLD}{BLUE}{
-                origin.absolute()
-            }{RED} {RESET}"
-        )
-        suppress_errors(delete_path, origin)
-        exit(1)
-    except PermissionError:
+    if not sys.stderr.isatty():
+        return None
+
+    def report(done: int, total: int) -> None:
+        # small moves finish before a progress line would be worth reading
+        if total < 64 * 1024 * 1024:
+            return
+        end = "\n" if done >= total else ""
         print_err(
-            f"{RED}{BOLD}PERMISSION DENIED{RESET}{RED}, can't add {BOLD}{BLUE}{
-                origin.absolute()
-            }{RED} {RESET}"
+            f"\rmoving {BLUE}{BOLD}{origin}{RESET} {done * 100 // total}%", end=end
         )
-        suppress_errors(delete_path, origin)
-        exit(1)
-    except Exception as e:
-        print_err(e)
-        suppress_errors(delete_path, origin)
-        exit(1)
+
+    return report
+
+
+def _expand_add_arguments(args: list[str]) -> tuple[list[Path], list[str]]:
+    """
+    Paths named by add-many's arguments, in order and without duplicates, and
+    the arguments that named nothing. Globs are expanded here so quoting them
+    works, and `-` reads one literal path per line from stdin.
+    """
+    import glob
+    import sys
+
+    paths: dict[Path, None] = {}
+    unmatched = []
+    for arg in args:
+        if arg == "-":
+            names = [line.rstrip("\n") for line in sys.stdin]
+            matches = [name for name in names if name]
+        elif glob.has_magic(arg):
+            matches = sorted(glob.glob(os.path.expanduser(arg)))
+        else:
+            matches = [arg]
+        if not matches:
+            unmatched.append(arg)
+        for match in matches:
+            paths[absolute_path(match)] = None
+    return list(paths), unmatched
+
+
+def _operation_message(op: "Operation") -> str:
+    from planner import OperationKind
+
+    color = RED if op.kind == OperationKind.CONFLICT else GREEN
+    msg = f"{color}{BOLD}{op.kind.value}{RESET} {BOLD}{GREEN}{op.source}{RESET} -> {BLUE}{BOLD}{op.target}{RESET}"
+    if op.reason:
+        msg += f" ({op.reason})"
+    return msg
 
 
 def _linked_message(source, target):
     return f"linked {BOLD}{GREEN}{source}{RESET} to {BLUE}{BOLD}{target}{RESET}"
 
 
+def _print_unfolded(unfolded: list[str]) -> None:
+    for fold in unfolded:
+        print(f"unfolded {BLUE}{BOLD}{fold}{RESET}")
+
+
+def _print_removed_groups(groups: list[Path]) -> None:
+    for group in groups:
+        print(f"removed empty group {BLUE}{BOLD}{group}{RESET}")
+
+
+def _error_message(error: Exception, verb: str = "add") -> str:
+    """an error raised by the api as the commands print it"""
+    from errors import (
+        ContainsSourceDirectory,
+        InsideSourceDirectory,
+        MoveFailed,
+        NotMovedBack,
+    )
+
+    if isinstance(error, LinkingError):
+        return describe(error)
+    if isinstance(error, MoveFailed):
+        if isinstance(error.cause, FileNotFoundError):
+            return f"{RED}{BOLD}FILE NOT FOUND{RESET}{RED}, can't {verb} {BOLD}{BLUE}{error.path}{RED} {RESET}"
+        if isinstance(error.cause, PermissionError):
+            return f"{RED}{BOLD}PERMISSION DENIED{RESET}{RED}, can't {verb} {BOLD}{BLUE}{error.path}{RED} {RESET}"
+        return f"{RED}{BOLD}ERROR{RESET}{RED}: {error.message}{RESET}"
+    if isinstance(error, NotMovedBack):
+        return f"{describe(error.error)}\n{RED}and it could not be moved back from {BOLD}{BLUE}{error.dest}{RESET}"
+    if isinstance(error, InsideSourceDirectory):
+        return f"{RED}cannot add {BOLD}{BLUE}{error.path}{RESET}{RED}, it is inside the source directory {BLUE}{BOLD}{error.source_dir}{RESET}"
+    if isinstance(error, ContainsSourceDirectory):
+        return f"{RED}cannot add {BOLD}{BLUE}{error.path}{RESET}{RED}, it contains the source directory{RESET}"
+    return f"{RED}{getattr(error, 'message', error)}{RESET}"
+
+
+def _fail(error: Exception, verb: str = "add") -> None:
+    print_err(_error_message(error, verb))
+    exit(1)
+
+
 class CommandProcessor:
     def __init__(self, config: Config):
         self.config = config
+        self.farm = Farm(config)
+        self.farm.progress = _move_progress
+
+    def link_all(self, jobs: int = 1, verify_all: bool = False, fold: bool = False) -> None:
+        result = self.farm.link(jobs, verify_all, fold)
+
+        with span("link.report"):
+            for target, source in result.folded:
+                print(f"folded {BLUE}{BOLD}{target}{RESET} to {BOLD}{GREEN}{source}{RESET}")
+            _print_unfolded(result.unfolded)
+            for outcome in result.outcomes:
+                if outcome.data.error is not None:
+                    print(describe(outcome.data.error))
+                elif not outcome.data.already_linked:
+                    print(_linked_message(outcome.source, outcome.target))
+
+        if self.config.metrics_file:
+            from metrics import link_families
+
+            self._write_metrics(
+                link_families(len(result.linked), result.already_linked, len(result.failed))
+            )
 
-    def link_all(self) -> None:
-        source_dir = Config.get_source_directory()
-        abs_paths = self.config.get_absolute_paths()
+    def link_roots(self, roots: list[str], jobs: int, home: Optional[str] = None) -> None:
+        from fanout import link_roots, rebase
+
+        source_dir = os.path.abspath(Config.get_source_directory())
+        home = os.path.normpath(home) if home else str(get_home_dir())
+        entries = []
+        missing = 0
+        for source_rel, target in self.config.paths.items():
+            source = os.path.join(source_dir, source_rel)
+            if not os.path.lexists(source):
+                print_err(f"{RED}source {BOLD}{source}{RESET}{RED} does not exist{RESET}")
+                missing += 1
+                continue
+            entries.append((source, rebase(target, home)))
+
+        failed = missing > 0
+        for summary in link_roots(roots, entries, jobs):
+            color = RED if summary.failed else GREEN
+            print(
+                f"{BLUE}{BOLD}{summary.root}{RESET}: {color}{summary.linked} linked, "
+                f"{summary.already_linked} already linked, {summary.failed} failed{RESET}"
+            )
+            for error in summary.errors:
+                print(f"    {RED}{error}{RESET}")
+            failed = failed or summary.failed > 0
 
-        for source_rel, target_str in abs_paths.items():
-            source_path = source_dir / source_rel
-            target_path = Path(target_str)
-            data: LinkData = link(source_path, target_path)
-            if data.msg:
-                print(data.msg)
-            elif not data.already_linked:
-                print(_linked_message(source_path, target_path))
+        if failed:
+            exit(1)
 
-    def unlink_all(self) -> None:
-        abs_paths = self.config.get_absolute_paths()
+    def status(self, as_json: bool = False, jobs: int = 8, strict: bool = False) -> None:
+        from status import EntryStatus
 
-        for source_rel, target_str in abs_paths.items():
-            source_path = Config.get_source_directory() / source_rel
-            msg = unlink(source_path, self.config)
-            if msg:
+        report = self.farm.status(jobs)
+        problems = report.problems()
+        if as_json:
+            print(report.to_json())
+        else:
+            for entry in problems:
+                msg = f"{RED}{BOLD}{entry.status.value}{RESET} {BOLD}{GREEN}{entry.source}{RESET} -> {BLUE}{BOLD}{entry.target}{RESET}"
+                if entry.detail:
+                    msg += f" ({entry.detail})"
                 print(msg)
-            else:
-                print(f"unlinked {BLUE}{BOLD}{source_path}{RESET}")
+            for target, source in report.untracked:
+                print(
+                    f"{RED}{BOLD}untracked-in-fold{RESET} {BLUE}{BOLD}{target}{RESET} (written through a fold to {BOLD}{GREEN}{source}{RESET}, add it or remove it)"
+                )
+            counts = report.counts()
+            summary = ", ".join(f"{counts[status.value]} {status.value}" for status in EntryStatus)
+            if report.untracked:
+                summary += f", {len(report.untracked)} untracked-in-fold"
+            print(summary)
 
-    def unlink_source_match_pattern(self, pattern: str) -> None:
-        abs_paths = self.config.get_absolute_paths()
+        if self.config.metrics_file:
+            from metrics import status_families
 
-        for source_rel, target_str in abs_paths.items():
-            if fnmatch.fnmatch(source_rel, pattern):
-                source_path = Config.get_source_directory() / source_rel
-                msg = unlink(source_path, self.config)
-                if msg:
-                    print(msg)
+            self._write_metrics(status_families(report.counts()))
 
-    def push(self) -> None:
-        source_dir = Config.get_source_directory()
-        git = GitWrapper(source_dir)
+        if strict and (problems or report.untracked):
+            exit(1)
 
-        changes = git.changes(self.config.no_update_on)
-        if not changes:
-            return
+    def _write_metrics(self, families: list) -> None:
+        from metrics import try_write_metrics
 
-        for change in changes:
-            for no_update_pattern in self.config.no_update_on:
-                if fnmatch.fnmatch(change.relative_path, no_update_pattern):
-                    break
-            else:
-                break
-        else:
+        try_write_metrics(self.config.metrics_file, families)
+
+    def plan(self, as_json: bool = False) -> None:
+        plan = self.farm.plan()
+        if as_json:
+            print(plan.to_json())
             return
 
-        for no in self.config.no_new_files:
-            no_new_path = source_dir / no
-            if no_new_path.exists():
-                for change in changes:
-                    if str(change.relative_path).startswith(no):
-                        error_msg = f"File added in no-new-files directory: {
-                            change.relative_path
-                        }"
-                        print(error_msg, file=sys.stderr)
-                        if self.config.push_notify_command:
-                            notify_cmd = self.config.push_notify_command.replace(
-                                "$!SYM_MESSAGE", error_msg
-                            )
-                            subprocess.run(notify_cmd, shell=True)
-                        return
-
-        attempts = 0
-        max_attempts = self.config.max_attempts
-        retry_delays_ms = self.config.retry_delays_ms
-
-        while attempts < max_attempts:
-            git.add_all()
-            git.timestamped_commit()
-            status = git.push()
-
-            if status == GitPushStatus.Success:
-                return
-            elif status == GitPushStatus.NetworkError:
-                attempts += 1
-                if attempts < max_attempts:
-                    time.sleep(retry_delays_ms / 1000.0)
-                    continue
-                else:
-                    error_msg = "Network error: max retry attempts reached"
-                    print(error_msg, file=sys.stderr)
-                    if self.config.push_notify_command:
-                        notify_cmd = self.config.push_notify_command.replace(
-                            "$!SYM_MESSAGE", error_msg
-                        )
-                        subprocess.run(notify_cmd, shell=True)
+        for op in plan.pending():
+            print(_operation_message(op))
+        counts = plan.counts()
+        print(", ".join(f"{count} {kind}" for kind, count in counts.items()))
+
+    def apply(self) -> None:
+        from planner import OperationKind, build_plan, apply_operation
 
-    def add(self, path: Path) -> None:
-        path = absolute_path(path)
         source_dir = Config.get_source_directory()
-        _guard_against_adding_inside_source(path, source_dir)
-        source_path = source_dir / path.name
-        if source_path.resolve() == path.resolve():
-            print("already linked")
-            exit(0)
-        if source_path.exists():
-            counter = 1
-            stem = path.stem
-            suffix = path.suffix
-            while source_path.exists():
-                source_path = source_dir / f"{stem}_{counter}{suffix}"
-                counter += 1
-
-        _safe_move_dir(path, source_path)
-        data = link(source_path, path)
-        msg = data.msg
-        if msg:
-            print_err(msg)
+        plan = build_plan(self.config)
+
+        failed = False
+        for op in plan.pending():
+            if op.kind == OperationKind.CONFLICT:
+                print_err(_operation_message(op))
+                failed = True
+                continue
+            msg = apply_operation(op, source_dir)
+            if msg:
+                print_err(msg)
+                failed = True
+            else:
+                print(_operation_message(op))
+
+        if failed:
             exit(1)
-        else:
-            print(_linked_message(source_path, path))
 
-        rel_path = source_path.relative_to(source_dir)
-        target = str(path)
-        self.config.add_to_paths(str(rel_path), target)
-        self.config.write()
+    def which(self, target: str) -> None:
+        from errors import NoOwner
+
+        try:
+            print(self.farm.which(target))
+        except NoOwner as e:
+            print_err(f"{RED}No source owns {BLUE}{BOLD}{e.path}{RESET}")
+            exit(1)
+
+    def unlink_all(self) -> None:
+        result = self.farm.unlink()
+        for fold, error in result.folds:
+            if error is None:
+                print(f"unlinked {BLUE}{BOLD}{fold}{RESET}")
+            else:
+                print(f"{RED}can't unlink {BLUE}{BOLD}{fold}{RESET}{RED}: {error.strerror}{RESET}")
+        for source_path, error in result.outcomes:
+            if error is None:
+                print(f"unlinked {BLUE}{BOLD}{source_path}{RESET}")
+            else:
+                print(describe(error))
+
+    def unlink_source_match_pattern(self, pattern: str) -> None:
+        result = self.farm.unlink(pattern)
+        _print_unfolded(result.unfolded)
+        for _, error in result.failed:
+            print(describe(error))
+
+    def push(self, force: bool = False) -> None:
+        self.farm.push(force)
+
+    def watch(self, force_polling: bool = False) -> None:
+        from watcher import PollingWatcher, PushWorker, make_watcher, watch
 
-    def add_path_and_group(self, path: Path, group_path: str) -> None:
-        path = absolute_path(path)
         source_dir = Config.get_source_directory()
+        watcher = make_watcher(
+            source_dir, self.config.watch_poll_interval_ms / 1000, force_polling
+        )
+        # the worker reloads the config so edits made while watching apply
+        worker = PushWorker(lambda: CommandProcessor(Config.load()).push())
+        worker.request()
 
-        _guard_against_adding_inside_source(path, source_dir)
+        kind = "polling" if isinstance(watcher, PollingWatcher) else "inotify"
+        print(f"watching {BLUE}{BOLD}{source_dir}{RESET} ({kind})")
+        try:
+            watch(
+                watcher,
+                worker,
+                self.config.watch_debounce_ms / 1000,
+                self.config.watch_max_latency_ms / 1000,
+            )
+        except KeyboardInterrupt:
+            pass
+        finally:
+            worker.stop()
+            watcher.close()
 
-        if ".." in group_path:
-            group_parts = group_path.split("/")
-            for part in group_parts:
-                if part == "..":
-                    raise ValueError(
-                        "Group path cannot escape source directory")
+    def add(self, path: Path) -> None:
+        self.add_path_and_group(path, None)
 
-        group_dir = source_dir / group_path
-        group_dir.mkdir(parents=True, exist_ok=True)
+    def add_path_and_group(self, path: Path, group_path: Optional[str]) -> None:
+        from errors import CustomFileException
 
-        target_path = group_dir / path.name
-        if target_path.resolve() == path.resolve():
+        try:
+            added = self.farm.add(path, group_path)
+        except (CustomFileException, LinkingError) as e:
+            _fail(e)
+        _print_unfolded(added.unfolded)
+        if added.already_linked:
             print("already linked")
             exit(0)
+        print(_linked_message(added.source, added.origin))
 
-        if target_path.exists():
-            counter = 1
-            stem = path.stem
-            suffix = path.suffix
-            while target_path.exists():
-                target_path = group_dir / f"{stem}_{counter}{suffix}"
-                counter += 1
-
-        _safe_move_dir(path, target_path)
-        data = link(target_path, path)
-        msg = data.msg
-        if msg:
-            print_err(msg)
-            exit(1)
-        else:
-            print(_linked_message(target_path, path))
+    def add_many(self, args: list[str], group_path: Optional[str] = None, jobs: int = 8) -> None:
+        from errors import GroupEscapesSource
 
-        rel_path = target_path.relative_to(source_dir)
-        target = str(path)
-        self.config.add_to_paths(str(rel_path), target)
-        self.config.write()
+        paths, unmatched = _expand_add_arguments(args)
+        try:
+            outcomes = self.farm.add_many(paths, group_path, jobs)
+        except GroupEscapesSource as e:
+            _fail(e)
+
+        failures = [f"{RED}nothing matches {BOLD}{BLUE}{arg}{RESET}" for arg in unmatched]
+        added = 0
+        for outcome in outcomes:
+            _print_unfolded(outcome.unfolded)
+            if outcome.error is not None:
+                failures.append(_error_message(outcome.error))
+            else:
+                print(_linked_message(outcome.source, outcome.origin))
+                added += 1
+
+        for failure in failures:
+            print_err(failure)
+        if failures:
+            print_err(f"{RED}{len(failures)} of {len(failures) + added} paths could not be added{RESET}")
+            exit(1)
 
-    def add_to_git_ignore(self, pattern: str) -> None:
+    @staticmethod
+    def add_to_git_ignore(pattern: str) -> None:
         source_dir = Config.get_source_directory()
         source_dir.mkdir(parents=True, exist_ok=True)
         gitignore_path = source_dir / ".gitignore"
@@ -237,7 +352,8 @@ class CommandProcessor:
         else:
             gitignore_path.write_text(f"{pattern}\n")
 
-    def remove_from_git_ignore(self, pattern: str) -> None:
+    @staticmethod
+    def remove_from_git_ignore(pattern: str) -> None:
         source_dir = Config.get_source_directory()
         gitignore_path = source_dir / ".gitignore"
 
@@ -286,180 +402,51 @@ class CommandProcessor:
             self.config.write()
 
     def set_config_value(self, tag: str, setting: str, *values) -> None:
-        self.config.update(tag, setting, *values)
-        self.config.write()
+        from errors import InvalidSetting
+
+        try:
+            self.farm.set(tag, setting, *values)
+        except InvalidSetting as e:
+            print_err(f"{RED}{e.message}{RESET}")
+            exit(1)
 
     def update_sym_data(self) -> None:
         self.config.write()
 
     def dsym(self, pattern: str) -> None:
-        source_dir = Config.get_source_directory()
-        abs_paths = self.config.get_absolute_paths()
-
-        dsymed = False
-        for source_rel, target_str in abs_paths.items():
-            if fnmatch.fnmatch(source_rel, pattern):
-                source_path = source_dir / source_rel
-                target_path = Path(target_str)
-
-                if target_path.is_symlink():
-                    target_path.unlink()
-                elif target_path.exists():
-                    print_err(
-                        f"{RED}Target {BLUE}{BOLD}{target_path}{
-                            RED
-                        } exists and is not a symlink, skipping"
-                    )
-                    continue
-
-                _safe_move_dir(source_path, target_path)
-                self.config.remove_from_paths(target_path)
-                dsymed = True
-
-                print(
-                    f"dsyming from {BLUE}{BOLD}{source_path}{RESET} to {BLUE}{BOLD}{
-                        target_path
-                    }{RESET}"
-                )
+        from errors import MoveFailed, NoMatches, OriginNotRemoved
 
-                self._cleanup_empty_groups(source_dir, source_rel)
-
-        if dsymed:
-            self.config.write()
-        else:
-            print_err(
-                f"{RED}No matches found for pattern: {
-                    BLUE}{BOLD}{pattern}{RESET}"
-            )
-
-    def _cleanup_empty_groups(self, source_dir: Path, source_rel: str) -> None:
-        rel_path = Path(source_rel)
-        if rel_path.parent == Path("."):
+        no_matches = f"{RED}No matches found for pattern: {BLUE}{BOLD}{pattern}{RESET}"
+        try:
+            result = self.farm.dsym(pattern)
+        except NoMatches:
+            print_err(no_matches)
             return
-
-        parent = rel_path.parent
-        while parent != Path("."):
-            group_dir = source_dir / parent
-            if group_dir.exists() and not any(group_dir.iterdir()):
-                try:
-                    group_dir.rmdir()
-                    print(f"removed empty group {BLUE}{
-                          BOLD}{group_dir}{RESET}")
-                except OSError:
-                    break
-            else:
-                break
-            parent = parent.parent
+        except (MoveFailed, OriginNotRemoved) as e:
+            _fail(e, "move")
+
+        _print_unfolded(result.unfolded)
+        for entry in result.entries:
+            if entry.skipped:
+                print_err(
+                    f"{RED}Target {BLUE}{BOLD}{entry.target}{RED} exists and is not a symlink, skipping"
+                )
+                continue
+            print(f"dsyming from {BLUE}{BOLD}{entry.source}{RESET} to {BLUE}{BOLD}{entry.target}{RESET}")
+            _print_removed_groups(entry.removed_groups)
+        if not result.restored:
+            print_err(no_matches)
 
     def regroup(self, path: str, new_group: Optional[str] = None) -> None:
-        source_dir = Config.get_source_directory()
-        old_source_path = source_dir / path
-
-        if not old_source_path.exists():
-            print_err(
-                f"{RED}{BOLD}ERROR{RESET}{RED}: path does not exist in source directory: {
-                    BLUE}{BOLD}{path}{RESET}"
-            )
-            exit(1)
-
-        filename = Path(path).name
-        if new_group:
-            new_rel = f"{new_group}/{filename}"
-        else:
-            new_rel = filename
-
-        new_source_path = source_dir / new_rel
-        if new_source_path.exists():
-            counter = 1
-            stem = Path(filename).stem
-            suffix = Path(filename).suffix
-            while new_source_path.exists():
-                if suffix:
-                    new_rel = (
-                        f"{new_group}/{stem}_{counter}{suffix}"
-                        if new_group
-                        else f"{stem}_{counter}{suffix}"
-                    )
-                else:
-                    new_rel = (
-                        f"{new_group}/{stem}_{counter}"
-                        if new_group
-                        else f"{stem}_{counter}"
-                    )
-                new_source_path = source_dir / new_rel
-                counter += 1
+        from errors import CustomFileException, OriginNotRemoved
 
         try:
-            new_source_path.parent.mkdir(parents=True, exist_ok=True)
-            shutil.move(
-                str(old_source_path.absolute()), str(
-                    new_source_path.absolute())
-            )
-        except PermissionError as e:
-            print_err(
-                f"{RED}{BOLD}PERMISSION DENIED{RESET}{RED}: can't move {BLUE}{BOLD}{
-                    old_source_path.absolute()}{RED} to {BLUE}{BOLD}{new_source_path.absolute()}{RED} {RESET}"
-            )
-            exit(1)
-        except FileNotFoundError as e:
-            print_err(
-                f"{RED}{BOLD}FILE NOT FOUND{RESET}{RED}: can't move {
-                    BLUE}{BOLD}{old_source_path.absolute()}{RED} {RESET}"
-            )
-            exit(1)
-        except OSError as e:
-            print_err(
-                f"{RED}{BOLD}ERROR{RESET}{RED}: can't move {BLUE}{BOLD}{old_source_path.absolute(
-                )}{RED} to {BLUE}{BOLD}{new_source_path.absolute()}{RED}: {e}{RESET}"
-            )
-            exit(1)
-
-        if path in self.config.paths:
-            target_str = self.config.paths[path]
-            target_path = absolute_path(target_str)
-            if (
-                target_path.is_symlink()
-                and target_path.resolve() == old_source_path.resolve()
-            ):
-                try:
-                    target_path.unlink()
-                    target_path.symlink_to(new_source_path)
-                except PermissionError:
-                    print_err(
-                        f"{RED}{BOLD}PERMISSION DENIED{RESET}{RED}: can't update symlink at {
-                            BLUE}{BOLD}{target_path.absolute()}{RED} {RESET}"
-                    )
-                    exit(1)
-                except OSError as e:
-                    print_err(
-                        f"{RED}{BOLD}ERROR{RESET}{RED}: can't update symlink at {
-                            BLUE}{BOLD}{target_path.absolute()}{RED}: {e}{RESET}"
-                    )
-                    exit(1)
-
-            new_paths = {}
-            for k, v in self.config._paths.items():
-                if k == path:
-                    new_paths[new_rel] = v
-                else:
-                    new_paths[k] = v
-            self.config._paths = new_paths
-
-        self._cleanup_empty_groups(source_dir, path)
-        self.config.write()
-
-        old_group = Path(path).parent
-        if old_group != Path("."):
-            old_group_dir = source_dir / old_group
-            if old_group_dir.exists() and not any(old_group_dir.iterdir()):
-                try:
-                    old_group_dir.rmdir()
-                    print(
-                        f"regroup: removed empty group {
-                            BLUE}{BOLD}{old_group_dir}{RESET}"
-                    )
-                except OSError:
-                    pass
-
-        print(f"regrouped {BLUE}{BOLD}{path}{
-              RESET} to {BLUE}{BOLD}{new_rel}{RESET}")
+            result = self.farm.regroup(path, new_group)
+        except OriginNotRemoved as e:
+            _fail(e)
+        except (CustomFileException, LinkingError) as e:
+            _fail(e, "move")
+
+        _print_unfolded(result.unfolded)
+        _print_removed_groups(result.removed_groups)
+        print(f"regrouped {BLUE}{BOLD}{path}{RESET} to {BLUE}{BOLD}{result.new}{RESET}")
@@ -1,18 +1,185 @@
 import os
 import pathlib
-from utils import get_home_dir
+from bisect import bisect_left, insort
+from collections.abc import Iterable, Iterator, MutableMapping
+from spans import span, traced
+from utils import FSYNC_FULL, FSYNC_POLICIES, atomic_write, get_home_dir, normalize_target
 from typing import Optional
-import tomllib
+
+MISC_GROUP = "misc."
+DEFAULT_RETRY_BACKOFF = 2.0
+DEFAULT_RETRY_MAX_DELAY_MS = 60000
+DEFAULT_RETRY_DEADLINE_MS = 60000
+DEFAULT_WATCH_DEBOUNCE_MS = 2000
+DEFAULT_WATCH_MAX_LATENCY_MS = 30000
+DEFAULT_WATCH_POLL_INTERVAL_MS = 5000
+DEFAULT_FSYNC = FSYNC_FULL
+DEFAULT_NOTIFY_TIMEOUT_MS = 5000
+DEFAULT_NOTIFY_COALESCE_MS = 300000
+
+
+def _check_fsync(value: str) -> str:
+    if value not in FSYNC_POLICIES:
+        raise ValueError(f"fsync must be one of {', '.join(FSYNC_POLICIES)}, not {value!r}")
+    return value
+
+
+def _top_level_group(path: str) -> str:
+    if "/" in path:
+        return path.split("/")[0]
+    return MISC_GROUP
+
+
+def _path_sort_key(path: str) -> tuple:
+    return tuple(path.split("/"))
+
+
+class PathTable(MutableMapping):
+    """
+    The [paths] table. Behaves like a dict of source -> target, but also keeps
+    every source bucketed by its top-level group and sorted by path segments as
+    entries are inserted and removed, so serializing never has to regroup or
+    re-sort the whole table. A reverse index from normalized target to sources
+    makes target lookups O(1).
+    """
+
+    def __init__(self, items: Optional[dict[str, str]] = None):
+        self._entries: dict[str, str] = {}
+        self._groups: dict[str, list[tuple[tuple, str]]] = {}
+        self._by_target: dict[str, dict[str, None]] = {}
+        self._home = str(get_home_dir())
+        if items:
+            for source, target in items.items():
+                self[source] = target
+
+    def __getitem__(self, source: str) -> str:
+        return self._entries[source]
+
+    def __setitem__(self, source: str, target: str) -> None:
+        if source in self._entries:
+            self._unindex_target(source, self._entries[source])
+        else:
+            bucket = self._groups.setdefault(_top_level_group(source), [])
+            insort(bucket, (_path_sort_key(source), source))
+        self._entries[source] = target
+        key = normalize_target(target, self._home)
+        self._by_target.setdefault(key, {})[source] = None
+
+    def __delitem__(self, source: str) -> None:
+        self._unindex_target(source, self._entries.pop(source))
+        group = _top_level_group(source)
+        bucket = self._groups[group]
+        del bucket[bisect_left(bucket, (_path_sort_key(source), source))]
+        if not bucket:
+            del self._groups[group]
+
+    def __contains__(self, source: object) -> bool:
+        return source in self._entries
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def keys(self):
+        return self._entries.keys()
+
+    def values(self):
+        return self._entries.values()
+
+    def items(self):
+        return self._entries.items()
+
+    def _unindex_target(self, source: str, target: str) -> None:
+        key = normalize_target(target, self._home)
+        sources = self._by_target[key]
+        del sources[source]
+        if not sources:
+            del self._by_target[key]
+
+    def _environment(self, has_relative: bool) -> tuple:
+        # everything normalize_target reads besides the target itself
+        cwd = os.getcwd() if has_relative else None
+        return self._home, os.path.expanduser("~"), cwd
+
+    def state(self, order: Optional[Iterable[str]] = None) -> tuple:
+        """
+        The table's indexes in a marshal friendly form, so from_state can
+        rebuild it without normalizing every target again. `order` is the order
+        of the sources in the file, which a fresh parse would iterate in.
+        """
+        if order is None:
+            order = self._entries
+        key_of = {
+            source: key for key, sources in self._by_target.items() for source in sources
+        }
+        entries = {}
+        by_target: dict[str, dict[str, None]] = {}
+        for source in order:
+            entries[source] = self._entries[source]
+            by_target.setdefault(key_of[source], {})[source] = None
+        groups = {
+            group: self._groups[group]
+            for group in dict.fromkeys(map(_top_level_group, entries))
+        }
+        has_relative = any(not t.startswith(("~", "/")) for t in entries.values())
+        return entries, groups, by_target, self._environment(has_relative)
+
+    @staticmethod
+    def from_state(state: tuple) -> "PathTable":
+        entries, groups, by_target, environment = state
+        table = PathTable()
+        if environment != table._environment(environment[2] is not None):
+            return PathTable(entries)
+        table._entries = entries
+        table._groups = groups
+        table._by_target = by_target
+        return table
+
+    def sources_for(self, target: str) -> list[str]:
+        """
+        Sources whose target normalizes to the same path as `target`, in the
+        order they were added.
+        """
+        return list(self._by_target.get(normalize_target(target, self._home), ()))
+
+    def duplicate_targets(self) -> dict[str, list[str]]:
+        return {
+            target: list(sources)
+            for target, sources in self._by_target.items()
+            if len(sources) > 1
+        }
+
+    def group_names(self) -> list[str]:
+        return list(self._groups)
+
+    def group_items(self, group: str) -> Iterator[tuple[str, str]]:
+        for _, source in self._groups.get(group, []):
+            yield source, self._entries[source]
 
 
 class Config:
     no_new_files: list[str]
     no_update_on: list[str]
     push_notify_command: Optional[str]
+    metrics_file: Optional[str]
     retry_delays_ms: int
     max_attempts: int
+    retry_backoff: float
+    retry_max_delay_ms: int
+    retry_deadline_ms: int
+    remotes: list[str]
+    watch_debounce_ms: int
+    watch_max_latency_ms: int
+    watch_poll_interval_ms: int
+    notify_file: Optional[str]
+    notify_socket: Optional[str]
+    notify_timeout_ms: int
+    notify_coalesce_ms: int
     group_order_override: list[str]
-    _paths: dict[str, str]
+    fsync: str
+    _paths: PathTable
 
     @staticmethod
     def _config_path() -> pathlib.Path:
@@ -33,6 +200,7 @@ class Config:
         return pathlib.Path(source_dir)
 
     @staticmethod
+    @traced("config.load")
     def load() -> "Config":
         config_path = Config._config_path()
         config = Config()
@@ -40,17 +208,49 @@ class Config:
         config.no_new_files = []
         config.no_update_on = []
         config.push_notify_command = None
+        config.metrics_file = None
         config.notify_on_error_only = True
         config.retry_delays_ms = 6000
         config.max_attempts = 10
+        config.retry_backoff = DEFAULT_RETRY_BACKOFF
+        config.retry_max_delay_ms = DEFAULT_RETRY_MAX_DELAY_MS
+        config.retry_deadline_ms = DEFAULT_RETRY_DEADLINE_MS
+        config.remotes = []
+        config.watch_debounce_ms = DEFAULT_WATCH_DEBOUNCE_MS
+        config.watch_max_latency_ms = DEFAULT_WATCH_MAX_LATENCY_MS
+        config.watch_poll_interval_ms = DEFAULT_WATCH_POLL_INTERVAL_MS
+        config.notify_file = None
+        config.notify_socket = None
+        config.notify_timeout_ms = DEFAULT_NOTIFY_TIMEOUT_MS
+        config.notify_coalesce_ms = DEFAULT_NOTIFY_COALESCE_MS
         config.group_order_override = []
-        config._paths = {}
+        config.fsync = DEFAULT_FSYNC
+        config._paths = PathTable()
 
         if not config_path.exists():
             return config
 
         with open(config_path, "rb") as f:
-            data = tomllib.load(f)
+            raw = f.read()
+            st = os.fstat(f.fileno())
+
+        from metacache import load_cached, store_cache
+
+        with span("config.cache"):
+            cached = load_cached(raw, st)
+        if cached is not None:
+            data, paths_state = cached
+            config._paths = PathTable.from_state(paths_state)
+        else:
+            import tomllib
+
+            with span("config.parse"):
+                data = tomllib.loads(raw.decode())
+            with span("config.paths"):
+                if "paths" in data:
+                    config._paths = PathTable(data.pop("paths"))
+            with span("config.cache"):
+                store_cache(raw, st, (data, config._paths.state()))
 
         if "general" in data:
             general = data["general"]
@@ -61,8 +261,12 @@ class Config:
             if "push-notify-command" in general:
                 val = general["push-notify-command"]
                 config.push_notify_command = val if val else None
+            if "metrics-file" in general:
+                config.metrics_file = general["metrics-file"] or None
             if "group-order-override" in general:
                 config.group_order_override = general["group-order-override"]
+            if "fsync" in general:
+                config.fsync = _check_fsync(general["fsync"])
 
         if "network" in data:
             network = data["network"]
@@ -70,9 +274,34 @@ class Config:
                 config.retry_delays_ms = network["retry-delays-ms"]
             if "max-attempts" in network:
                 config.max_attempts = network["max-attempts"]
-
-        if "paths" in data:
-            config._paths = dict(data["paths"])
+            if "retry-backoff" in network:
+                config.retry_backoff = float(network["retry-backoff"])
+            if "retry-max-delay-ms" in network:
+                config.retry_max_delay_ms = network["retry-max-delay-ms"]
+            if "retry-deadline-ms" in network:
+                config.retry_deadline_ms = network["retry-deadline-ms"]
+            if "remotes" in network:
+                config.remotes = network["remotes"]
+
+        if "watch" in data:
+            watch = data["watch"]
+            if "debounce-ms" in watch:
+                config.watch_debounce_ms = watch["debounce-ms"]
+            if "max-latency-ms" in watch:
+                config.watch_max_latency_ms = watch["max-latency-ms"]
+            if "poll-interval-ms" in watch:
+                config.watch_poll_interval_ms = watch["poll-interval-ms"]
+
+        if "notify" in data:
+            notify = data["notify"]
+            if "file" in notify:
+                config.notify_file = notify["file"] or None
+            if "socket" in notify:
+                config.notify_socket = notify["socket"] or None
+            if "timeout-ms" in notify:
+                config.notify_timeout_ms = notify["timeout-ms"]
+            if "coalesce-ms" in notify:
+                config.notify_coalesce_ms = notify["coalesce-ms"]
 
         return config
 
@@ -84,38 +313,71 @@ class Config:
                 self.no_update_on = list(values)
             elif key == "push-notify-command":
                 self.push_notify_command = values[0] if values else None
+            elif key == "metrics-file":
+                self.metrics_file = values[0] if values and values[0] else None
+            elif key == "fsync":
+                self.fsync = _check_fsync(values[0])
         elif tag == "network":
             if key == "retry-delays-ms":
                 self.retry_delays_ms = int(values[0])
             elif key == "max-attempts":
                 self.max_attempts = int(values[0])
+            elif key == "retry-backoff":
+                self.retry_backoff = float(values[0])
+            elif key == "retry-max-delay-ms":
+                self.retry_max_delay_ms = int(values[0])
+            elif key == "retry-deadline-ms":
+                self.retry_deadline_ms = int(values[0])
+            elif key == "remotes":
+                self.remotes = list(values)
+        elif tag == "watch":
+            if key == "debounce-ms":
+                self.watch_debounce_ms = int(values[0])
+            elif key == "max-latency-ms":
+                self.watch_max_latency_ms = int(values[0])
+            elif key == "poll-interval-ms":
+                self.watch_poll_interval_ms = int(values[0])
+        elif tag == "notify":
+            if key == "file":
+                self.notify_file = values[0] if values and values[0] else None
+            elif key == "socket":
+                self.notify_socket = values[0] if values and values[0] else None
+            elif key == "timeout-ms":
+                self.notify_timeout_ms = int(values[0])
+            elif key == "coalesce-ms":
+                self.notify_coalesce_ms = int(values[0])
 
     def add_to_paths(self, source_path: str, target: str) -> None:
-        from utils import absolute_path, unexpand_path
-
-        abs_target = absolute_path(target)
-        unexpanded_target = unexpand_path(abs_target)
-        self._paths[source_path] = str(unexpanded_target)
+        self._paths[source_path] = normalize_target(target)
 
     def remove_from_paths(self, path: str) -> None:
-        from utils import absolute_path
-
-        abs_path = absolute_path(path)
-        from utils import unexpand_path
-
-        unexpanded = unexpand_path(abs_path)
-        path_str = str(unexpanded)
-
-        keys_to_remove = []
-        for key, value in self._paths.items():
-            if value == path_str:
-                keys_to_remove.append(key)
-
-        for key in keys_to_remove:
+        for key in self._paths.sources_for(str(path)):
             del self._paths[key]
 
+    def find_owner(self, target: str) -> Optional[tuple[str, str]]:
+        """
+        Returns the source owning `target` and the remainder of `target` below
+        that source's link, walking up so files inside a linked directory are
+        found too. Returns None if no entry covers `target`.
+        """
+        normalized = normalize_target(target)
+        remainder = ""
+        while True:
+            sources = self._paths.sources_for(normalized)
+            if sources:
+                return sources[0], remainder
+            parent, name = os.path.split(normalized)
+            if not parent or not name or parent == normalized:
+                return None
+            remainder = f"{name}/{remainder}" if remainder else name
+            normalized = parent
+
+    def move_in_paths(self, old_source: str, new_source: str) -> None:
+        if old_source in self._paths:
+            self._paths[new_source] = self._paths.pop(old_source)
+
     @property
-    def paths(self) -> dict[str, str]:
+    def paths(self) -> PathTable:
         return self._paths
 
     def get_absolute_paths(self) -> dict[str, str]:
@@ -127,68 +389,129 @@ class Config:
             result[source] = str(abs_target)
         return dict(result)
 
+    def render(self) -> str:
+        """the metadata file as `write` saves it"""
+        out = ["[general]\n"]
+        out.append(f"no-new-files = {self._serialize_list(self.no_new_files)}\n")
+        out.append(f"no-update-on = {self._serialize_list(self.no_update_on)}\n")
+        cmd = self.push_notify_command
+        if cmd:
+            out.append(f'push-notify-command = "{cmd}"\n')
+        if self.metrics_file:
+            out.append(f'metrics-file = "{self.metrics_file}"\n')
+        if self.group_order_override:
+            out.append(
+                f"group-order-override = {self._serialize_list(self.group_order_override)}\n"
+            )
+        if self.fsync != DEFAULT_FSYNC:
+            out.append(f'fsync = "{self.fsync}"\n')
+
+        out.append("\n[network]\n")
+        out.append(f"retry-delays-ms = {self.retry_delays_ms}\n")
+        out.append(f"max-attempts = {self.max_attempts}\n")
+        if self.retry_backoff != DEFAULT_RETRY_BACKOFF:
+            out.append(f"retry-backoff = {self.retry_backoff}\n")
+        if self.retry_max_delay_ms != DEFAULT_RETRY_MAX_DELAY_MS:
+            out.append(f"retry-max-delay-ms = {self.retry_max_delay_ms}\n")
+        if self.retry_deadline_ms != DEFAULT_RETRY_DEADLINE_MS:
+            out.append(f"retry-deadline-ms = {self.retry_deadline_ms}\n")
+        if self.remotes:
+            out.append(f"remotes = {self._serialize_list(self.remotes)}\n")
+
+        watch_lines = []
+        if self.watch_debounce_ms != DEFAULT_WATCH_DEBOUNCE_MS:
+            watch_lines.append(f"debounce-ms = {self.watch_debounce_ms}\n")
+        if self.watch_max_latency_ms != DEFAULT_WATCH_MAX_LATENCY_MS:
+            watch_lines.append(f"max-latency-ms = {self.watch_max_latency_ms}\n")
+        if self.watch_poll_interval_ms != DEFAULT_WATCH_POLL_INTERVAL_MS:
+            watch_lines.append(f"poll-interval-ms = {self.watch_poll_interval_ms}\n")
+        if watch_lines:
+            out.append("\n[watch]\n")
+            out.extend(watch_lines)
+
+        notify_lines = []
+        if self.notify_file:
+            notify_lines.append(f'file = "{self.notify_file}"\n')
+        if self.notify_socket:
+            notify_lines.append(f'socket = "{self.notify_socket}"\n')
+        if self.notify_timeout_ms != DEFAULT_NOTIFY_TIMEOUT_MS:
+            notify_lines.append(f"timeout-ms = {self.notify_timeout_ms}\n")
+        if self.notify_coalesce_ms != DEFAULT_NOTIFY_COALESCE_MS:
+            notify_lines.append(f"coalesce-ms = {self.notify_coalesce_ms}\n")
+        if notify_lines:
+            out.append("\n[notify]\n")
+            out.extend(notify_lines)
+
+        out.append("\n[paths]\n")
+        ordered_groups = self._get_ordered_groups()
+        for i, group_name in enumerate(ordered_groups):
+            if i > 0:
+                out.append("\n")
+            out.append(f"# {group_name}\n")
+            for source, target in self._paths.group_items(group_name):
+                out.append(f'"{source}" = "{target}"\n')
+        return "".join(out)
+
+    @traced("config.write")
     def write(self) -> None:
+        """
+        Saves the config unless the file already holds exactly what would be
+        written, so a no-op save never touches the mtime, dirties the git repo or
+        triggers a push. The new file is renamed into place and synced according
+        to the fsync setting, a crash leaves either the old or the new file.
+        """
         config_path = self._config_path()
-        config_path.parent.mkdir(parents=True, exist_ok=True)
+        rendered = self.render().encode()
+        try:
+            with open(config_path, "rb") as f:
+                if f.read() == rendered:
+                    return
+        except FileNotFoundError:
+            pass
 
-        with open(config_path, "w") as f:
-            f.write("[general]\n")
-            f.write(f"no-new-files = {self._serialize_list(self.no_new_files)}\n")
-            f.write(f"no-update-on = {self._serialize_list(self.no_update_on)}\n")
-            cmd = self.push_notify_command
-            if cmd:
-                f.write(f'push-notify-command = "{cmd}"\n')
-            if self.group_order_override:
-                f.write(
-                    f"group-order-override = {self._serialize_list(self.group_order_override)}\n"
-                )
-
-            f.write("\n[network]\n")
-            f.write(f"retry-delays-ms = {self.retry_delays_ms}\n")
-            f.write(f"max-attempts = {self.max_attempts}\n")
-
-            f.write("\n[paths]\n")
-            ordered_groups = self._get_ordered_groups()
-            for i, group_name in enumerate(ordered_groups):
-                if i > 0:
-                    f.write("\n")
-                f.write(f"# {group_name}\n")
-                sorted_paths = sorted(
-                    self._get_grouped_paths()[group_name].items(),
-                    key=lambda x: self._path_sort_key(x[0]),
-                )
-                for source, target in sorted_paths:
-                    f.write(f'"{source}" = "{target}"\n')
-
-    def _get_grouped_paths(self) -> dict[str, dict[str, str]]:
-        groups: dict[str, dict[str, str]] = {}
-        for source, target in self._paths.items():
-            group_name = self._get_top_level_group(source)
-            if group_name not in groups:
-                groups[group_name] = {}
-            groups[group_name][source] = target
-        return groups
-
-    def _get_top_level_group(self, path: str) -> str:
-        if "/" in path:
-            return path.split("/")[0]
-        return "misc."
+        config_path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(config_path, rendered, self.fsync)
+
+        self._store_cache(rendered, os.stat(config_path))
+
+    def _store_cache(self, rendered: bytes, st: os.stat_result) -> None:
+        """
+        Caches what the next load would parse from `rendered`. It is parsed
+        here rather than rebuilt from the fields, so the cache can never differ
+        from the file.
+        """
+        import tomllib
+
+        from metacache import store_cache
+
+        try:
+            data = tomllib.loads(rendered.decode())
+        except tomllib.TOMLDecodeError:
+            # a string write doesn't escape, the next load reports it
+            return
+        paths = data.pop("paths", {})
+        # the table already holds these entries, only their file order is new
+        if paths == self._paths._entries:
+            paths_state = self._paths.state(paths)
+        else:
+            paths_state = PathTable(paths).state()
+        store_cache(rendered, st, (data, paths_state))
 
     def _get_ordered_groups(self) -> list[str]:
-        groups = self._get_grouped_paths()
+        groups = self._paths.group_names()
         override = self.group_order_override
 
         ordered = []
         remaining = []
         has_misc = False
-        misc_in_override = "misc." in override
+        misc_in_override = MISC_GROUP in override
 
         for group_name in override:
             if group_name in groups:
                 ordered.append(group_name)
 
         for group in groups:
-            if group == "misc.":
+            if group == MISC_GROUP:
                 has_misc = True
             elif group not in override:
                 remaining.append(group)
@@ -196,12 +519,9 @@ class Config:
         remaining.sort(key=lambda g: g.lower())
         result = ordered + remaining
         if has_misc and not misc_in_override:
-            result.append("misc.")
+            result.append(MISC_GROUP)
         return result
 
-    def _path_sort_key(self, path: str) -> tuple:
-        return tuple(path.split("/"))
-
     def _serialize_list(self, lst: list[str]) -> str:
         if not lst:
             return "[]"
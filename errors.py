@@ -59,3 +59,106 @@ class FileNotDirectory(CustomFileException):
     def __init__(self, path: Path):
         super().__init__(path)
         self.message = f"{path} is a file not a directory"
+
+
+class OriginNotRemoved(CustomFileException):
+    def __init__(self, path: Path, dest: Path):
+        super().__init__(path)
+        self.dest = dest
+        self.message = f"copied {path} to {dest} but couldn't remove the original"
+
+
+class SourceNotFound(LinkingError):
+    def __init__(self, source: Path):
+        super().__init__()
+        self.source = source
+        self.message = f"can't link source does not exist: {source}"
+
+
+class LinkPointsElsewhere(LinkingError):
+    def __init__(self, dest_path: Path, source: Path):
+        super().__init__()
+        self.dest_path = dest_path
+        self.source = source
+        self.message = f"{dest_path} is a symlink but doesn't point to {source}"
+
+
+class NotALink(LinkingError):
+    def __init__(self, dest_path: Path):
+        super().__init__()
+        self.dest_path = dest_path
+        self.message = f"can't unlink {dest_path}, it is not a symlink into the farm"
+
+
+class RelinkFailed(LinkingError):
+    def __init__(self, dest_path: Path, source: Path, cause: OSError):
+        super().__init__()
+        self.dest_path = dest_path
+        self.source = source
+        self.cause = cause
+        reason = cause.strerror or str(cause)
+        self.message = f"can't update the link at {dest_path} to {source}: {reason}"
+
+
+class InsideSourceDirectory(CustomFileException):
+    def __init__(self, path: Path, source_dir: Path):
+        super().__init__(path)
+        self.source_dir = source_dir
+        self.message = f"cannot add {path}, it is inside the source directory {source_dir}"
+
+
+class ContainsSourceDirectory(CustomFileException):
+    def __init__(self, path: Path, source_dir: Path):
+        super().__init__(path)
+        self.source_dir = source_dir
+        self.message = f"cannot add {path}, it contains the source directory {source_dir}"
+
+
+class NotInSourceDirectory(CustomFileException):
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self.message = f"{path} does not exist in the source directory"
+
+
+class GroupEscapesSource(CustomFileException):
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self.message = f"group path {path} cannot escape the source directory"
+
+
+class MoveFailed(CustomFileException):
+    def __init__(self, path: Path, dest: Path, cause: OSError):
+        super().__init__(path)
+        self.dest = dest
+        self.cause = cause
+        reason = cause.strerror or str(cause)
+        self.message = f"can't move {path} to {dest}: {reason}"
+
+
+class NotMovedBack(CustomFileException):
+    def __init__(self, path: Path, dest: Path, error: LinkingError):
+        super().__init__(path)
+        self.dest = dest
+        self.error = error
+        self.message = f"{error.message}, and {path} could not be moved back from {dest}"
+
+
+class NoOwner(CustomFileException):
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self.message = f"no source owns {path}"
+
+
+class NoMatches(Exception):
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self.message = f"no matches found for pattern: {pattern}"
+        super().__init__(self.message)
+
+
+class InvalidSetting(Exception):
+    def __init__(self, tag: str, key: str, reason: str):
+        self.tag = tag
+        self.key = key
+        self.message = reason
+        super().__init__(self.message)
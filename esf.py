@@ -1,6 +1,12 @@
 import sys
-from cli import Parser
+from client import run_via_server
 
 if __name__ == "__main__":
+    code = run_via_server(sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
+
+    from cli import Parser
+
     parser = Parser()
     parser.dispatch(*sys.argv[1:])
@@ -0,0 +1,111 @@
+import os
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+# (source, target relative to the root) pairs, handed to every worker once by
+# the pool initializer instead of being pickled along with every root
+_entries: list[tuple[str, str]] = []
+
+
+def rebase(target: str, home: str) -> str:
+    """`target` from [paths] as a path relative to any root, `~` meaning `home`"""
+    if target == "~" or target.startswith("~/"):
+        target = home + target[1:]
+    else:
+        target = os.path.abspath(target)
+    return os.path.normpath(target).lstrip(os.sep)
+
+
+@dataclass
+class RootSummary:
+    root: str
+    linked: int = 0
+    already_linked: int = 0
+    failed: int = 0
+    errors: list[str] = field(default_factory=list)
+
+
+def _init_worker(entries: list[tuple[str, str]]) -> None:
+    global _entries
+    _entries = entries
+
+
+def _inside(path: str, real_root: str) -> bool:
+    return path == real_root or path.startswith(real_root + os.sep)
+
+
+def _prepare_parent(parent: str, real_root: str) -> Optional[str]:
+    """creates `parent`, unless a symlink in the root leads it outside, or says why not"""
+    existing = parent
+    while not os.path.lexists(existing):
+        existing = os.path.dirname(existing)
+    if not _inside(os.path.realpath(existing), real_root):
+        return f"{parent} leads outside the root"
+    try:
+        os.makedirs(parent, exist_ok=True)
+    except OSError as e:
+        return f"can't create {parent}: {e.strerror}"
+    return None
+
+
+def link_root(root: str) -> RootSummary:
+    """
+    Links every entry into `root`. Parent directories are prepared once each,
+    and an existing target costs a readlink only when the symlink call fails.
+    """
+    summary = RootSummary(root)
+    real_root = os.path.realpath(root)
+    if not os.path.isdir(real_root):
+        summary.failed = len(_entries)
+        summary.errors.append(f"{root} is not a directory")
+        return summary
+
+    parents: dict[str, Optional[str]] = {}
+    for source, relative in _entries:
+        target = os.path.join(root, relative)
+        parent = os.path.dirname(target)
+        if parent not in parents:
+            parents[parent] = _prepare_parent(parent, real_root)
+            if parents[parent] is not None:
+                summary.errors.append(parents[parent])
+        if parents[parent] is not None:
+            summary.failed += 1
+            continue
+
+        try:
+            os.symlink(source, target)
+            summary.linked += 1
+        except FileExistsError:
+            try:
+                existing = os.readlink(target)
+            except OSError:
+                existing = None
+            if existing == source:
+                summary.already_linked += 1
+            else:
+                summary.failed += 1
+                summary.errors.append(f"{target} already exists")
+        except OSError as e:
+            summary.failed += 1
+            summary.errors.append(f"can't link {target}: {e.strerror}")
+    return summary
+
+
+def link_roots(
+    roots: list[str], entries: list[tuple[str, str]], jobs: int
+) -> Iterator[RootSummary]:
+    """links `entries` into every root, `jobs` roots at a time, yielding summaries in order"""
+    if jobs == 1 or len(roots) == 1:
+        _init_worker(entries)
+        for root in roots:
+            yield link_root(root)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(
+        max_workers=min(jobs, len(roots)),
+        initializer=_init_worker,
+        initargs=(entries,),
+    ) as pool:
+        yield from pool.map(link_root, roots)
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+from config import Config
+from spans import traced
+from state import read_state, write_state
+
+FINGERPRINT_KIND = "pushfingerprint"
+
+
+def _hash_tree(hasher, source_dir: str, skip_prefix: str) -> None:
+    stack = [source_dir]
+    while stack:
+        directory = stack.pop()
+        try:
+            st = os.stat(directory)
+            entries = sorted(os.scandir(directory), key=lambda e: e.name)
+        except OSError:
+            continue
+        hasher.update(f"d{directory}\0{st.st_mtime_ns}\0".encode())
+
+        for entry in entries:
+            if directory == source_dir and (
+                entry.name == ".git" or entry.name.startswith(skip_prefix)
+            ):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                    continue
+                est = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            # directory mtimes only see creates, deletes and renames; in place
+            # edits show up in the file's own size and mtime
+            hasher.update(f"f{entry.name}\0{est.st_size}\0{est.st_mtime_ns}\0".encode())
+
+
+def _hash_git_state(hasher, git_dir: Path) -> None:
+    for name in ("index", "packed-refs"):
+        try:
+            st = os.stat(git_dir / name)
+            hasher.update(f"{name}\0{st.st_size}\0{st.st_mtime_ns}\0".encode())
+        except OSError:
+            hasher.update(f"{name}\0missing\0".encode())
+
+    try:
+        head = (git_dir / "HEAD").read_text().strip()
+    except OSError:
+        return
+    hasher.update(f"HEAD\0{head}\0".encode())
+    if head.startswith("ref: "):
+        try:
+            hasher.update((git_dir / head[5:]).read_bytes())
+        except OSError:
+            pass
+
+
+@traced("push.fingerprint")
+def compute_fingerprint(source_dir: Path) -> str:
+    """
+    A cheap digest of everything `git status` would look at: the mtime of
+    every directory and the size and mtime of every file in the work tree, the
+    git index and HEAD. Equal fingerprints mean nothing could have changed.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    skip_prefix = f".{Config._config_path().name}."
+    _hash_tree(hasher, str(source_dir), skip_prefix)
+    _hash_git_state(hasher, source_dir / ".git")
+    return hasher.hexdigest()
+
+
+def load_fingerprint() -> dict:
+    raw = read_state(FINGERPRINT_KIND)
+    if raw is None:
+        return {}
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return {}
+
+
+def save_fingerprint(
+    fingerprint: Optional[str],
+    status_caches: bool,
+    pending_remotes: Optional[list[str]] = None,
+) -> None:
+    data = {
+        "fingerprint": fingerprint,
+        "status_caches": status_caches,
+        "pending_remotes": pending_remotes or [],
+    }
+    write_state(FINGERPRINT_KIND, json.dumps(data).encode())
@@ -0,0 +1,245 @@
+import os
+from typing import Iterable, Optional
+
+from utils import link_destination
+
+# A fold replaces a target directory whose whole tree is made of links into
+# one source directory with a single link to that source directory, the way
+# stow folds trees. Folds are only recognized on disk: a directory symlink
+# pointing into the source directory. Unfolding turns a fold back into a real
+# directory holding one link per child of the source directory, so a fold is
+# only ever taken apart one level at a time.
+
+
+class FoldFinder:
+    """
+    Finds the fold a path lies under. Every directory is lstat'ed at most once,
+    so checking thousands of targets costs one lstat per distinct ancestor.
+    """
+
+    def __init__(self, source_dir: str):
+        self.source_dir = source_dir
+        self._cache: dict[str, Optional[tuple[str, str]]] = {}
+
+    def fold_of(self, directory: str) -> Optional[tuple[str, str]]:
+        """the (fold, source directory) `directory` is or lies under, if any"""
+        if directory in self._cache:
+            return self._cache[directory]
+
+        parent = os.path.dirname(directory)
+        result = None
+        if os.path.islink(directory):
+            try:
+                destination = link_destination(directory, os.readlink(directory))
+            except OSError:
+                destination = ""
+            if destination.startswith(self.source_dir + os.sep):
+                result = (directory, destination)
+        elif parent != directory:
+            result = self.fold_of(parent)
+        self._cache[directory] = result
+        return result
+
+    def covers(self, source: str, target: str) -> bool:
+        """True if `target` lies under a fold that already shows `source` there"""
+        found = self.fold_of(os.path.dirname(target))
+        return found is not None and source == found[1] + target[len(found[0]) :]
+
+    def forget(self) -> None:
+        self._cache.clear()
+
+
+def unfold(fold: str) -> None:
+    source = link_destination(fold, os.readlink(fold))
+    mode = os.stat(source).st_mode & 0o7777
+    os.unlink(fold)
+    os.mkdir(fold)
+    os.chmod(fold, mode)
+    with os.scandir(source) as children:
+        for child in children:
+            os.symlink(child.path, os.path.join(fold, child.name))
+
+
+def unfold_conflicts(source_dir: str, pairs: Iterable[tuple[str, str]]) -> list[str]:
+    """
+    Unfolds every fold a (source, target) pair would have to put a link
+    inside, because the target is not where the fold already shows the source.
+    Returns the unfolded directories.
+    """
+    finder = FoldFinder(source_dir)
+    unfolded = []
+    for source, target in pairs:
+        while not finder.covers(source, target):
+            found = finder.fold_of(os.path.dirname(target))
+            if found is None:
+                break
+            unfold(found[0])
+            unfolded.append(found[0])
+            finder.forget()
+    return unfolded
+
+
+def unfold_around(source_dir: str, targets: Iterable[str]) -> list[str]:
+    """unfolds until none of `targets` lies under a fold, so each has its own link"""
+    finder = FoldFinder(source_dir)
+    unfolded = []
+    for target in targets:
+        while (found := finder.fold_of(os.path.dirname(target))) is not None:
+            unfold(found[0])
+            unfolded.append(found[0])
+            finder.forget()
+    return unfolded
+
+
+def ancestors(path: str, stop: str) -> Iterable[str]:
+    """the directories above `path` up to, not including, `stop`"""
+    prefix = stop.rstrip(os.sep) + os.sep
+    path = os.path.dirname(path)
+    while path != stop and path.startswith(prefix):
+        yield path
+        path = os.path.dirname(path)
+
+
+def _mirrored_pairs(source: str, target: str, source_dir: str) -> Iterable[tuple[str, str]]:
+    """(source dir, target dir) pairs above an entry that mirror each other below"""
+    if os.path.basename(source) != os.path.basename(target):
+        return
+    s, t = os.path.dirname(source), os.path.dirname(target)
+    while s.startswith(source_dir + os.sep) and os.path.dirname(t) != t:
+        yield s, t
+        if os.path.basename(s) != os.path.basename(t):
+            return
+        s, t = os.path.dirname(s), os.path.dirname(t)
+
+
+class _Farm:
+    def __init__(self, source_dir: str, pairs: list[tuple[str, str]]):
+        self.source_dir = source_dir
+        self.by_source = dict(pairs)
+        self.by_target = {target: source for source, target in pairs}
+        self.source_ancestors: set[str] = set()
+        self.target_ancestors: set[str] = set()
+        self.under_source: dict[str, int] = {}
+        self.under_target: dict[str, int] = {}
+        self.owners: dict[tuple[str, str], int] = {}
+
+        for source, target in pairs:
+            for s in ancestors(source, source_dir):
+                self.source_ancestors.add(s)
+                self.under_source[s] = self.under_source.get(s, 0) + 1
+            for t in ancestors(target, os.sep):
+                self.target_ancestors.add(t)
+                self.under_target[t] = self.under_target.get(t, 0) + 1
+            for pair in _mirrored_pairs(source, target, source_dir):
+                self.owners[pair] = self.owners.get(pair, 0) + 1
+
+    def owned_pairs(self, home: str) -> list[tuple[str, str]]:
+        """
+        Pairs where every entry below the source dir lands below the target dir
+        and nothing else does, shallowest target first.
+        """
+        pairs = [
+            (s, t)
+            for (s, t), count in self.owners.items()
+            if count == self.under_source.get(s) == self.under_target.get(t)
+            and s not in self.by_source
+            and t not in self.by_target
+            and t != home
+            and not home.startswith(t + os.sep)
+        ]
+        pairs.sort(key=lambda pair: pair[1].count(os.sep))
+        return pairs
+
+    def source_tree_owned(self, source: str) -> bool:
+        """nothing below `source` on disk that a fold would expose besides entries"""
+        stack = [source]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as children:
+                    entries = list(children)
+            except OSError:
+                return False
+            for child in entries:
+                if child.path in self.by_source:
+                    continue
+                if child.path in self.source_ancestors and child.is_dir(follow_symlinks=False):
+                    stack.append(child.path)
+                    continue
+                return False
+        return True
+
+    def target_tree_removable(self, target: str) -> Optional[tuple[list[str], list[str]]]:
+        """
+        The links and directories to remove before `target` can become a fold,
+        or None if anything below it isn't one of the farm's own links.
+        """
+        if not os.path.lexists(target):
+            return [], []
+        if os.path.islink(target) or not os.path.isdir(target):
+            return None
+
+        links: list[str] = []
+        dirs = [target]
+        stack = [target]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as children:
+                    entries = list(children)
+            except OSError:
+                return None
+            for child in entries:
+                source = self.by_target.get(child.path)
+                if source is not None and child.is_symlink():
+                    if link_destination(child.path, os.readlink(child.path)) != source:
+                        return None
+                    links.append(child.path)
+                elif child.path in self.target_ancestors and child.is_dir(follow_symlinks=False):
+                    dirs.append(child.path)
+                    stack.append(child.path)
+                else:
+                    return None
+        return links, dirs
+
+
+def fold(source_dir: str, pairs: list[tuple[str, str]], home: str) -> list[tuple[str, str]]:
+    """
+    Folds the shallowest target directories whose whole tree is owned by the
+    farm and returns the (target dir, source dir) pairs folded. Directories
+    holding anything else, or the home directory itself, are never folded.
+    """
+    farm = _Farm(source_dir, pairs)
+    finder = FoldFinder(source_dir)
+    folded: list[tuple[str, str]] = []
+    covered: set[str] = set()
+
+    for source, target in farm.owned_pairs(home):
+        if any(t in covered for t in ancestors(target, os.sep)):
+            continue
+        found = finder.fold_of(target)
+        if found is not None:
+            # already folded here, or under a fold that covers it
+            covered.add(target)
+            continue
+        if not farm.source_tree_owned(source):
+            continue
+        removable = farm.target_tree_removable(target)
+        if removable is None:
+            continue
+
+        links, dirs = removable
+        try:
+            for path in links:
+                os.unlink(path)
+            for path in reversed(dirs):
+                os.rmdir(path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.symlink(source, target)
+        except OSError:
+            # something appeared in the meantime; linking recreates whatever
+            # links were already removed
+            continue
+        covered.add(target)
+        folded.append((target, source))
+    return folded
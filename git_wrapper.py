@@ -1,9 +1,14 @@
+import os
+import time
+from collections.abc import Iterator
 from datetime import datetime
 from enum import Enum
 from pathlib import Path
 from typing import Optional
 from subprocess import CompletedProcess
 
+from patterns import PatternSet
+from spans import span
 from errors import (
     DirectoryNotFound,
     FileNotDirectory,
@@ -17,22 +22,84 @@ class StatusChangeType(Enum):
     ADDED = "added"
     REMOVED = "removed"
     MODIFIED = "modified"
+    RENAMED = "renamed"
 
 
 class FileChangeStatus:
-    def __init__(self, relative_path: str, change_type: StatusChangeType):
+    __slots__ = ("relative_path", "change_type", "original_path")
+
+    def __init__(
+        self,
+        relative_path: str,
+        change_type: StatusChangeType,
+        original_path: Optional[str] = None,
+    ):
         self.relative_path = relative_path
         self.change_type = change_type
+        self.original_path = original_path
+
+
+# number of space separated fields before the path in each porcelain v2 record
+_V2_FIELD_COUNTS = {"1": 8, "2": 9, "u": 10, "?": 1, "!": 1}
+
+
+def _change_type(record_type: str, xy: str) -> StatusChangeType:
+    if record_type == "?":
+        return StatusChangeType.ADDED
+    if record_type == "2":
+        return StatusChangeType.RENAMED
+    if "A" in xy:
+        return StatusChangeType.ADDED
+    if "D" in xy:
+        return StatusChangeType.REMOVED
+    return StatusChangeType.MODIFIED
 
 
 class GitPushStatus(Enum):
     Success = "success"
     NetworkError = "network_error"
+    AuthError = "auth_error"
+    Rejected = "rejected"
+    Failed = "failed"
+
+
+_AUTH_ERRORS = (
+    "permission denied",
+    "authentication failed",
+    "could not read username",
+    "access denied",
+    "the requested url returned error: 403",
+)
+_REJECTED_ERRORS = ("non-fast-forward", "[rejected]", "fetch first")
+_NETWORK_ERRORS = (
+    "network",
+    "connection",
+    "could not resolve host",
+    "timed out",
+    "unable to access",
+)
+
+
+def classify_push_error(stderr: str) -> GitPushStatus:
+    error_lower = stderr.lower()
+    if any(marker in error_lower for marker in _AUTH_ERRORS):
+        return GitPushStatus.AuthError
+    if any(marker in error_lower for marker in _REJECTED_ERRORS):
+        return GitPushStatus.Rejected
+    if any(marker in error_lower for marker in _NETWORK_ERRORS):
+        return GitPushStatus.NetworkError
+    return GitPushStatus.Failed
 
 
 class GitWrapper:
     def __init__(self, path: Path):
         self.path = path
+        # seconds spent in each git subcommand, for the metrics file
+        self.durations: dict[str, float] = {}
+
+    def _timed(self, command: str, start: float) -> None:
+        elapsed = time.perf_counter() - start
+        self.durations[command] = self.durations.get(command, 0.0) + elapsed
 
     def _validate_path(self) -> None:
         if not self.path.exists():
@@ -42,87 +109,166 @@ class GitWrapper:
         if not (self.path / ".git").exists():
             raise NotAGitRepo(self.path)
 
-    def _run_git(self, *args: str) -> CompletedProcess:
+    def _run_git(self, *args: str, check: bool = True) -> CompletedProcess:
         import subprocess
 
         self._validate_path()
-        result = subprocess.run(
-            ["git", *args],
-            cwd=self.path,
-            capture_output=True,
-            text=True,
-        )
-        if result.returncode != 0:
+        start = time.perf_counter()
+        with span(f"git {args[0]}"):
+            result = subprocess.run(
+                ["git", *args],
+                cwd=self.path,
+                capture_output=True,
+                text=True,
+            )
+        self._timed(args[0], start)
+        if check and result.returncode != 0:
             raise GitError(self.path)
         return result
 
+    def _stream_records(self, *args: str) -> Iterator[bytes]:
+        """
+        Runs git and yields its NUL separated output records as they arrive.
+        Closing the generator early kills git.
+        """
+        import subprocess
+
+        self._validate_path()
+        start = time.perf_counter()
+        with span(f"git {args[0]}"):
+            proc = subprocess.Popen(
+                ["git", *args],
+                cwd=self.path,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+            assert proc.stdout is not None
+            finished = False
+            try:
+                pending = b""
+                while chunk := proc.stdout.read1(65536):
+                    records = (pending + chunk).split(b"\0")
+                    pending = records.pop()
+                    yield from records
+                if pending:
+                    yield pending
+                finished = True
+            finally:
+                if not finished:
+                    proc.kill()
+                proc.stdout.close()
+                returncode = proc.wait()
+                self._timed(args[0], start)
+        if returncode != 0:
+            raise GitError(self.path)
+
     def changes(
-        self, ignored_glob_patterns: Optional[list[str]] = None
+        self,
+        ignored_glob_patterns: Optional[list[str] | PatternSet] = None,
+        stop_at_first: bool = False,
     ) -> list[FileChangeStatus]:
-        result = self._run_git("status", "--porcelain")
-        output = result.stdout
+        """
+        Parses `git status --porcelain=v2 -z` while git is still writing it.
+        With `stop_at_first` git is stopped as soon as one change that is not
+        ignored has been seen, and only that change is returned.
+        """
+        ignored = PatternSet.of(ignored_glob_patterns)
+        changes: list[FileChangeStatus] = []
 
-        if not output.strip():
-            return []
+        records = self._stream_records("status", "--porcelain=v2", "-z")
+        try:
+            for record in records:
+                if not record:
+                    continue
+                line = os.fsdecode(record)
+                record_type = line[0]
+                field_count = _V2_FIELD_COUNTS.get(record_type)
+                if field_count is None or record_type == "!":
+                    continue
 
-        changes: list[FileChangeStatus] = []
+                fields = line.split(" ", field_count)
+                relative_path = fields[-1]
+                original_path = None
+                if record_type == "2":
+                    # renames and copies carry the original path as the next record
+                    original_path = os.fsdecode(next(records))
 
-        import fnmatch
-
-        for line in output.splitlines():
-            if len(line) < 3:
-                continue
-            status_code = line[:2]
-            relative_path = line[3:]
-
-            if status_code[0] == "?" or status_code[1] == "?":
-                change_type = StatusChangeType.ADDED
-            elif status_code[0] == "A" or status_code[1] == "A":
-                change_type = StatusChangeType.ADDED
-            elif status_code[0] == "D" or status_code[1] == "D":
-                change_type = StatusChangeType.REMOVED
-            else:
-                change_type = StatusChangeType.MODIFIED
-
-            if ignored_glob_patterns:
-                should_ignore = False
-                for pattern in ignored_glob_patterns:
-                    if fnmatch.fnmatch(relative_path, pattern):
-                        should_ignore = True
-                        break
-                if should_ignore:
+                if ignored.matches(relative_path):
                     continue
 
-            changes.append(FileChangeStatus(relative_path, change_type))
+                change_type = _change_type(record_type, fields[1])
+                changes.append(FileChangeStatus(relative_path, change_type, original_path))
+                if stop_at_first:
+                    break
+        finally:
+            records.close()
 
         return changes
 
+    def has_changes(
+        self, ignored_glob_patterns: Optional[list[str] | PatternSet] = None
+    ) -> bool:
+        return bool(self.changes(ignored_glob_patterns, stop_at_first=True))
+
+    def enable_status_caches(self) -> None:
+        """
+        Opts the repository into git's untracked cache, and into the builtin
+        fsmonitor daemon when this git was built with it, so `git status`
+        only rescans what changed.
+        """
+        self._run_git("config", "core.untrackedCache", "true")
+        build_options = self._run_git("version", "--build-options").stdout
+        if "fsmonitor--daemon" in build_options:
+            self._run_git("config", "core.fsmonitor", "true")
+
     def add_all(self) -> None:
         self._run_git("add", ".")
 
     def push(self) -> GitPushStatus:
-        result = self._run_git("push")
-
+        result = self._run_git("push", check=False)
         if result.returncode != 0:
-            error_lower = result.stderr.lower()
-            if (
-                "network" in error_lower
-                or "connection" in error_lower
-                or "could not resolve host" in error_lower
-            ):
-                return GitPushStatus.NetworkError
-            raise GitError(self.path)
-
+            return classify_push_error(result.stderr)
         return GitPushStatus.Success
 
-    def timestamped_commit(self) -> None:
-        timestamp = datetime.now().strftime("%Y:%m:%d %H:%M:%S")
-        self._run_git("commit", "-m", timestamp)
+    async def push_async(self, remote: str) -> GitPushStatus:
+        import asyncio
 
         self._validate_path()
+        start = time.perf_counter()
+        with span("git push", remote=remote):
+            proc = await asyncio.create_subprocess_exec(
+                "git",
+                "push",
+                remote,
+                "HEAD",
+                cwd=self.path,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            _, stderr = await proc.communicate()
+        self._timed("push", start)
+        if proc.returncode != 0:
+            return classify_push_error(stderr.decode(errors="replace"))
+        return GitPushStatus.Success
+
+    def commits_ahead(self) -> int:
+        """number of local commits not yet on the upstream branch, 0 without one"""
+        result = self._run_git("rev-list", "--count", "@{upstream}..HEAD", check=False)
+        if result.returncode != 0:
+            return 0
+        return int(result.stdout.strip() or 0)
+
+    def timestamped_commit(self, require_origin: bool = True) -> None:
+        """
+        commit everything staged; with require_origin, refuse to commit at all
+        when there is no origin to push the commit to
+        """
+        if require_origin:
+            remote_result = self._run_git(
+                "remote", "get-url", "origin", check=False
+            )
+            if remote_result.returncode != 0:
+                raise MissingRemoteOrigin(self.path)
 
-        remote_result = self._run_git(
-            "remote", "get-url", "origin"
-        )
-        if remote_result.returncode != 0:
-            raise MissingRemoteOrigin(self.path)
+        timestamp = datetime.now().strftime("%Y:%m:%d %H:%M:%S")
+        self._run_git("commit", "-m", timestamp)
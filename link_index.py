@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import stat
+from typing import Optional
+
+from config import Config
+from state import read_state, state_path, write_state
+
+INDEX_KIND = "linkindex"
+INDEX_VERSION = 1
+
+
+def _paths_digest(config: Config) -> str:
+    table = json.dumps(
+        [str(Config.get_source_directory()), sorted(config.paths.items())]
+    )
+    return hashlib.sha256(table.encode()).hexdigest()
+
+
+def _stat_identity(path: str) -> Optional[tuple[int, int, int]]:
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_mtime_ns)
+
+
+class LinkIndex:
+    """
+    Records, for every source -> target pair that was last seen correctly
+    linked, the lstat identity and link text of the target plus the mtimes of
+    the target and source parent directories. Creating, removing or renaming
+    anything in a directory bumps its mtime, so an entry whose parents are
+    unchanged cannot have been touched and does not need to be verified.
+    A parent whose mtime is not older than the index itself could have changed
+    again within the same clock tick, so it is never trusted.
+    """
+
+    def __init__(self, digest: str):
+        self.digest = digest
+        self.entries: dict[str, dict] = {}
+        self.parents: dict[str, int] = {}
+        self._parent_cache: dict[str, Optional[int]] = {}
+        self._dirty = False
+
+    @staticmethod
+    def load(config: Config) -> "LinkIndex":
+        index = LinkIndex(_paths_digest(config))
+        raw = read_state(INDEX_KIND)
+        if raw is None:
+            return index
+
+        try:
+            data = json.loads(raw)
+            saved = os.stat(state_path(INDEX_KIND)).st_mtime_ns
+        except (ValueError, OSError):
+            return index
+
+        # any change to [paths] or the source directory invalidates everything
+        if data.get("version") != INDEX_VERSION or data.get("digest") != index.digest:
+            return index
+
+        index.entries = data.get("entries", {})
+        index.parents = {
+            parent: mtime
+            for parent, mtime in data.get("parents", {}).items()
+            if mtime < saved
+        }
+        return index
+
+    def _parent_mtime(self, parent: str) -> Optional[int]:
+        if parent not in self._parent_cache:
+            try:
+                self._parent_cache[parent] = os.stat(parent).st_mtime_ns
+            except OSError:
+                self._parent_cache[parent] = None
+        return self._parent_cache[parent]
+
+    def _parent_unchanged(self, parent: str) -> bool:
+        recorded = self.parents.get(parent)
+        return recorded is not None and recorded == self._parent_mtime(parent)
+
+    def is_fresh(self, source_rel: str, source: str, target: str) -> bool:
+        entry = self.entries.get(source_rel)
+        if entry is None or entry["target"] != target:
+            return False
+
+        if not self._parent_unchanged(os.path.dirname(source)):
+            return False
+        if self._parent_unchanged(os.path.dirname(target)):
+            return True
+
+        # the target directory changed; the link survived if it is the same
+        # inode and still points where it did
+        identity = _stat_identity(target)
+        if identity is None or list(identity) != entry["identity"]:
+            return False
+        if entry["link"] is None:
+            return True
+        try:
+            return os.readlink(target) == entry["link"]
+        except OSError:
+            return False
+
+    def record(self, source_rel: str, source: str, target: str) -> None:
+        try:
+            st = os.lstat(target)
+            link_text = os.readlink(target) if stat.S_ISLNK(st.st_mode) else None
+        except OSError:
+            self.forget(source_rel)
+            return
+
+        # targets inside a folded directory are the source itself, not a link
+        if link_text is None and os.path.realpath(target) != os.path.realpath(source):
+            self.forget(source_rel)
+            return
+
+        self.entries[source_rel] = {
+            "target": target,
+            "identity": [st.st_dev, st.st_ino, st.st_mtime_ns],
+            "link": link_text,
+            "parents": [os.path.dirname(source), os.path.dirname(target)],
+        }
+        self._dirty = True
+
+    def forget(self, source_rel: str) -> None:
+        if self.entries.pop(source_rel, None) is not None:
+            self._dirty = True
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+
+        parents: dict[str, int] = {}
+        for entry in self.entries.values():
+            for parent in entry["parents"]:
+                if parent in parents:
+                    continue
+                try:
+                    parents[parent] = os.stat(parent).st_mtime_ns
+                except OSError:
+                    pass
+        self.parents = parents
+
+        data = {
+            "version": INDEX_VERSION,
+            "digest": self.digest,
+            "entries": self.entries,
+            "parents": self.parents,
+        }
+        write_state(INDEX_KIND, json.dumps(data).encode())
+        self._dirty = False
@@ -5,41 +5,81 @@ from utils import expand_path
 from typing import Optional
 from ansii import RED, BLUE, RESET, BOLD
 from dataclasses import dataclass
+from errors import (
+    FileAlreadyExist,
+    LinkingError,
+    LinkPermissionDenied,
+    LinkPointsElsewhere,
+    NotALink,
+    RelinkFailed,
+    SourceNotFound,
+)
+from spans import traced
 
 
 @dataclass
 class LinkData:
     already_linked: bool = False
-    msg: Optional[str] = None
+    error: Optional[LinkingError] = None
 
+    @property
+    def msg(self) -> Optional[str]:
+        return None if self.error is None else describe(self.error)
 
-def link(source: Path, dest: Path) -> LinkData:
+
+def describe(error: LinkingError) -> str:
+    """the error as link and unlink have always printed it"""
+    if isinstance(error, SourceNotFound):
+        return f"{RED}can't link source does not exist: {BLUE}{BOLD}{error.source}{RESET}"
+    if isinstance(error, LinkPointsElsewhere):
+        return f"""
+    {RED}Destination exists but is not a symlink to source
+    source is {BLUE}{BOLD}{error.source}{RESET}{RED}
+    destination is{BLUE}{BOLD}{error.dest_path}
+    {RED}destination resolves to {BLUE}{BOLD}{error.dest_path.resolve()}
+    """
+    if isinstance(error, FileAlreadyExist):
+        return f"{RED}{BOLD}LINK FAILED{RESET}, {RED}destination already exist {BLUE}{BOLD}{error.dest_path.absolute()}"
+    if isinstance(error, LinkPermissionDenied) and error.creating:
+        return f"{RED}{BOLD}PERMISSION DENIED{RESET}{RED}, can't link to {BOLD}{BLUE}{error.dest_path.absolute()}{RED} {RESET}"
+    if isinstance(error, LinkPermissionDenied):
+        return f"{RED}{BOLD}PERMISSION DENIED{RESET}{RED}, can't unlink {BOLD}{BLUE}{error.dest_path.absolute()}{RED} {RESET}"
+    if isinstance(error, NotALink):
+        return f"{RED}can't unlink destination is not a symlink: {BLUE}{BOLD}{error.dest_path}{RESET}"
+    if isinstance(error, RelinkFailed):
+        reason = error.cause.strerror or error.cause
+        return f"{RED}{BOLD}ERROR{RESET}{RED}: can't update symlink at {BLUE}{BOLD}{error.dest_path}{RED}: {reason}{RESET}"
+    return f"{RED}{error.message}{RESET}"
+
+
+@traced("linker.link")
+def link(source: Path, dest: Path, make_parents: bool = True) -> LinkData:
     if not source.exists():
-        return LinkData(msg=f"{RED}can't link source does not exist: {BLUE}{BOLD}{source}{RESET}")
+        return LinkData(error=SourceNotFound(source))
 
     if dest.is_symlink():
         if dest.resolve() == source.resolve():
             return LinkData(already_linked=True)
-        return LinkData(msg=f"""
-    {RED}Destination exists but is not a symlink to source
-    source is {BLUE}{BOLD}{source}{RESET}{RED}
-    destination is{BLUE}{BOLD}{dest}
-    {RED}destination resolves to {BLUE}{BOLD}{dest.resolve()}
-    """)
+        return LinkData(error=LinkPointsElsewhere(dest, source))
 
     if dest.exists():
-        return LinkData(msg=f"{RED}{BOLD}LINK FAILED{RESET}, {RED}destination already exist {BLUE}{BOLD}{dest.absolute()}")
+        # inside a folded directory the target is the source itself
+        if dest.resolve() == source.resolve():
+            return LinkData(already_linked=True)
+        return LinkData(error=FileAlreadyExist(dest))
 
     try:
-        dest.parent.mkdir(parents=True, exist_ok=True)
+        if make_parents:
+            dest.parent.mkdir(parents=True, exist_ok=True)
         dest.symlink_to(source)
         return LinkData()
     except PermissionError:
-        return LinkData(msg=f"{RED}{BOLD}PERMISSION DENIED{RESET}{RED}, can't link to {BOLD}{BLUE}{dest.absolute()}{RED} {RESET}")
+        return LinkData(error=LinkPermissionDenied(dest, creating=True))
 
 
-# returns an error message or None if successful
-def unlink(source: Path, config: Config) -> Optional[str]:
+@traced("linker.unlink")
+def unlink_entry(source: Path, config: Config) -> Optional[LinkingError]:
+    """removes the link to `source`, returning why it couldn't instead of raising"""
     source_str = str(source.relative_to(Config.get_source_directory()))
     if source_str not in config.paths.keys():
         raise ValueError(f"Source not in config.paths: {source}")
@@ -49,13 +89,16 @@ def unlink(source: Path, config: Config) -> Optional[str]:
     if not dest.exists():
         return None
 
-    if not dest.is_symlink():
-        return f"{RED}can't unlink destination is not a symlink: {BLUE}{BOLD}{dest}{RESET}"
-
-    if dest.resolve() != source.resolve():
-        return f"{RED}can't unlink destination is not a symlink: {BLUE}{BOLD}{dest}{RESET}"
+    if not dest.is_symlink() or dest.resolve() != source.resolve():
+        return NotALink(dest)
     try:
         dest.unlink()
         return None
     except PermissionError:
-        return f"{RED}{BOLD}PERMISSION DENIED{RESET}{RED}, can't unlink {BOLD}{BLUE}{dest.absolute()}{RED} {RESET}"
+        return LinkPermissionDenied(dest, creating=False)
+
+
+# returns an error message or None if successful
+def unlink(source: Path, config: Config) -> Optional[str]:
+    error = unlink_entry(source, config)
+    return None if error is None else describe(error)
@@ -0,0 +1,57 @@
+import hashlib
+import marshal
+import mmap
+import os
+import struct
+from typing import Optional
+
+from state import replace_state, replaced_state_path
+
+CACHE_KIND = "tomlcache"
+
+# magic, TOML size, TOML mtime_ns, blake2b digest of the TOML bytes; the
+# marshalled table follows. marshal's format version is part of the magic, so a
+# cache written by another interpreter is rebuilt rather than misread.
+_HEADER = struct.Struct("<8sQq16s")
+_MAGIC = b"esfmeta" + bytes([marshal.version])
+
+
+def _digest(raw: bytes) -> bytes:
+    return hashlib.blake2b(raw, digest_size=16).digest()
+
+
+def load_cached(raw: bytes, st: os.stat_result) -> Optional[tuple]:
+    """
+    The value cached for exactly the TOML bytes `raw`, or None if there is no
+    cache or it was written for anything else.
+    """
+    try:
+        with open(replaced_state_path(CACHE_KIND), "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if len(mm) < _HEADER.size:
+                    return None
+                magic, size, mtime_ns, digest = _HEADER.unpack_from(mm)
+                if (magic, size, mtime_ns) != (_MAGIC, st.st_size, st.st_mtime_ns):
+                    return None
+                # size and mtime are only a quick reject, a same-size edit
+                # within the mtime granularity still changes the digest
+                if digest != _digest(raw):
+                    return None
+                with memoryview(mm)[_HEADER.size :] as payload:
+                    data = marshal.loads(payload)
+    except (OSError, ValueError, EOFError, TypeError):
+        return None
+    return data if isinstance(data, tuple) else None
+
+
+def store_cache(raw: bytes, st: os.stat_result, data: tuple) -> None:
+    try:
+        payload = marshal.dumps(data)
+    except ValueError:
+        # TOML dates and times can't be marshalled, those farms just parse
+        return
+    header = _HEADER.pack(_MAGIC, st.st_size, st.st_mtime_ns, _digest(raw))
+    try:
+        replace_state(CACHE_KIND, header + payload)
+    except OSError:
+        pass
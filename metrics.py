@@ -0,0 +1,208 @@
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from ansii import BLUE, BOLD, RED, RESET
+from utils import atomic_write, print_err
+
+# Metrics for node_exporter's textfile collector. Every run only knows about
+# what it did itself, so writing merges with the file that is already there:
+# families the run reports replace the old ones whole, counters add to their
+# old values and everything else is kept as it was. The file is renamed into
+# place, so the collector never reads half of it.
+
+_Labels = tuple[tuple[str, str], ...]
+
+
+class Family:
+    def __init__(self, name: str, kind: str, help: str):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.samples: dict[_Labels, float] = {}
+
+    def set(self, value: float, **labels: str) -> "Family":
+        self.samples[tuple(sorted(labels.items()))] = value
+        return self
+
+    def inc(self, value: float = 1, **labels: str) -> "Family":
+        key = tuple(sorted(labels.items()))
+        self.samples[key] = self.samples.get(key, 0) + value
+        return self
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}\n", f"# TYPE {self.name} {self.kind}\n"]
+        for labels, value in self.samples.items():
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}\n")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: _Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def _parse_labels(text: str) -> _Labels:
+    labels = []
+    i = 0
+    while i < len(text):
+        equals = text.index("=", i)
+        key = text[i:equals].strip().lstrip(",").strip()
+        i = equals + 2
+        value = []
+        while text[i] != '"':
+            if text[i] == "\\":
+                i += 1
+                value.append("\n" if text[i] == "n" else text[i])
+            else:
+                value.append(text[i])
+            i += 1
+        labels.append((key, "".join(value)))
+        i += 1
+    return tuple(sorted(labels))
+
+
+def _read_families(path: Path) -> dict[str, tuple[list[str], dict[_Labels, float]]]:
+    """the lines and sample values of every family in an existing file, in order"""
+    try:
+        text = path.read_text()
+    except OSError:
+        return {}
+
+    families: dict[str, tuple[list[str], dict[_Labels, float]]] = {}
+    for line in text.splitlines(keepends=True):
+        if line.startswith("#"):
+            parts = line.split(" ", 3)
+            if len(parts) < 3:
+                continue
+            name = parts[2].strip()
+        elif line.strip():
+            name = line.split("{", 1)[0].split(" ", 1)[0]
+        else:
+            continue
+        lines, samples = families.setdefault(name, ([], {}))
+        lines.append(line if line.endswith("\n") else line + "\n")
+        if line.startswith("#"):
+            continue
+        try:
+            head, value = line.rstrip().rsplit(" ", 1)
+            labels = _parse_labels(head[len(name) + 1 : -1]) if "{" in head else ()
+            samples[labels] = float(value)
+        except (ValueError, IndexError):
+            pass
+    return families
+
+
+def write_metrics(path: str, families: list[Family]) -> None:
+    """merges `families` into the metrics file at `path`"""
+    target = Path(os.path.expanduser(path))
+    existing = _read_families(target)
+    for family in families:
+        if family.kind != "counter" or family.name not in existing:
+            continue
+        for labels, value in existing[family.name][1].items():
+            family.samples[labels] = family.samples.get(labels, 0) + value
+
+    replaced = {family.name: family for family in families}
+    out: list[str] = []
+    for name, (lines, _) in existing.items():
+        if name in replaced:
+            out.extend(replaced.pop(name).render())
+        else:
+            out.extend(lines)
+    for family in replaced.values():
+        out.extend(family.render())
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    atomic_write(target, "".join(out).encode())
+
+
+def try_write_metrics(path: str, families: list[Family]) -> None:
+    """write_metrics for commands, which report a failed write and carry on"""
+    try:
+        write_metrics(path, families)
+    except OSError as e:
+        print_err(f"{RED}can't write metrics to {BLUE}{BOLD}{path}{RESET}{RED}: {e.strerror}{RESET}")
+
+
+def link_families(linked: int, already_linked: int, failed: int) -> list[Family]:
+    now = time.time()
+    return [
+        Family("esf_link_entries", "gauge", "Farm entries by outcome of the last link")
+        .set(linked, result="linked")
+        .set(already_linked, result="already-linked")
+        .set(failed, result="failed"),
+        Family("esf_last_link_timestamp_seconds", "gauge", "When link last ran").set(now),
+    ]
+
+
+def status_families(counts: dict[str, int]) -> list[Family]:
+    entries = Family("esf_entries", "gauge", "Farm entries by state at the last status or doctor")
+    for state, count in counts.items():
+        entries.set(count, state=state)
+    return [
+        entries,
+        Family("esf_last_status_timestamp_seconds", "gauge", "When status last ran")
+        .set(time.time()),
+    ]
+
+
+def push_families(
+    result: str,
+    attempts: int,
+    changed_files: Optional[int],
+    violations: int,
+    git_seconds: dict[str, float],
+) -> list[Family]:
+    """
+    `result` is `success`, `up-to-date` when there was nothing to push, or
+    why the push failed. Both of the first two count as a current backup.
+    """
+    now = time.time()
+    families = [
+        Family("esf_last_push_timestamp_seconds", "gauge", "When push last ran").set(now),
+        Family("esf_last_push_result", "gauge", "1 for the result of the last push")
+        .set(1, result=result),
+        Family("esf_last_push_success", "gauge", "1 if the last push left the remote up to date")
+        .set(1 if result in ("success", "up-to-date") else 0),
+        Family("esf_push_attempts", "gauge", "git push attempts made by the last push")
+        .set(attempts),
+        Family(
+            "esf_push_no_new_files_violations",
+            "gauge",
+            "Changes the last push refused because of no-new-files",
+        ).set(violations),
+        Family("esf_pushes_total", "counter", "Push runs by result").inc(result=result),
+    ]
+    if result in ("success", "up-to-date"):
+        families.append(
+            Family(
+                "esf_last_successful_push_timestamp_seconds",
+                "gauge",
+                "When a push last left the remote up to date",
+            ).set(now)
+        )
+    if changed_files is not None:
+        families.append(
+            Family("esf_push_changed_files", "gauge", "Changed files seen by the last push")
+            .set(changed_files)
+        )
+    git = Family(
+        "esf_git_duration_seconds", "gauge", "Time spent in each git subcommand by the last push"
+    )
+    for command, seconds in git_seconds.items():
+        git.set(round(seconds, 6), command=command)
+    families.append(git)
+    return families
@@ -0,0 +1,198 @@
+import errno
+import fcntl
+import os
+import shutil
+import stat
+import threading
+from pathlib import Path
+from typing import Callable, Optional
+
+from errors import OriginNotRemoved
+from utils import delete_path, suppress_errors
+
+# Moves that stay on one filesystem are a single rename. Across filesystems the
+# tree is copied into a hidden staging path next to the destination, renamed
+# into place once complete and only then is the original removed, so a failure
+# at any point leaves the original untouched and no partial copy behind.
+
+FICLONE = 0x40049409
+_CHUNK = 1 << 30
+_BUFFER = 1 << 20
+# errors that mean a copy method doesn't work between these two filesystems,
+# as opposed to a problem with the file itself
+_UNSUPPORTED = {
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EBADF,
+}
+
+Progress = Callable[[int, int], None]
+
+
+def _copy_metadata(src: str, dst: str, st: os.stat_result) -> None:
+    shutil.copystat(src, dst, follow_symlinks=False)
+    if os.geteuid() == 0:
+        # esf runs under sudo on behalf of SUDO_USER, keep their ownership
+        suppress_errors(os.chown, dst, st.st_uid, st.st_gid, follow_symlinks=False)
+
+
+class _Copier:
+    """
+    Copies single entries with the cheapest method the filesystems allow:
+    a reflink, then copy_file_range, then sendfile, then plain reads and
+    writes. A method that fails as unsupported is not tried again.
+    """
+
+    def __init__(self, total: int, progress: Optional[Progress]):
+        self.reflink = True
+        self.copy_file_range = hasattr(os, "copy_file_range")
+        self.sendfile = hasattr(os, "sendfile")
+        self.total = total
+        self.done = 0
+        self.progress = progress
+        self._lock = threading.Lock()
+
+    def copy_entry(self, src: str, dst: str, st: os.stat_result) -> None:
+        if stat.S_ISLNK(st.st_mode):
+            os.symlink(os.readlink(src), dst)
+        elif stat.S_ISREG(st.st_mode):
+            self._copy_file(src, dst, st.st_size)
+        else:
+            raise OSError(errno.EOPNOTSUPP, "can't move special file", src)
+        _copy_metadata(src, dst, st)
+
+        if self.progress is not None and stat.S_ISREG(st.st_mode):
+            with self._lock:
+                self.done += st.st_size
+                self.progress(self.done, self.total)
+
+    def _copy_file(self, src: str, dst: str, size: int) -> None:
+        in_fd = os.open(src, os.O_RDONLY)
+        try:
+            out_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            try:
+                self._copy_data(in_fd, out_fd, size)
+            finally:
+                os.close(out_fd)
+        finally:
+            os.close(in_fd)
+
+    def _copy_data(self, in_fd: int, out_fd: int, size: int) -> None:
+        if size == 0:
+            return
+        if self.reflink:
+            try:
+                fcntl.ioctl(out_fd, FICLONE, in_fd)
+                return
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+                self.reflink = False
+
+        if self.copy_file_range and self._copy_loop(
+            lambda: os.copy_file_range(in_fd, out_fd, _CHUNK)
+        ):
+            return
+        self.copy_file_range = False
+
+        if self.sendfile and self._copy_loop(
+            lambda: os.sendfile(out_fd, in_fd, None, _CHUNK)
+        ):
+            return
+        self.sendfile = False
+
+        while chunk := os.read(in_fd, _BUFFER):
+            os.write(out_fd, chunk)
+
+    @staticmethod
+    def _copy_loop(copy_chunk: Callable[[], int]) -> bool:
+        """False if the method is unsupported before anything was copied"""
+        copied = 0
+        while True:
+            try:
+                n = copy_chunk()
+            except OSError as e:
+                if copied == 0 and e.errno in _UNSUPPORTED:
+                    return False
+                raise
+            if n == 0:
+                return True
+            copied += n
+
+
+def _copy_tree(origin: str, staging: str, jobs: int, progress: Optional[Progress]) -> None:
+    st = os.lstat(origin)
+    if not stat.S_ISDIR(st.st_mode):
+        _Copier(st.st_size, progress).copy_entry(origin, staging, st)
+        return
+
+    # directories are created up front, in order, and get their metadata last
+    # so copying into them doesn't bump their mtime or trip over read-only modes
+    dirs = []
+    files = []
+    stack = [(origin, staging, st)]
+    while stack:
+        src, dst, dst_st = stack.pop()
+        os.mkdir(dst, 0o700)
+        dirs.append((src, dst, dst_st))
+        with os.scandir(src) as entries:
+            for entry in entries:
+                est = entry.stat(follow_symlinks=False)
+                target = os.path.join(dst, entry.name)
+                if stat.S_ISDIR(est.st_mode):
+                    stack.append((entry.path, target, est))
+                else:
+                    files.append((entry.path, target, est))
+
+    total = sum(est.st_size for _, _, est in files if stat.S_ISREG(est.st_mode))
+    copier = _Copier(total, progress)
+    if jobs > 1 and len(files) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(copier.copy_entry, *file) for file in files]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    else:
+        for file in files:
+            copier.copy_entry(*file)
+
+    for src, dst, dst_st in reversed(dirs):
+        _copy_metadata(src, dst, dst_st)
+
+
+def move(origin: Path, dest: Path, jobs: int = 8, progress: Optional[Progress] = None) -> None:
+    """
+    Moves `origin` to `dest`, which must not exist. Raises whatever stopped the
+    copy after removing the partial copy, or OriginNotRemoved when `dest` is
+    complete but the original is (partly) still there.
+    """
+    if os.path.lexists(dest):
+        raise FileExistsError(errno.EEXIST, "destination already exists", str(dest))
+    try:
+        os.rename(origin, dest)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    staging = dest.with_name(f".{dest.name}.esf-move-{os.getpid()}")
+    try:
+        _copy_tree(str(origin), str(staging), jobs, progress)
+        os.rename(staging, dest)
+    except BaseException:
+        suppress_errors(delete_path, staging)
+        raise
+
+    try:
+        delete_path(origin)
+    except OSError as e:
+        raise OriginNotRemoved(origin, dest) from e
@@ -0,0 +1,180 @@
+import json
+import os
+import queue
+import threading
+import time
+from typing import Optional
+
+from ansii import RED, RESET
+from spans import span
+from state import read_state, write_state
+from utils import print_err
+
+# Notifications are handed to one worker thread per sink, so a slow command
+# never holds up the push or the other sinks, and every delivery is cut off
+# after the configured timeout. Identical messages sent again within the
+# coalescing window are dropped; the next one after it says how many were.
+# The window is kept in a state file because a flapping network fails one
+# push per cron run, each in a new process.
+
+MESSAGE_PLACEHOLDER = "$!SYM_MESSAGE"
+NOTIFY_STATE_KIND = "notifystate"
+
+
+class CommandSink:
+    """runs a shell command with $!SYM_MESSAGE replaced by the message"""
+
+    name = "command"
+
+    def __init__(self, command: str):
+        self.command = command
+
+    def send(self, message: str, timeout: float) -> None:
+        import signal
+        import subprocess
+
+        proc = subprocess.Popen(
+            self.command.replace(MESSAGE_PLACEHOLDER, message),
+            shell=True,
+            stdin=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        try:
+            proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            # the shell's children go too
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+            raise TimeoutError(f"killed after {timeout:g}s")
+
+
+class FileSink:
+    """appends one timestamped line per message"""
+
+    name = "file"
+
+    def __init__(self, path: str):
+        self.path = os.path.expanduser(path)
+
+    def send(self, message: str, timeout: float) -> None:
+        line = f"{time.strftime('%Y-%m-%dT%H:%M:%S%z')} {message.replace(chr(10), ' ')}\n"
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            # one write, so lines from concurrent runs never interleave
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+
+
+class DatagramSink:
+    """sends the message as one datagram to a UNIX socket"""
+
+    name = "socket"
+
+    def __init__(self, path: str):
+        self.path = os.path.expanduser(path)
+
+    def send(self, message: str, timeout: float) -> None:
+        import socket
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(timeout)
+            sock.sendto(message.encode(), self.path)
+
+
+class _Worker:
+    def __init__(self, sink, timeout: float):
+        self.sink = sink
+        self.timeout = timeout
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.pending = 0
+        self.thread: Optional[threading.Thread] = None
+
+    def put(self, message: str) -> None:
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self._run, name=f"esf-notify-{self.sink.name}", daemon=True
+            )
+            self.thread.start()
+        self.pending += 1
+        self.queue.put(message)
+
+    def _run(self) -> None:
+        while (message := self.queue.get()) is not None:
+            try:
+                with span(f"notify.{self.sink.name}"):
+                    self.sink.send(message, self.timeout)
+            except (OSError, TimeoutError) as e:
+                print_err(f"{RED}{self.sink.name} notification failed: {e}{RESET}")
+
+    def close(self) -> None:
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        # every delivery is bounded by the timeout, give each queued one its share
+        self.thread.join(self.timeout * (self.pending + 1))
+        self.thread = None
+        self.pending = 0
+
+
+class Notifier:
+    def __init__(self, sinks: list, timeout_ms: int, coalesce_ms: int):
+        self.workers = [_Worker(sink, timeout_ms / 1000) for sink in sinks]
+        self.coalesce = coalesce_ms / 1000
+
+    @staticmethod
+    def from_config(config) -> "Notifier":
+        sinks: list = []
+        if config.push_notify_command:
+            sinks.append(CommandSink(config.push_notify_command))
+        if config.notify_file:
+            sinks.append(FileSink(config.notify_file))
+        if config.notify_socket:
+            sinks.append(DatagramSink(config.notify_socket))
+        return Notifier(sinks, config.notify_timeout_ms, config.notify_coalesce_ms)
+
+    def notify(self, message: str) -> None:
+        """queues `message` for every sink and returns without waiting"""
+        if not self.workers:
+            return
+        coalesced = self._coalesce(message)
+        if coalesced is None:
+            return
+        for worker in self.workers:
+            worker.put(coalesced)
+
+    def close(self) -> None:
+        """waits for the queued notifications, at most each sink's timeout per message"""
+        for worker in self.workers:
+            worker.close()
+
+    def _coalesce(self, message: str) -> Optional[str]:
+        if self.coalesce <= 0:
+            return message
+
+        now = time.time()
+        try:
+            seen = json.loads(read_state(NOTIFY_STATE_KIND) or b"{}")
+        except ValueError:
+            seen = {}
+        # {message: [last sent, times dropped since]}
+        seen = {
+            text: entry
+            for text, entry in seen.items()
+            if entry[1] or now - entry[0] < self.coalesce
+        }
+
+        entry = seen.get(message)
+        if entry is not None and now - entry[0] < self.coalesce:
+            entry[1] += 1
+            result = None
+        else:
+            dropped = entry[1] if entry is not None else 0
+            seen[message] = [now, 0]
+            result = f"{message} (repeated {dropped} more times)" if dropped else message
+
+        try:
+            write_state(NOTIFY_STATE_KIND, json.dumps(seen).encode())
+        except OSError:
+            pass
+        return result
@@ -0,0 +1,57 @@
+import fnmatch
+import re
+from collections.abc import Iterable
+from typing import Optional, Union
+
+_GLOB_CHARS = re.compile(r"[*?\[]")
+
+
+def _literal_prefix(pattern: str) -> str:
+    match = _GLOB_CHARS.search(pattern)
+    return pattern if match is None else pattern[: match.start()]
+
+
+class PatternSet:
+    """
+    A group of fnmatch patterns matched as one. Patterns without glob
+    characters are looked up in a set, the rest are compiled into a single
+    alternation. When every glob pattern starts with literal text, paths that
+    start with none of those prefixes are rejected without touching the regex.
+    Matching is case-sensitive, the same as fnmatch on POSIX.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns = list(dict.fromkeys(patterns))
+        self._literals = {p for p in self.patterns if not _GLOB_CHARS.search(p)}
+
+        globs = [p for p in self.patterns if p not in self._literals]
+        self._regex: Optional[re.Pattern] = None
+        self._prefixes: Optional[tuple[str, ...]] = None
+        if globs:
+            self._regex = re.compile(
+                "|".join(f"(?:{fnmatch.translate(p)})" for p in globs)
+            )
+            prefixes = tuple(_literal_prefix(p) for p in globs)
+            if all(prefixes):
+                self._prefixes = prefixes
+
+    @staticmethod
+    def of(patterns: Union["PatternSet", Iterable[str], None]) -> "PatternSet":
+        if isinstance(patterns, PatternSet):
+            return patterns
+        return PatternSet(patterns or [])
+
+    def __bool__(self) -> bool:
+        return bool(self.patterns)
+
+    def matches(self, path: str) -> bool:
+        if path in self._literals:
+            return True
+        if self._regex is None:
+            return False
+        if self._prefixes is not None and not path.startswith(self._prefixes):
+            return False
+        return self._regex.match(path) is not None
+
+    def filter(self, paths: Iterable[str]) -> list[str]:
+        return [path for path in paths if self.matches(path)]
@@ -0,0 +1,172 @@
+import json
+import os
+import stat
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import Optional
+
+from config import Config
+from linker import link
+from ansii import RED, BLUE, RESET, BOLD
+from utils import link_destination
+
+
+class OperationKind(Enum):
+    CREATE = "create"
+    SKIP = "skip"
+    RETARGET = "retarget"
+    CONFLICT = "conflict"
+    REMOVE = "remove"
+
+
+@dataclass
+class TargetState:
+    exists: bool = False
+    is_symlink: bool = False
+    link_text: Optional[str] = None
+
+
+@dataclass
+class Operation:
+    kind: OperationKind
+    source: str
+    target: str
+    reason: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "kind": self.kind.value,
+            "source": self.source,
+            "target": self.target,
+            "reason": self.reason,
+        }
+
+
+@dataclass
+class Plan:
+    source_directory: str
+    operations: list[Operation]
+
+    def pending(self) -> list[Operation]:
+        return [op for op in self.operations if op.kind != OperationKind.SKIP]
+
+    def counts(self) -> dict[str, int]:
+        result = {kind.value: 0 for kind in OperationKind}
+        for op in self.operations:
+            result[op.kind.value] += 1
+        return result
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "source_directory": self.source_directory,
+                "counts": self.counts(),
+                "operations": [op.to_dict() for op in self.operations],
+            },
+            indent=2,
+        )
+
+
+def snapshot(targets: list[str]) -> dict[str, TargetState]:
+    """
+    Take one lstat (plus a readlink for symlinks) per target, never following
+    links, so the plan sees the filesystem exactly as it is.
+    """
+    states: dict[str, TargetState] = {}
+    for target in targets:
+        try:
+            st = os.lstat(target)
+        except OSError:
+            states[target] = TargetState()
+            continue
+
+        if stat.S_ISLNK(st.st_mode):
+            try:
+                link_text = os.readlink(target)
+            except OSError:
+                link_text = None
+            states[target] = TargetState(True, True, link_text)
+        else:
+            states[target] = TargetState(True, False)
+    return states
+
+
+def _classify(
+    source: str, target: str, state: TargetState, source_dir: str
+) -> tuple[OperationKind, Optional[str]]:
+    source_exists = os.path.exists(source)
+
+    if not state.exists:
+        if source_exists:
+            return OperationKind.CREATE, None
+        return OperationKind.CONFLICT, "source does not exist"
+
+    if not state.is_symlink:
+        # the target is reached through a folded directory
+        if source_exists and os.path.realpath(target) == os.path.realpath(source):
+            return OperationKind.SKIP, None
+        return OperationKind.CONFLICT, "target exists and is not a symlink"
+
+    if state.link_text is None:
+        return OperationKind.CONFLICT, "target symlink could not be read"
+
+    destination = link_destination(target, state.link_text)
+    points_at_source = destination == source or (
+        source_exists and os.path.realpath(target) == os.path.realpath(source)
+    )
+    if points_at_source:
+        if source_exists:
+            return OperationKind.SKIP, None
+        return OperationKind.REMOVE, "source no longer exists"
+
+    if destination.startswith(source_dir + os.sep):
+        if source_exists:
+            return OperationKind.RETARGET, f"points at {destination}"
+        return OperationKind.REMOVE, "source no longer exists"
+
+    return OperationKind.CONFLICT, f"symlink points outside the farm at {destination}"
+
+
+def build_plan(config: Config) -> Plan:
+    source_dir = str(Config.get_source_directory().absolute())
+    abs_paths = config.get_absolute_paths()
+    states = snapshot(list(abs_paths.values()))
+
+    # every source after the first one claiming a target can never be applied
+    claimed_by: dict[str, str] = {}
+    for sources in config.paths.duplicate_targets().values():
+        for source_rel in sources[1:]:
+            claimed_by[source_rel] = sources[0]
+
+    operations = []
+    for source_rel, target in abs_paths.items():
+        if source_rel in claimed_by:
+            reason = f"target is already claimed by {claimed_by[source_rel]}"
+            operations.append(
+                Operation(OperationKind.CONFLICT, source_rel, target, reason)
+            )
+            continue
+        source = os.path.join(source_dir, source_rel)
+        kind, reason = _classify(source, target, states[target], source_dir)
+        operations.append(Operation(kind, source_rel, target, reason))
+    return Plan(source_dir, operations)
+
+
+# returns an error message or None if successful
+def apply_operation(op: Operation, source_dir: Path) -> Optional[str]:
+    source = source_dir / op.source
+    target = Path(op.target)
+
+    if op.kind in (OperationKind.RETARGET, OperationKind.REMOVE):
+        try:
+            target.unlink()
+        except FileNotFoundError:
+            pass
+        except PermissionError:
+            return f"{RED}{BOLD}PERMISSION DENIED{RESET}{RED}, can't remove {BOLD}{BLUE}{target}{RED} {RESET}"
+
+    if op.kind in (OperationKind.CREATE, OperationKind.RETARGET):
+        return link(source, target).msg
+
+    return None
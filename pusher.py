@@ -0,0 +1,206 @@
+import asyncio
+import sys
+from typing import Optional
+
+from ansii import BLUE, BOLD, RESET
+from config import Config
+from errors import GitError
+from fingerprint import compute_fingerprint, load_fingerprint, save_fingerprint
+from git_wrapper import FileChangeStatus, GitPushStatus, GitWrapper, StatusChangeType
+from notify import Notifier
+from patterns import PatternSet
+from retry import RetryPolicy, RetryResult, RetryScheduler
+
+
+def _push_error_message(result: RetryResult[GitPushStatus]) -> str:
+    status = result.value
+    if status == GitPushStatus.NetworkError:
+        return f"Network error: {result.gave_up}"
+    if status == GitPushStatus.AuthError:
+        return "Authentication error: push was refused, not retrying"
+    if status == GitPushStatus.Rejected:
+        return "Push rejected: remote has commits that are not local, not retrying"
+    return "Push failed"
+
+
+def _adds_or_removes_under(change: FileChangeStatus, directory: str) -> bool:
+    if change.change_type == StatusChangeType.MODIFIED:
+        return False
+    if change.relative_path.startswith(directory):
+        return True
+    return change.original_path is not None and change.original_path.startswith(
+        directory
+    )
+
+
+class Pusher:
+    """The `esf push` pipeline, kept apart so other commands never import git."""
+
+    def __init__(self, config: Config):
+        self.config = config
+        # what the last push did, for the metrics file
+        self.result = "up-to-date"
+        self.attempts = 0
+        self.changed_files: Optional[int] = None
+        self.violations = 0
+        self.git: Optional[GitWrapper] = None
+        self.notifier = Notifier.from_config(config)
+
+    def push(self, force: bool = False) -> None:
+        try:
+            self._push(force)
+        except BaseException as e:
+            if not isinstance(e, SystemExit) or e.code:
+                self.result = "error"
+            raise
+        finally:
+            self.notifier.close()
+            if self.config.metrics_file:
+                self._write_metrics()
+
+    def _write_metrics(self) -> None:
+        from metrics import push_families, try_write_metrics
+
+        families = push_families(
+            self.result,
+            self.attempts,
+            self.changed_files,
+            self.violations,
+            self.git.durations if self.git else {},
+        )
+        try_write_metrics(self.config.metrics_file, families)
+
+    def _push(self, force: bool) -> None:
+        source_dir = Config.get_source_directory()
+        git = self.git = GitWrapper(source_dir)
+
+        stored = load_fingerprint()
+        # taken before git looks at the tree, so an edit made while git runs
+        # never ends up in a fingerprint recorded as pushed
+        fingerprint = compute_fingerprint(source_dir)
+        if not force and stored.get("fingerprint") == fingerprint:
+            self.changed_files = 0
+            return
+
+        status_caches = stored.get("status_caches", False)
+        if not status_caches:
+            try:
+                git.enable_status_caches()
+                status_caches = True
+            except GitError:
+                pass
+
+        no_update = PatternSet(self.config.no_update_on)
+        guarded = [no for no in self.config.no_new_files if (source_dir / no).exists()]
+
+        # without a no-new-files directory to check, one change is enough to
+        # push, unless the metrics file wants to know how many there are
+        changes = git.changes(
+            no_update, stop_at_first=not guarded and not self.config.metrics_file
+        )
+        if self.config.metrics_file:
+            self.changed_files = len(changes)
+        pending_remotes = stored.get("pending_remotes", [])
+        if not changes:
+            # commits left behind by a push that gave up still need pushing
+            if self.config.remotes and pending_remotes:
+                self._push_remotes(git, fingerprint, status_caches, pending_remotes)
+            elif git.commits_ahead():
+                self._push_commits(git, fingerprint, status_caches)
+            else:
+                save_fingerprint(fingerprint, status_caches)
+            return
+
+        violations = [
+            change
+            for change in changes
+            if any(_adds_or_removes_under(change, no) for no in guarded)
+        ]
+        if violations:
+            self.result = "blocked"
+            self.violations = len(violations)
+            error_msg = f"File added in no-new-files directory: {
+                violations[0].relative_path
+            }"
+            print(error_msg, file=sys.stderr)
+            self.notifier.notify(error_msg)
+            return
+
+        git.add_all()
+        if self.config.remotes:
+            # recorded before committing: once the commit exists there are no
+            # changes left to notice, so a run that dies before reaching every
+            # remote must leave them pending for the next one
+            save_fingerprint(None, status_caches, self.config.remotes)
+        git.timestamped_commit(require_origin=not self.config.remotes)
+        # the commit changed the index and HEAD; snapshot before the push,
+        # which can take a whole retry deadline
+        fingerprint = compute_fingerprint(source_dir)
+        if self.config.remotes:
+            self._push_remotes(git, fingerprint, status_caches, self.config.remotes)
+        else:
+            self._push_commits(git, fingerprint, status_caches)
+
+    def _push_commits(self, git: GitWrapper, fingerprint: str, status_caches: bool) -> None:
+        scheduler = RetryScheduler(RetryPolicy.from_config(self.config))
+        result = scheduler.run(
+            git.push,
+            should_retry=lambda status: status == GitPushStatus.NetworkError,
+            describe=lambda status: status.value,
+        )
+        self.attempts += len(result.attempts)
+        self.result = result.value.value
+
+        if result.value == GitPushStatus.Success:
+            save_fingerprint(fingerprint, status_caches)
+            return
+
+        self._report_push_failure(_push_error_message(result), result)
+
+    def _push_remotes(
+        self,
+        git: GitWrapper,
+        fingerprint: str,
+        status_caches: bool,
+        remotes: list[str],
+    ) -> None:
+        results = asyncio.run(self._push_remotes_async(git, remotes))
+
+        failed = []
+        self.result = GitPushStatus.Success.value
+        for remote, result in results.items():
+            self.attempts += len(result.attempts)
+            if result.value == GitPushStatus.Success:
+                print(f"pushed to {BLUE}{BOLD}{remote}{RESET}")
+            else:
+                failed.append(remote)
+                if self.result == GitPushStatus.Success.value:
+                    self.result = result.value.value
+                error_msg = f"{remote}: {_push_error_message(result)}"
+                self._report_push_failure(error_msg, result)
+
+        save_fingerprint(None if failed else fingerprint, status_caches, failed)
+
+    async def _push_remotes_async(
+        self, git: GitWrapper, remotes: list[str]
+    ) -> dict[str, RetryResult[GitPushStatus]]:
+        # every remote gets its own scheduler, so one slow or dead remote only
+        # delays its own retries
+        async def push_remote(remote: str) -> RetryResult[GitPushStatus]:
+            scheduler = RetryScheduler(RetryPolicy.from_config(self.config))
+            return await scheduler.run_async(
+                lambda: git.push_async(remote),
+                should_retry=lambda status: status == GitPushStatus.NetworkError,
+                describe=lambda status: status.value,
+            )
+
+        results = await asyncio.gather(*(push_remote(remote) for remote in remotes))
+        return dict(zip(remotes, results))
+
+    def _report_push_failure(
+        self, error_msg: str, result: RetryResult[GitPushStatus]
+    ) -> None:
+        print(error_msg, file=sys.stderr)
+        for line in result.summary():
+            print(f"  {line}", file=sys.stderr)
+        self.notifier.notify(error_msg)
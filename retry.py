@@ -0,0 +1,141 @@
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Generic, Optional, TypeVar
+
+from config import Config
+
+T = TypeVar("T")
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int
+    base_delay_ms: int
+    backoff: float = 2.0
+    max_delay_ms: int = 60000
+    deadline_ms: int = 60000
+    # fraction of every delay that is randomized so a fleet doesn't retry in lockstep
+    jitter: float = 0.5
+
+    @staticmethod
+    def from_config(config: Config) -> "RetryPolicy":
+        return RetryPolicy(
+            max_attempts=config.max_attempts,
+            base_delay_ms=config.retry_delays_ms,
+            backoff=config.retry_backoff,
+            max_delay_ms=config.retry_max_delay_ms,
+            deadline_ms=config.retry_deadline_ms,
+        )
+
+    def delay_ms(self, attempt: int) -> float:
+        """delay to wait after failed attempt number `attempt` (1 based)"""
+        delay = min(self.base_delay_ms * self.backoff ** (attempt - 1), self.max_delay_ms)
+        return delay * (1 - self.jitter) + random.random() * delay * self.jitter
+
+
+@dataclass
+class Attempt:
+    number: int
+    started_ms: float
+    duration_ms: float
+    outcome: str
+
+
+@dataclass
+class RetryResult(Generic[T]):
+    value: T
+    attempts: list[Attempt] = field(default_factory=list)
+    gave_up: Optional[str] = None
+
+    def summary(self) -> list[str]:
+        return [
+            f"attempt {a.number}: {a.outcome} after {a.duration_ms:.0f}ms (started at +{a.started_ms:.0f}ms)"
+            for a in self.attempts
+        ]
+
+
+class RetryScheduler:
+    """
+    Runs an operation until it returns a result `should_retry` rejects, the
+    attempts run out or the next delay would cross the deadline.
+    """
+
+    def __init__(
+        self,
+        policy: RetryPolicy,
+        sleep: Callable[[float], None] = time.sleep,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.policy = policy
+        self.sleep = sleep
+        self.clock = clock
+
+    def run(
+        self,
+        operation: Callable[[], T],
+        should_retry: Callable[[T], bool],
+        describe: Callable[[T], str] = str,
+    ) -> RetryResult[T]:
+        start = self.clock()
+        attempts: list[Attempt] = []
+        while True:
+            attempt_start = self.clock()
+            value = operation()
+            result, delay_ms = self._after_attempt(
+                start, attempt_start, attempts, value, should_retry, describe
+            )
+            if result is not None:
+                return result
+            self.sleep(delay_ms / 1000)
+
+    async def run_async(
+        self,
+        operation: Callable[[], Awaitable[T]],
+        should_retry: Callable[[T], bool],
+        describe: Callable[[T], str] = str,
+    ) -> RetryResult[T]:
+        import asyncio
+
+        start = self.clock()
+        attempts: list[Attempt] = []
+        while True:
+            attempt_start = self.clock()
+            value = await operation()
+            result, delay_ms = self._after_attempt(
+                start, attempt_start, attempts, value, should_retry, describe
+            )
+            if result is not None:
+                return result
+            await asyncio.sleep(delay_ms / 1000)
+
+    def _after_attempt(
+        self,
+        start: float,
+        attempt_start: float,
+        attempts: list[Attempt],
+        value: T,
+        should_retry: Callable[[T], bool],
+        describe: Callable[[T], str],
+    ) -> tuple[Optional[RetryResult[T]], float]:
+        """records the attempt and returns either the final result or the delay before the next one"""
+        now = self.clock()
+        number = len(attempts) + 1
+        attempts.append(
+            Attempt(
+                number,
+                (attempt_start - start) * 1000,
+                (now - attempt_start) * 1000,
+                describe(value),
+            )
+        )
+
+        if not should_retry(value):
+            return RetryResult(value, attempts), 0
+        if number >= self.policy.max_attempts:
+            return RetryResult(value, attempts, "max retry attempts reached"), 0
+
+        delay_ms = self.policy.delay_ms(number)
+        if (now - start) * 1000 + delay_ms > self.policy.deadline_ms:
+            return RetryResult(value, attempts, "retry deadline reached"), 0
+        return None, delay_ms
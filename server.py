@@ -0,0 +1,135 @@
+import json
+import os
+import socket
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+from typing import Optional
+
+from cli import Parser
+from client import is_private_dir, request_env, send_message, socket_path
+from config import Config
+from utils import print_err
+from ansii import BLUE, BOLD, RESET
+
+
+class _SocketStream:
+    """file-like object forwarding writes to the client as stream frames"""
+
+    def __init__(self, conn: socket.socket, name: str):
+        self.conn = conn
+        self.name = name
+
+    def write(self, data: str) -> int:
+        if data:
+            send_message(self.conn, {"stream": self.name, "data": data})
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def isatty(self) -> bool:
+        return False
+
+
+def _config_stamp() -> Optional[tuple[int, int, int]]:
+    try:
+        st = os.stat(Config._config_path())
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class Server:
+    """
+    Keeps one Config loaded and runs forwarded commands against it, one at a
+    time. The metadata file is re-checked before every command, so edits made
+    outside the server are picked up.
+    """
+
+    def __init__(self):
+        self.env = request_env()
+        self.config = Config.load()
+        self.stamp = _config_stamp()
+
+    def _refresh_config(self) -> None:
+        stamp = _config_stamp()
+        if stamp != self.stamp:
+            self.config = Config.load()
+            self.stamp = stamp
+
+    def handle(self, conn: socket.socket) -> None:
+        request = json.loads(conn.makefile("rb").readline())
+        if request["env"] != self.env:
+            send_message(conn, {"fallback": True})
+            return
+
+        self._refresh_config()
+        try:
+            os.chdir(request["cwd"])
+        except OSError:
+            send_message(conn, {"fallback": True})
+            return
+
+        code = 0
+        stdout = _SocketStream(conn, "stdout")
+        stderr = _SocketStream(conn, "stderr")
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            try:
+                Parser(self.config).dispatch(*request["argv"])
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            except Exception:
+                traceback.print_exc()
+                code = 1
+
+        if code != 0:
+            # a failed command may have changed the config without writing it
+            self.config = Config.load()
+        self.stamp = _config_stamp()
+        send_message(conn, {"exit": code})
+
+    def serve_forever(self) -> None:
+        path = socket_path()
+        directory = os.path.dirname(path)
+        try:
+            os.mkdir(directory, 0o700)
+        except FileExistsError:
+            pass
+        except OSError as e:
+            print_err(f"Error: can't create {directory}: {e.strerror}")
+            exit(1)
+        # clients refuse to connect anywhere else, and the mode keeps other
+        # users from reaching the socket at all
+        if not is_private_dir(directory):
+            print_err(f"Error: {directory} must be a directory only you can open")
+            exit(1)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        old_umask = os.umask(0o177)
+        try:
+            sock.bind(path)
+        finally:
+            os.umask(old_umask)
+        sock.listen(16)
+        print(f"serving {BLUE}{BOLD}{Config._config_path()}{RESET} on {path}")
+
+        try:
+            while True:
+                conn, _ = sock.accept()
+                with conn:
+                    try:
+                        self.handle(conn)
+                    except (OSError, ValueError) as e:
+                        print_err(e)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sock.close()
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
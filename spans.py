@@ -0,0 +1,141 @@
+import os
+import time
+
+# Phase timing for `--timings` and `ESF_TRACE`. Until `enable` is called,
+# `span` hands out one shared no-op context manager and `traced` functions
+# go straight to the function they wrap, so instrumented code costs a global
+# lookup per call when nobody is looking.
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoSpan":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.tracer.record(self.name, self.args, self.start, time.perf_counter_ns())
+
+
+class Tracer:
+    def __init__(self):
+        import threading
+
+        self._thread_id = threading.get_native_id
+        self.origin = time.perf_counter_ns()
+        # (name, args, start ns, end ns, thread id), appended from any thread
+        self.events: list[tuple[str, dict, int, int, int]] = []
+
+    def span(self, name: str, args: dict) -> _Span:
+        return _Span(self, name, args)
+
+    def record(self, name: str, args: dict, start: int, end: int) -> None:
+        self.events.append((name, args, start, end, self._thread_id()))
+
+    def summary(self) -> str:
+        """calls and total time of every phase, in the order phases first started"""
+        phases: dict[str, list[int]] = {}
+        for name, _, start, end, _ in sorted(self.events, key=lambda event: event[2]):
+            phase = phases.setdefault(name, [0, 0])
+            phase[0] += 1
+            phase[1] += end - start
+        wall = time.perf_counter_ns() - self.origin
+
+        width = max([len(name) for name in phases] + [5])
+        lines = [f"{'phase':{width}}  {'calls':>7}  {'total':>11}  {'share':>6}"]
+        for name, (calls, total) in phases.items():
+            share = 100 * total / wall if wall else 0
+            lines.append(f"{name:{width}}  {calls:>7}  {total / 1e6:>9.2f}ms  {share:>5.1f}%")
+        lines.append(f"{'wall':{width}}  {'':>7}  {wall / 1e6:>9.2f}ms")
+        return "\n".join(lines)
+
+    def chrome_trace(self) -> dict:
+        """the events in the Chrome trace event format, which Perfetto also reads"""
+        pid = os.getpid()
+        events = [
+            {
+                "name": name,
+                "cat": "esf",
+                "ph": "X",
+                "ts": (start - self.origin) / 1000,
+                "dur": (end - start) / 1000,
+                "pid": pid,
+                "tid": tid,
+                "args": args,
+            }
+            for name, args, start, end, tid in self.events
+        ]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+_tracer: Tracer | None = None
+
+
+def span(name: str, **args):
+    """a context manager timing the `name` phase, free while tracing is off"""
+    if _tracer is None:
+        return _NO_SPAN
+    return _tracer.span(name, args)
+
+
+def traced(name: str):
+    """decorator timing every call of a function as the `name` phase"""
+
+    def decorate(function):
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with _tracer.span(name, {}):
+                return function(*args, **kwargs)
+
+        # functools.wraps would cost every command the functools import
+        wrapper.__name__ = function.__name__
+        wrapper.__qualname__ = function.__qualname__
+        wrapper.__doc__ = function.__doc__
+        wrapper.__wrapped__ = function
+        return wrapper
+
+    return decorate
+
+
+def enable() -> Tracer:
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def finish(timings: bool, trace_path: str | None) -> None:
+    """stops tracing, printing the summary to stderr and writing the trace if asked"""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is None:
+        return
+    if timings:
+        import sys
+
+        print(tracer.summary(), file=sys.stderr)
+    if trace_path:
+        import json
+
+        with open(trace_path, "w") as f:
+            json.dump(tracer.chrome_trace(), f)
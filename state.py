@@ -0,0 +1,85 @@
+import os
+from pathlib import Path
+from typing import Optional
+
+from config import Config
+from utils import atomic_write, get_home_dir, suppress_errors
+
+# Machine-local files kept next to the metadata TOML. They describe this host,
+# not the farm, so they are hidden from git through .git/info/exclude.
+# Every state file is a cache that is validated when read, so existing files are
+# overwritten in place; replacing them would bump the mtime of the directory
+# they live in, which is exactly what the link index and push fingerprint watch.
+# State that has to be replaced whole lives in the user's cache directory instead.
+
+
+def state_path(kind: str) -> Path:
+    config_path = Config._config_path()
+    return config_path.with_name(f".{config_path.name}.{kind}")
+
+
+def read_state(kind: str) -> Optional[bytes]:
+    try:
+        return state_path(kind).read_bytes()
+    except OSError:
+        return None
+
+
+def write_state(kind: str, data: bytes) -> None:
+    path = state_path(kind)
+    suppress_errors(_exclude_from_git, path)
+    try:
+        with open(path, "r+b") as f:
+            f.write(data)
+            f.truncate()
+        return
+    except FileNotFoundError:
+        pass
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    atomic_write(path, data)
+
+
+def replaced_state_path(kind: str) -> Path:
+    """where replace_state keeps `kind`, one file per metadata file"""
+    import hashlib
+
+    config_path = Config._config_path().absolute()
+    digest = hashlib.blake2b(str(config_path).encode(), digest_size=8).hexdigest()
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or str(get_home_dir() / ".cache")
+    return Path(cache_dir) / "esf" / f"{config_path.name}.{digest}.{kind}"
+
+
+def replace_state(kind: str, data: bytes) -> None:
+    """
+    Like write_state, but always renames a new file into place, for state
+    that readers map into memory and must never see half written. The rename
+    happens outside the source directory, so it doesn't touch its mtime.
+    """
+    path = replaced_state_path(kind)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    atomic_write(path, data)
+    # older versions kept it next to the metadata file
+    suppress_errors(os.unlink, state_path(kind))
+
+
+def _exclude_from_git(path: Path) -> None:
+    source_dir = Config.get_source_directory()
+    git_dir = source_dir / ".git"
+    if not git_dir.is_dir():
+        return
+
+    config_name = Config._config_path().name
+    rel_dir = path.parent.relative_to(source_dir).as_posix()
+    prefix = "/" if rel_dir == "." else f"/{rel_dir}/"
+    pattern = f"{prefix}.{config_name}.*"
+
+    exclude_path = git_dir / "info" / "exclude"
+    content = exclude_path.read_text() if exclude_path.exists() else ""
+    if pattern in content.splitlines():
+        return
+
+    exclude_path.parent.mkdir(parents=True, exist_ok=True)
+    if content and not content.endswith("\n"):
+        content += "\n"
+    exclude_path.write_text(content + pattern + "\n")
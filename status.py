@@ -0,0 +1,195 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Optional
+
+from config import Config
+from utils import link_destination
+
+
+class EntryStatus(Enum):
+    OK = "ok"
+    MISSING = "missing"
+    DANGLING = "dangling"
+    WRONG_TARGET = "wrong-target"
+    IN_THE_WAY = "regular-file-in-the-way"
+
+
+@dataclass
+class Entry:
+    status: EntryStatus
+    source: str
+    target: str
+    detail: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "status": self.status.value,
+            "source": self.source,
+            "target": self.target,
+            "detail": self.detail,
+        }
+
+
+@dataclass
+class Report:
+    source_directory: str
+    entries: list[Entry]
+    # (path under a fold, where it really is) for everything written through
+    # a fold that has no entry of its own; push would commit it
+    untracked: list[tuple[str, str]] = field(default_factory=list)
+
+    def problems(self) -> list[Entry]:
+        return [entry for entry in self.entries if entry.status != EntryStatus.OK]
+
+    def counts(self) -> dict[str, int]:
+        result = {status.value: 0 for status in EntryStatus}
+        for entry in self.entries:
+            result[entry.status.value] += 1
+        return result
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "source_directory": self.source_directory,
+                "counts": self.counts(),
+                "entries": [entry.to_dict() for entry in self.entries],
+                "untracked_in_folds": [
+                    {"target": target, "source": source} for target, source in self.untracked
+                ],
+            },
+            indent=2,
+        )
+
+
+def _listing(directory: str) -> dict[str, os.DirEntry]:
+    try:
+        with os.scandir(directory) as entries:
+            return {entry.name: entry for entry in entries}
+    except OSError:
+        return {}
+
+
+def _check(
+    source: str, source_exists: bool, target: str, entry: Optional[os.DirEntry]
+) -> tuple[EntryStatus, Optional[str]]:
+    if entry is None:
+        return EntryStatus.MISSING, None if source_exists else "source does not exist"
+
+    # d_type answers these without a stat
+    if not entry.is_symlink():
+        kind = "directory" if entry.is_dir(follow_symlinks=False) else "file"
+        return EntryStatus.IN_THE_WAY, f"a {kind} is in the way"
+
+    try:
+        link_text = os.readlink(target)
+    except OSError as e:
+        return EntryStatus.WRONG_TARGET, f"symlink could not be read: {e.strerror}"
+
+    destination = link_destination(target, link_text)
+    if destination == source:
+        if source_exists:
+            return EntryStatus.OK, None
+        return EntryStatus.DANGLING, "source does not exist"
+
+    # only links that don't point straight at their source pay for more stats
+    if not os.path.exists(target):
+        return EntryStatus.DANGLING, f"points at missing {destination}"
+    if source_exists and os.path.realpath(target) == os.path.realpath(source):
+        return EntryStatus.OK, None
+    return EntryStatus.WRONG_TARGET, f"points at {destination}"
+
+
+def _untracked_in_folds(
+    source_dir: str, target_dirs: list[str], sources: set[str]
+) -> list[tuple[str, str]]:
+    """what the folds over `target_dirs` show that isn't one of `sources`, or above one"""
+    from folding import FoldFinder, ancestors
+
+    finder = FoldFinder(source_dir)
+    folds = {}
+    for directory in target_dirs:
+        found = finder.fold_of(directory)
+        if found is not None:
+            folds[found[0]] = found[1]
+
+    above = {parent for source in sources for parent in ancestors(source, source_dir)}
+    untracked = []
+    for fold, fold_source in folds.items():
+        stack = [fold_source]
+        while stack:
+            directory = stack.pop()
+            for name, entry in sorted(_listing(directory).items()):
+                if entry.path in sources:
+                    continue
+                if entry.path in above and entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                    continue
+                untracked.append((fold + entry.path[len(fold_source) :], entry.path))
+    return sorted(untracked)
+
+
+def scan(config: Config, jobs: int = 8) -> Report:
+    """
+    Checks every entry of the farm with one scandir per directory holding a
+    target or a source, the directories spread over `jobs` threads, plus a
+    readlink per symlink found.
+    """
+    source_dir = str(Config.get_source_directory().absolute())
+    cwd = os.getcwd()
+
+    # string-only version of get_absolute_paths, which costs as much as the scan
+    items = [
+        (
+            source_rel,
+            os.path.join(source_dir, source_rel),
+            os.path.normpath(os.path.join(cwd, os.path.expanduser(target))),
+        )
+        for source_rel, target in config.paths.items()
+    ]
+    by_target_dir: dict[str, list[tuple[str, str, str]]] = {}
+    source_dirs: dict[str, None] = {}
+    for item in items:
+        by_target_dir.setdefault(os.path.dirname(item[2]), []).append(item)
+        source_dirs[os.path.dirname(item[1])] = None
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        listings = dict(zip(source_dirs, pool.map(_listing, source_dirs)))
+
+        def source_exists(source: str) -> bool:
+            return os.path.basename(source) in listings[os.path.dirname(source)]
+
+        real_source_dirs: dict[str, str] = {}
+
+        def real_source_dir(directory: str) -> str:
+            if directory not in real_source_dirs:
+                real_source_dirs[directory] = os.path.realpath(directory)
+            return real_source_dirs[directory]
+
+        def scan_directory(directory: str) -> list[Entry]:
+            listing = _listing(directory)
+            resolved = None
+            entries = []
+            for source_rel, source, target in by_target_dir[directory]:
+                name = os.path.basename(target)
+                status, detail = _check(source, source_exists(source), target, listing.get(name))
+                if status == EntryStatus.IN_THE_WAY and name == os.path.basename(source):
+                    # a folded directory lists the source directory itself
+                    if resolved is None:
+                        resolved = os.path.realpath(directory)
+                    if resolved == real_source_dir(os.path.dirname(source)):
+                        status, detail = EntryStatus.OK, None
+                entries.append(Entry(status, source_rel, target, detail))
+            return entries
+
+        found = {}
+        for entries in pool.map(scan_directory, by_target_dir):
+            for entry in entries:
+                found[entry.source] = entry
+
+    untracked = _untracked_in_folds(
+        source_dir, list(by_target_dir), {source for _, source, _ in items}
+    )
+    return Report(source_dir, [found[source_rel] for source_rel, _, _ in items], untracked)
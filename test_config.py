@@ -0,0 +1,136 @@
+import os
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+
+import metacache
+import state
+from config import Config
+
+# The metadata file is committed with the farm, so saving must be stable:
+# loading and rendering gives back the same bytes, and saving a config nobody
+# changed leaves the file and the git repo alone.
+
+CANONICAL = """\
+[general]
+no-new-files = ["private"]
+no-update-on = ["*.log"]
+metrics-file = "~/metrics/esf.prom"
+group-order-override = ["shell"]
+fsync = "file"
+
+[network]
+retry-delays-ms = 1000
+max-attempts = 3
+retry-backoff = 1.5
+remotes = ["origin", "backup"]
+
+[watch]
+debounce-ms = 500
+
+[notify]
+file = "~/esf.log"
+timeout-ms = 2000
+
+[paths]
+# shell
+"shell/.bashrc" = "~/.bashrc"
+"shell/.zshrc" = "~/.zshrc"
+
+# misc.
+"notes.txt" = "~/notes.txt"
+"""
+
+
+class ConfigStabilityTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.source = Path(self.tmp.name) / "src"
+        self.source.mkdir()
+        env = {
+            "HOME": str(Path(self.tmp.name) / "home"),
+            "easy_sym_source": str(self.source),
+            "easy_sym_meta_name": "esf.toml",
+        }
+        self._saved_env = {key: os.environ.get(key) for key in env}
+        os.environ.update(env)
+        self.addCleanup(self._restore_env)
+        self.path = Config._config_path()
+
+    def _restore_env(self):
+        for key, value in self._saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+    def _git(self, *args: str) -> str:
+        return subprocess.run(
+            ["git", "-C", str(self.source), *args],
+            check=True,
+            capture_output=True,
+            text=True,
+            env={
+                **os.environ,
+                "GIT_AUTHOR_NAME": "test",
+                "GIT_AUTHOR_EMAIL": "test@example.com",
+                "GIT_COMMITTER_NAME": "test",
+                "GIT_COMMITTER_EMAIL": "test@example.com",
+            },
+        ).stdout
+
+    def test_render_round_trips(self):
+        self.path.write_text(CANONICAL)
+        self.assertEqual(Config.load().render(), CANONICAL)
+
+    def test_render_round_trips_from_cache(self):
+        self.path.write_text(CANONICAL)
+        Config.load()
+        self.assertEqual(Config.load().render(), CANONICAL)
+
+    def test_cache_written_by_write_matches_a_fresh_parse(self):
+        self.path.write_text(CANONICAL)
+        config = Config.load()
+        config.update("watch", "poll-interval-ms", "100")
+        config.update("notify", "coalesce-ms", "0")
+        config.add_to_paths("shell/.profile", "~/.profile")
+        config.write()
+
+        cached = Config.load()
+        os.unlink(state.replaced_state_path(metacache.CACHE_KIND))
+        parsed = Config.load()
+        self.assertEqual(cached.render(), parsed.render())
+        self.assertEqual(cached.render(), self.path.read_text())
+        self.assertEqual(dict(cached.paths), dict(parsed.paths))
+
+    def test_defaults_round_trip(self):
+        Config.load().write()
+        rendered = self.path.read_text()
+        self.assertEqual(Config.load().render(), rendered)
+
+    def test_noop_write_leaves_file_and_repo_alone(self):
+        self.path.write_text(CANONICAL)
+        self._git("init", "-q")
+        self._git("add", "esf.toml")
+        self._git("commit", "-q", "-m", "config")
+        config = Config.load()
+        before = os.stat(self.path)
+        status = self._git("status", "--porcelain")
+
+        config.write()
+
+        after = os.stat(self.path)
+        self.assertEqual(after.st_ino, before.st_ino)
+        self.assertEqual(after.st_mtime_ns, before.st_mtime_ns)
+        self.assertEqual(self._git("status", "--porcelain"), status)
+
+    def test_unknown_fsync_policy_is_rejected(self):
+        self.path.write_text('[general]\nfsync = "ful"\n')
+        with self.assertRaises(ValueError):
+            Config.load()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+import os
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+from typing import Optional
+
+from git_wrapper import GitWrapper, StatusChangeType
+from patterns import PatternSet
+
+# GitWrapper.changes parses `git status --porcelain=v2 -z` as it streams in,
+# so paths are taken verbatim, renames and copies take the record after them,
+# and records can be split across pipe reads.
+
+GIT_IDENTITY = {
+    "GIT_AUTHOR_NAME": "test",
+    "GIT_AUTHOR_EMAIL": "test@example.com",
+    "GIT_COMMITTER_NAME": "test",
+    "GIT_COMMITTER_EMAIL": "test@example.com",
+}
+
+
+class ChangesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.repo = Path(self.tmp.name)
+        self._git("init", "-q")
+        # without this git reports copies as plain additions
+        self._git("config", "status.renames", "copies")
+        self.git = GitWrapper(self.repo)
+
+    def _git(self, *args: str) -> None:
+        subprocess.run(
+            ["git", *args],
+            cwd=self.repo,
+            check=True,
+            capture_output=True,
+            env={**os.environ, **GIT_IDENTITY},
+        )
+
+    def _write(self, name: str, content: str) -> None:
+        path = self.repo / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+    def _commit(self, *names: str) -> None:
+        for name in names:
+            self._write(name, "".join(f"line {i}\n" for i in range(50)))
+        self._git("add", "-A")
+        self._git("commit", "-q", "-m", "base")
+
+    def _changes(self, **kwargs) -> dict[str, tuple[StatusChangeType, Optional[str]]]:
+        return {
+            change.relative_path: (change.change_type, change.original_path)
+            for change in self.git.changes(**kwargs)
+        }
+
+    def test_clean_tree_has_no_changes(self):
+        self._commit("notes.txt")
+        self.assertEqual(self.git.changes(), [])
+        self.assertFalse(self.git.has_changes())
+
+    def test_change_types(self):
+        self._commit("kept.txt", "edited.txt", "gone.txt")
+        self._write("edited.txt", "new\n")
+        self._write("staged.txt", "new\n")
+        self._git("add", "staged.txt")
+        os.unlink(self.repo / "gone.txt")
+        self._write("untracked.txt", "new\n")
+
+        self.assertEqual(
+            self._changes(),
+            {
+                "edited.txt": (StatusChangeType.MODIFIED, None),
+                "staged.txt": (StatusChangeType.ADDED, None),
+                "gone.txt": (StatusChangeType.REMOVED, None),
+                "untracked.txt": (StatusChangeType.ADDED, None),
+            },
+        )
+
+    def test_rename_carries_the_original_path(self):
+        self._commit("old name.txt")
+        (self.repo / "dir with space").mkdir()
+        self._git("mv", "old name.txt", "dir with space/new name.txt")
+
+        self.assertEqual(
+            self._changes(),
+            {
+                "dir with space/new name.txt": (
+                    StatusChangeType.RENAMED,
+                    "old name.txt",
+                )
+            },
+        )
+
+    def test_copy_carries_the_original_path(self):
+        self._commit("a file.txt")
+        # git only looks for copies of files that changed in the same commit
+        (self.repo / "a file.txt").write_text(
+            (self.repo / "a file.txt").read_text() + "more\n"
+        )
+        self._write("copy of a.txt", "".join(f"line {i}\n" for i in range(50)))
+        self._git("add", "-A")
+
+        changes = self._changes()
+        self.assertEqual(
+            changes["copy of a.txt"], (StatusChangeType.RENAMED, "a file.txt")
+        )
+        self.assertEqual(changes["a file.txt"], (StatusChangeType.MODIFIED, None))
+
+    def test_paths_are_taken_verbatim(self):
+        self._commit("base.txt")
+        names = [
+            "with space.txt",
+            "tab\there.txt",
+            "new\nline.txt",
+            'quote".txt',
+            "é.txt",
+        ]
+        for name in names:
+            self._write(name, "x\n")
+
+        self.assertEqual(set(self._changes()), set(names))
+
+    def test_records_split_across_reads(self):
+        self._commit("base.txt")
+        # well over one 64KiB pipe read
+        names = [f"untracked/{'x' * 60}-{i:05}.txt" for i in range(1500)]
+        for name in names:
+            self._write(name, "")
+        self._git("config", "status.showUntrackedFiles", "all")
+
+        self.assertEqual(sorted(self._changes()), names)
+
+    def test_ignored_patterns_are_skipped(self):
+        self._commit("base.txt")
+        self._write("cache/a.tmp", "")
+        self._write("notes.txt", "")
+        self._git("config", "status.showUntrackedFiles", "all")
+
+        changes = self._changes(ignored_glob_patterns=PatternSet(["cache/*"]))
+        self.assertEqual(set(changes), {"notes.txt"})
+        self.assertFalse(self.git.has_changes(["cache/*", "notes.txt"]))
+
+    def test_stop_at_first_returns_one_change(self):
+        self._commit("base.txt")
+        for i in range(20):
+            self._write(f"new-{i}.txt", "")
+
+        changes = self.git.changes(stop_at_first=True)
+        self.assertEqual(len(changes), 1)
+        self.assertTrue(changes[0].relative_path.startswith("new-"))
+
+
+if __name__ == "__main__":
+    unittest.main()
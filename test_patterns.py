@@ -0,0 +1,105 @@
+import fnmatch
+import unittest
+
+from patterns import PatternSet
+
+# PatternSet folds every pattern into one regex and skips it for paths no
+# pattern's literal prefix can match, so it must still agree with fnmatch
+# path by path.
+
+PATHS = [
+    "editors/nvim/init.lua",
+    "editors/.vimrc",
+    "editorsbackup",
+    "shell/.bashrc",
+    "shell/.bashrc.bak",
+    "notes.txt",
+    "notes.txt.orig",
+    "logs/today.log",
+    "today.log",
+    "a.log",
+    "b.log",
+    "Notes.txt",
+    "",
+]
+
+
+class PatternSetTest(unittest.TestCase):
+    def assertAgreesWithFnmatch(self, patterns: list[str]) -> None:
+        pattern_set = PatternSet(patterns)
+        for path in PATHS:
+            expected = any(fnmatch.fnmatchcase(path, p) for p in patterns)
+            self.assertEqual(
+                pattern_set.matches(path), expected, f"{patterns!r} on {path!r}"
+            )
+
+    def test_agrees_with_fnmatch(self):
+        for patterns in (
+            ["*.log"],
+            ["editors/*", "shell/*"],
+            ["notes.txt", "*.bak"],
+            ["[ab].log", "notes.tx?"],
+            ["[!a].log"],
+            ["editors/*", "*.orig", "today.log"],
+        ):
+            self.assertAgreesWithFnmatch(patterns)
+
+    def test_patterns_are_anchored_at_both_ends(self):
+        pattern_set = PatternSet(["*.log", "notes.txt", "editors/*"])
+        self.assertFalse(pattern_set.matches("today.log.gz"))
+        self.assertFalse(pattern_set.matches("old/notes.txt"))
+        self.assertFalse(pattern_set.matches("notes.txt.orig"))
+        self.assertFalse(pattern_set.matches("my/editors/x"))
+
+    def test_alternation_does_not_leak_between_patterns(self):
+        # each pattern is anchored on its own, not just the first and last
+        pattern_set = PatternSet(["a*", "*b"])
+        self.assertTrue(pattern_set.matches("axx"))
+        self.assertTrue(pattern_set.matches("xxb"))
+        self.assertFalse(pattern_set.matches("xax"))
+
+    def test_negated_character_class(self):
+        pattern_set = PatternSet(["[!a].log", "shell/[!.]*"])
+        self.assertTrue(pattern_set.matches("b.log"))
+        self.assertFalse(pattern_set.matches("a.log"))
+        self.assertFalse(pattern_set.matches("shell/.bashrc"))
+        self.assertTrue(pattern_set.matches("shell/profile"))
+
+    def test_star_crosses_directories(self):
+        # the same as fnmatch: `*` isn't stopped by `/`
+        self.assertTrue(PatternSet(["editors/*"]).matches("editors/nvim/init.lua"))
+
+    def test_prefix_shortcut_only_rejects_paths_no_prefix_could_match(self):
+        pattern_set = PatternSet(["editors/*", "shell/*.bak"])
+        self.assertTrue(pattern_set.matches("shell/.bashrc.bak"))
+        self.assertFalse(pattern_set.matches("editorsbackup"))
+        self.assertFalse(pattern_set.matches("notes.txt"))
+        # one pattern without a literal prefix means every path is checked
+        self.assertTrue(PatternSet(["editors/*", "*.txt"]).matches("notes.txt"))
+
+    def test_matching_is_case_sensitive(self):
+        self.assertFalse(PatternSet(["notes.txt"]).matches("Notes.txt"))
+        self.assertFalse(PatternSet(["notes.*"]).matches("Notes.txt"))
+
+    def test_empty_set_matches_nothing(self):
+        pattern_set = PatternSet([])
+        self.assertFalse(pattern_set)
+        self.assertFalse(pattern_set.matches("notes.txt"))
+        self.assertEqual(pattern_set.filter(PATHS), [])
+
+    def test_filter_keeps_order_and_duplicates_collapse(self):
+        pattern_set = PatternSet(["*.log", "*.log", "notes.txt"])
+        self.assertEqual(pattern_set.patterns, ["*.log", "notes.txt"])
+        self.assertEqual(
+            pattern_set.filter(PATHS),
+            ["notes.txt", "logs/today.log", "today.log", "a.log", "b.log"],
+        )
+
+    def test_of_reuses_a_pattern_set(self):
+        pattern_set = PatternSet(["*.log"])
+        self.assertIs(PatternSet.of(pattern_set), pattern_set)
+        self.assertFalse(PatternSet.of(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
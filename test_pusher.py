@@ -0,0 +1,107 @@
+import contextlib
+import io
+import os
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+
+from config import Config
+from pusher import Pusher
+
+# Pushing to [network] remotes must not depend on an origin remote, and a
+# remote that a run couldn't reach must still get the commit on the next one.
+
+GIT_IDENTITY = {
+    "GIT_AUTHOR_NAME": "test",
+    "GIT_AUTHOR_EMAIL": "test@example.com",
+    "GIT_COMMITTER_NAME": "test",
+    "GIT_COMMITTER_EMAIL": "test@example.com",
+}
+
+
+class PushRemotesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        root = Path(self.tmp.name)
+        self.source = root / "src"
+        self.source.mkdir()
+        env = {
+            "HOME": str(root / "home"),
+            "XDG_CACHE_HOME": str(root / "cache"),
+            "easy_sym_source": str(self.source),
+            "easy_sym_meta_name": "esf.toml",
+            **GIT_IDENTITY,
+        }
+        self._saved_env = {key: os.environ.get(key) for key in env}
+        os.environ.update(env)
+        self.addCleanup(self._restore_env)
+
+        self.first = root / "first.git"
+        self.second = root / "second.git"
+        self._init(self.source)
+        self._init(self.first, "--bare")
+        for remote in (self.first, self.second):
+            self._git("-C", str(self.source), "remote", "add", remote.stem, str(remote))
+
+        Config._config_path().write_text(
+            '[network]\nmax-attempts = 1\nremotes = ["first", "second"]\n'
+        )
+        (self.source / "notes.txt").write_text("notes\n")
+
+    def _restore_env(self):
+        for key, value in self._saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+    def _git(self, *args: str) -> str:
+        return subprocess.run(
+            ["git", *args],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+
+    def _init(self, repo: Path, *flags: str) -> None:
+        self._git("init", "-q", "-b", "main", *flags, str(repo))
+
+    def _head(self, repo: Path) -> str:
+        return self._git("-C", str(repo), "rev-parse", "main").strip()
+
+    def _push(self) -> Pusher:
+        pusher = Pusher(Config.load())
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(
+            io.StringIO()
+        ):
+            pusher.push()
+        return pusher
+
+    def test_pushes_to_every_remote_without_origin(self):
+        self._init(self.second, "--bare")
+
+        pusher = self._push()
+
+        self.assertEqual(pusher.result, "success")
+        head = self._head(self.source)
+        self.assertEqual(self._head(self.first), head)
+        self.assertEqual(self._head(self.second), head)
+
+    def test_unreached_remote_gets_the_commit_next_run(self):
+        pusher = self._push()
+
+        self.assertEqual(pusher.result, "failed")
+        head = self._head(self.source)
+        self.assertEqual(self._head(self.first), head)
+
+        self._init(self.second, "--bare")
+        pusher = self._push()
+
+        self.assertEqual(pusher.result, "success")
+        self.assertEqual(self._head(self.second), head)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from retry import RetryPolicy, RetryScheduler
+
+# The scheduler takes its clock and sleep as arguments, so these tests run it
+# on a fake clock that only moves when it sleeps or an attempt takes time.
+
+
+class FakeClock:
+    def __init__(self, attempt_ms: float = 0):
+        self.now = 0.0
+        self.attempt_ms = attempt_ms
+        self.sleeps: list[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds * 1000)
+        self.now += seconds
+
+    def attempt(self, value: str):
+        def operation() -> str:
+            self.now += self.attempt_ms / 1000
+            return value
+
+        return operation
+
+
+def _policy(**overrides) -> RetryPolicy:
+    settings = dict(
+        max_attempts=10,
+        base_delay_ms=100,
+        backoff=2.0,
+        max_delay_ms=60000,
+        deadline_ms=60000,
+        jitter=0.0,
+    )
+    settings.update(overrides)
+    return RetryPolicy(**settings)
+
+
+class RetryPolicyTest(unittest.TestCase):
+    def test_backoff_is_exponential_and_capped(self):
+        policy = _policy(max_delay_ms=500)
+        self.assertEqual(
+            [policy.delay_ms(attempt) for attempt in range(1, 6)],
+            [100, 200, 400, 500, 500],
+        )
+
+    def test_jitter_stays_within_its_fraction_of_the_delay(self):
+        policy = _policy(base_delay_ms=1000, jitter=0.5)
+        with mock.patch("retry.random.random", return_value=0.0):
+            self.assertEqual(policy.delay_ms(1), 500)
+        with mock.patch("retry.random.random", return_value=0.999999):
+            self.assertAlmostEqual(policy.delay_ms(1), 1000, places=2)
+        for _ in range(200):
+            self.assertTrue(500 <= policy.delay_ms(1) <= 1000)
+
+    def test_jitter_never_lifts_a_delay_over_the_cap(self):
+        policy = _policy(base_delay_ms=1000, max_delay_ms=1500, jitter=1.0)
+        for _ in range(200):
+            self.assertTrue(0 <= policy.delay_ms(5) <= 1500)
+
+
+class RetrySchedulerTest(unittest.TestCase):
+    def _run(self, policy: RetryPolicy, clock: FakeClock, values: list[str]):
+        outcomes = iter(values)
+        scheduler = RetryScheduler(policy, sleep=clock.sleep, clock=clock)
+        return scheduler.run(
+            lambda: clock.attempt(next(outcomes))(),
+            should_retry=lambda value: value == "network",
+        )
+
+    def test_success_needs_one_attempt(self):
+        result = self._run(_policy(), FakeClock(), ["ok"])
+        self.assertEqual(result.value, "ok")
+        self.assertEqual(len(result.attempts), 1)
+        self.assertIsNone(result.gave_up)
+
+    def test_final_errors_are_not_retried(self):
+        clock = FakeClock()
+        result = self._run(_policy(), clock, ["auth", "ok"])
+        self.assertEqual(result.value, "auth")
+        self.assertEqual(len(result.attempts), 1)
+        self.assertIsNone(result.gave_up)
+        self.assertEqual(clock.sleeps, [])
+
+    def test_retries_until_success(self):
+        clock = FakeClock()
+        result = self._run(_policy(), clock, ["network", "network", "ok"])
+        self.assertEqual(result.value, "ok")
+        self.assertEqual(clock.sleeps, [100, 200])
+        self.assertEqual(
+            [a.outcome for a in result.attempts], ["network", "network", "ok"]
+        )
+
+    def test_gives_up_after_max_attempts(self):
+        clock = FakeClock()
+        result = self._run(_policy(max_attempts=3), clock, ["network"] * 5)
+        self.assertEqual(len(result.attempts), 3)
+        self.assertEqual(result.gave_up, "max retry attempts reached")
+        self.assertEqual(len(clock.sleeps), 2)
+
+    def test_never_sleeps_past_the_deadline(self):
+        clock = FakeClock(attempt_ms=50)
+        policy = _policy(backoff=1.0, base_delay_ms=400, deadline_ms=1000)
+        result = self._run(policy, clock, ["network"] * 10)
+        # attempts end at 50, 500 and 950ms; a third delay would end at 1350ms
+        self.assertEqual(len(result.attempts), 3)
+        self.assertEqual(result.gave_up, "retry deadline reached")
+        self.assertLessEqual(clock.now * 1000, policy.deadline_ms)
+
+    def test_deadline_holds_with_jitter(self):
+        policy = _policy(base_delay_ms=300, backoff=1.5, deadline_ms=2000, jitter=0.5)
+        for _ in range(50):
+            clock = FakeClock(attempt_ms=20)
+            result = self._run(policy, clock, ["network"] * 10)
+            self.assertEqual(result.gave_up, "retry deadline reached")
+            # the deadline bounds sleeping; the last attempt may run past it
+            self.assertLessEqual(result.attempts[-1].started_ms, policy.deadline_ms)
+
+    def test_attempt_timings_are_recorded(self):
+        clock = FakeClock(attempt_ms=30)
+        result = self._run(_policy(), clock, ["network", "ok"])
+        self.assertEqual(
+            [(a.number, a.started_ms, a.duration_ms) for a in result.attempts],
+            [(1, 0, 30), (2, 130, 30)],
+        )
+        self.assertEqual(
+            result.summary(),
+            [
+                "attempt 1: network after 30ms (started at +0ms)",
+                "attempt 2: ok after 30ms (started at +130ms)",
+            ],
+        )
+
+    def test_run_async_retries_the_same_way(self):
+        outcomes = iter(["network", "network", "ok"])
+
+        async def operation() -> str:
+            return next(outcomes)
+
+        scheduler = RetryScheduler(_policy(base_delay_ms=1))
+        result = asyncio.run(
+            scheduler.run_async(
+                operation, should_retry=lambda value: value == "network"
+            )
+        )
+        self.assertEqual(result.value, "ok")
+        self.assertEqual(len(result.attempts), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
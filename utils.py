@@ -1,7 +1,6 @@
 import os
 import sys
 from pathlib import Path
-import shutil
 from typing import Optional
 
 
@@ -42,6 +41,67 @@ def absolute_path(path: str | Path) -> Path:
     return Path(os.path.normpath(str(base)))
 
 
+# how hard atomic_write tries to survive a power loss: not at all, by syncing
+# the new file before the rename, or by also syncing the directory entry
+FSYNC_NONE = "none"
+FSYNC_FILE = "file"
+FSYNC_FULL = "full"
+FSYNC_POLICIES = (FSYNC_NONE, FSYNC_FILE, FSYNC_FULL)
+
+
+def atomic_write(path: Path, data: bytes, fsync: str = FSYNC_NONE) -> None:
+    """
+    Write `data` to a temporary file next to `path` and rename it into place,
+    so readers only ever see the old or the new contents.
+    """
+    tmp_path = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+    try:
+        with open(tmp_path, "wb") as f:
+            try:
+                os.fchmod(f.fileno(), os.stat(path).st_mode & 0o7777)
+            except FileNotFoundError:
+                pass
+            f.write(data)
+            if fsync != FSYNC_NONE:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        suppress_errors(os.unlink, tmp_path)
+        raise
+
+    if fsync == FSYNC_FULL:
+        dir_fd = os.open(path.parent, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def normalize_target(target: str, home: Optional[str] = None) -> str:
+    """
+    String-only equivalent of `str(unexpand_path(absolute_path(target)))`,
+    cheap enough to run for every entry of a large [paths] table.
+    """
+    path = os.path.expanduser(target)
+    if not os.path.isabs(path):
+        path = os.path.join(os.getcwd(), path)
+    path = os.path.normpath(path)
+
+    if home is None:
+        home = str(get_home_dir())
+    if path.startswith(home):
+        return "~" + path[len(home):]
+    return path
+
+
+def link_destination(target: str, link_text: str) -> str:
+    """the path a symlink at `target` reading `link_text` points at, without resolving further"""
+    if not os.path.isabs(link_text):
+        link_text = os.path.join(os.path.dirname(target), link_text)
+    return os.path.normpath(link_text)
+
+
 def suppress_errors(callback, *args, **kwargs):
     """
     Calls `callback` with the given arguments and suppresses all exceptions.
@@ -67,6 +127,8 @@ def delete_path(path: Path) -> None:
     if not path.exists() and not path.is_symlink():
         return  # nothing to delete
 
+    import shutil
+
     if path.is_symlink():
         # Only removes the symlink itself, not the target
         path.unlink()
@@ -0,0 +1,208 @@
+import os
+import select
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+from config import Config
+from fingerprint import compute_fingerprint
+from utils import print_err
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """
+    Watches every directory below the source directory, except .git, with one
+    inotify instance through ctypes. New directories are watched as they appear.
+    """
+
+    def __init__(self, source_dir: Path, ignored_prefix: str):
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.source_dir = str(source_dir)
+        self.ignored_prefix = ignored_prefix
+        self.watches: dict[int, str] = {}
+        self._watch_tree(self.source_dir)
+
+    def _watch_tree(self, root: str) -> None:
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            wd = self._add_watch(self.fd, os.fsencode(directory), _WATCH_MASK)
+            if wd < 0:
+                continue
+            self.watches[wd] = directory
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name == ".git" and directory == self.source_dir:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+
+    def _is_relevant(self, directory: Optional[str], name: str) -> bool:
+        if directory == self.source_dir:
+            return name != ".git" and not name.startswith(self.ignored_prefix)
+        return True
+
+    def wait(self, timeout: Optional[float]) -> bool:
+        """blocks up to `timeout` seconds, True if something in the tree changed"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+
+        data = os.read(self.fd, 64 * 1024)
+        relevant = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                relevant = True
+                continue
+            directory = self.watches.get(wd)
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if not self._is_relevant(directory, name):
+                continue
+            relevant = True
+            if directory and mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(os.path.join(directory, name))
+        return relevant
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Fallback for systems without inotify: compares push fingerprints."""
+
+    def __init__(self, source_dir: Path, interval: float):
+        self.source_dir = source_dir
+        self.interval = interval
+        self.last = compute_fingerprint(source_dir)
+
+    def wait(self, timeout: Optional[float]) -> bool:
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        current = compute_fingerprint(self.source_dir)
+        changed = current != self.last
+        self.last = current
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+def make_watcher(source_dir: Path, poll_interval: float, force_polling: bool = False):
+    if not force_polling:
+        try:
+            return InotifyWatcher(source_dir, f".{Config._config_path().name}.")
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(source_dir, poll_interval)
+
+
+class PushWorker:
+    """
+    Runs the push pipeline on its own thread. Requests made while a push is
+    running collapse into one follow-up push.
+    """
+
+    def __init__(self, push: Callable[[], None]):
+        self.push = push
+        self._requested = threading.Event()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="esf-push", daemon=True)
+        self._thread.start()
+
+    def request(self) -> None:
+        self._requested.set()
+
+    def _run(self) -> None:
+        while True:
+            self._requested.wait()
+            if self._stopping:
+                return
+            self._requested.clear()
+            try:
+                self.push()
+            except SystemExit:
+                pass
+            except Exception as e:
+                print_err(e)
+
+    def stop(self) -> None:
+        self._stopping = True
+        self._requested.set()
+        self._thread.join()
+
+
+def watch(
+    watcher,
+    worker: PushWorker,
+    debounce: float,
+    max_latency: float,
+    clock: Callable[[], float] = time.monotonic,
+) -> None:
+    """
+    Event loop: after the first change, keep absorbing changes until the tree
+    has been quiet for `debounce` seconds or `max_latency` seconds have passed
+    since the first one, then hand one push to the worker.
+    """
+    while True:
+        if not watcher.wait(None):
+            continue
+
+        first = clock()
+        quiet_until = first + debounce
+        while True:
+            timeout = min(quiet_until, first + max_latency) - clock()
+            if timeout <= 0:
+                break
+            if watcher.wait(timeout):
+                quiet_until = clock() + debounce
+        worker.request()